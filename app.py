@@ -2,22 +2,39 @@
 from __future__ import annotations
 
 import os
-import re
-import json
+import hashlib
+import random
+import threading
+import uuid
 import streamlit as st
 import pandas as pd
 
 from tool.ui_common import inject_css, sidebar_brand
+from tool.normalize import normalize_subject, normalize_semester
 from tool.utils import (
-    QTYPE_ORDER, LEVEL_ORDER, LEVEL_NAME,
+    QTYPE_ORDER, LEVEL_ORDER,
     round_to_step, qtype_level_label, parse_qtype_level
 )
-from tool.matrix_template import load_matrix_template, MatrixTemplate, LessonRow
-from tool.question_bank import load_bank_from_upload, Bank
+from tool.matrix_template import MatrixTemplate, LessonRow, matrix_to_editor_df, editor_df_to_matrix
+from tool.allocation import allocate_matrix, allocation_to_editor_df, DEFAULT_LEVEL_MIX
+from tool.template_registry import TemplateRegistry
+from tool.question_bank import load_bank_from_upload, load_bank_from_path, Bank
+from tool.bank_store import BankStore, bank_row, default_root, validate_row
+from tool.draft_store import DraftStore
+from tool.ai_ledger import get_ledger
 from tool.data_loader import load_catalog_csv, try_parse_catalog_from_excel
-from tool.ai_provider import openai_compatible_generate, gemini_ai_studio_generate, AIError
-from tool.export_docx import export_spec_from_template, export_exam_docx
-from tool.catalog_builder import load_or_build_catalog
+from tool.ai_provider import (
+    openai_compatible_generate, gemini_ai_studio_generate, ai_generate, ai_preflight, gemini_models, AIError, BudgetExceeded,
+)
+from tool.generation import build_question_prompt, parse_ai_question
+from tool.export_docx import (
+    export_spec_from_template, export_exam_docx, export_bulk_zip, export_bundle, ExportJob,
+    get_spec_template, warm_export,
+)
+from tool.catalog_builder import load_build_errors, load_or_build_catalog
+from tool.catalog_index import CascadeIndex, prep_catalog
+from tool import profiling
+from tool.profiling import timed
 
 # ---------------- Page ----------------
 st.set_page_config(page_title="Tool HỖ TRỢ RA ĐỀ", layout="wide")
@@ -30,6 +47,8 @@ st.session_state.setdefault("catalog_df", None)
 
 st.session_state.setdefault("draft_items", [])
 st.session_state.setdefault("used_question_ids", set())
+st.session_state.setdefault("_kept", {})
+st.session_state.setdefault("_flash", [])
 
 # Matrix editor state
 st.session_state.setdefault("matrix_editor_df", None)
@@ -53,7 +72,6 @@ SOURCE_DIR = os.path.join(DATA_DIR, "khgd_sources")
 CATALOG_CSV = os.path.join(DATA_DIR, "yccd_catalog.csv")
 
 os.makedirs(DATA_DIR, exist_ok=True)
-os.makedirs("outputs", exist_ok=True)
 
 # ---------------- HERO ----------------
 st.markdown('<div class="app-hero">', unsafe_allow_html=True)
@@ -70,55 +88,127 @@ st.write("")
 
 
 # ---------------- API/AI (moved under title) ----------------
-with st.expander("⚙️ API/AI (để AI tạo câu hỏi) — mở để nhập key & test", expanded=False):
-    c1, c2, c3, c4 = st.columns([1.2, 2.2, 2.2, 1.2], gap="medium")
-    with c1:
-        mode_ui = st.selectbox("Chế độ", ["Tắt", "OpenAI-compatible", "AI Studio (Gemini)"], index=0, key="ai_mode_ui_top")
-        if mode_ui == "Tắt":
-            st.session_state["ai_mode"] = "Tắt"
-        elif mode_ui == "OpenAI-compatible":
-            st.session_state["ai_mode"] = "OpenAI-compatible"
-        else:
-            st.session_state["ai_mode"] = "Gemini"
-    with c2:
-        st.session_state["ai_api_key"] = st.text_input("API Key", type="password", value=st.session_state.get("ai_api_key",""), key="ai_key_top")
-    with c3:
-        if st.session_state["ai_mode"] == "OpenAI-compatible":
-            st.session_state["ai_base_url"] = st.text_input("Base URL", value=st.session_state.get("ai_base_url","https://api.openai.com"), key="ai_base_top")
-            st.session_state["ai_model"] = st.text_input("Model", value=st.session_state.get("ai_model","gpt-4o-mini"), key="ai_model_top")
-        elif st.session_state["ai_mode"] == "Gemini":
-            st.session_state["gemini_model"] = st.text_input("Gemini model", value=st.session_state.get("gemini_model","gemini-2.5-flash"), key="gem_model_top")
-        else:
-            st.caption("Bật AI để tool có thể tạo câu hỏi.")
-    with c4:
-        if st.button("✅ Test API", use_container_width=True):
-            try:
-                if st.session_state["ai_mode"] == "OpenAI-compatible":
-                    out = openai_compatible_generate(
-                        st.session_state.get("ai_base_url","https://api.openai.com"),
-                        st.session_state.get("ai_api_key",""),
-                        st.session_state.get("ai_model","gpt-4o-mini"),
-                        "Trả lời đúng 1 từ: OK",
-                        timeout=25
-                    )
-                elif st.session_state["ai_mode"] == "Gemini":
-                    out = gemini_ai_studio_generate(
-                        st.session_state.get("ai_api_key",""),
-                        st.session_state.get("gemini_model","gemini-2.5-flash"),
-                        "Trả lời đúng 1 từ: OK",
-                        timeout=25
-                    )
-                else:
-                    out = "AI đang tắt."
-                st.success(f"Kết quả: {str(out)[:120]}")
-            except Exception as e:
-                st.error(f"Test lỗi: {e}")
-
-status = "🟢 AI đang bật" if st.session_state.get("ai_mode") != "Tắt" else "⚪ AI đang tắt"
-st.caption(f"{status} — (Nếu muốn AI tạo câu, hãy mở expander ⚙️ ở trên để nhập key.)")
+def _model_label(key: str, name: str) -> str:
+    p = gemini_models.cached_probe(key, name)
+    if p is None:
+        return name
+    if not p.ok:
+        return f"{name} — ❌ lỗi"
+    return f"{name} — ⚡ {p.latency_s:.1f}s" + (" · JSON" if p.json_ok else "")
+
+def _probe_gemini_models(key: str):
+    try:
+        gemini_models.models(key, force=True)
+        probes = gemini_models.probe_all(key)
+    except Exception as e:
+        st.session_state["_gem_probe_err"] = f"Dò model lỗi: {e}"
+        return
+    best = gemini_models.best(key)
+    if best and not any(p.ok and p.model == st.session_state.get("gemini_model") for p in probes):
+        st.session_state["gemini_model"] = best
+        st.session_state.pop("gem_model_pick", None)
+
+def gemini_model_picker(key: str):
+    # model list/probes come from the per-key registry; probing runs in a background thread
+    if key and st.session_state.get("_gem_probed") != hash(key):
+        st.session_state["_gem_probed"] = hash(key)
+        gemini_models.warm(key)
+    names = gemini_models.cached_models(key) if key else []
+    cur = st.session_state.get("gemini_model","gemini-2.5-flash")
+    if names:
+        best = gemini_models.best(key)
+        if cur not in names or (best and "gem_model_pick" not in st.session_state):
+            cur = best or names[0]  # first time the list shows up: default to the fastest working model
+        st.session_state["gemini_model"] = st.selectbox("Gemini model", names, index=names.index(cur),
+                                                        format_func=lambda n: _model_label(key, n), key="gem_model_pick")
+        if best and best != st.session_state["gemini_model"]:
+            st.caption(f"Nhanh nhất: {best}")
+    else:
+        st.session_state["gemini_model"] = st.text_input("Gemini model", value=cur, key="gem_model_top")
+    if key:
+        st.button("🔍 Dò model", help="Liệt kê model của key và thử từng model (độ trễ, JSON).",
+                  on_click=_probe_gemini_models, args=(key,))
+    if st.session_state.get("_gem_probe_err"):
+        st.error(st.session_state.pop("_gem_probe_err"))
+
+def usage_panel():
+    ledger = get_ledger()
+    for w in ledger.warnings:
+        st.warning(f"ai_budgets.json: {w}")
+    school = ledger.school
+    calls, tokens = ledger.used_today(school)
+    b = ledger.budget(school)
+    lim = lambda n: f"/{n:,}" if n else ""
+    st.caption(f"📊 Hôm nay ({school or 'mặc định'}): {calls:,}{lim(b.calls_per_day)} lượt gọi AI • {tokens:,}{lim(b.tokens_per_day)} token")
+    for used, limit in [(calls, b.calls_per_day), (tokens, b.tokens_per_day)]:
+        if limit:
+            st.progress(min(used / limit, 1.0))
+    rows = ledger.summary(school)
+    if rows:
+        st.dataframe(pd.DataFrame(rows).rename(columns={
+            "provider": "Nhà cung cấp", "model": "Model", "calls": "Lượt", "errors": "Lỗi", "parse_fail": "Sai JSON", "hedged": "Gửi kép",
+            "prompt_tokens": "Token vào", "completion_tokens": "Token ra", "cache_hit_pct": "Cache %",
+            "p50_s": "p50 (s)", "p95_s": "p95 (s)",
+        }), hide_index=True, use_container_width=True)
+
+@st.fragment
+def api_panel():
+    with st.expander("⚙️ API/AI (để AI tạo câu hỏi) — mở để nhập key & test", expanded=False):
+        c1, c2, c3, c4 = st.columns([1.2, 2.2, 2.2, 1.2], gap="medium")
+        with c1:
+            mode_ui = st.selectbox("Chế độ", ["Tắt", "OpenAI-compatible", "AI Studio (Gemini)"], index=0, key="ai_mode_ui_top")
+            if mode_ui == "Tắt":
+                st.session_state["ai_mode"] = "Tắt"
+            elif mode_ui == "OpenAI-compatible":
+                st.session_state["ai_mode"] = "OpenAI-compatible"
+            else:
+                st.session_state["ai_mode"] = "Gemini"
+        with c2:
+            st.session_state["ai_api_key"] = st.text_input("API Key", type="password", value=st.session_state.get("ai_api_key",""), key="ai_key_top")
+        with c3:
+            if st.session_state["ai_mode"] == "OpenAI-compatible":
+                st.session_state["ai_base_url"] = st.text_input("Base URL", value=st.session_state.get("ai_base_url","https://api.openai.com"), key="ai_base_top")
+                st.session_state["ai_model"] = st.text_input("Model", value=st.session_state.get("ai_model","gpt-4o-mini"), key="ai_model_top")
+            elif st.session_state["ai_mode"] == "Gemini":
+                gemini_model_picker(st.session_state.get("ai_api_key",""))
+            else:
+                st.caption("Bật AI để tool có thể tạo câu hỏi.")
+        with c4:
+            if st.button("✅ Test API", use_container_width=True):
+                try:
+                    if st.session_state["ai_mode"] == "OpenAI-compatible":
+                        out = openai_compatible_generate(
+                            st.session_state.get("ai_base_url","https://api.openai.com"),
+                            st.session_state.get("ai_api_key",""),
+                            st.session_state.get("ai_model","gpt-4o-mini"),
+                            "Trả lời đúng 1 từ: OK",
+                            timeout=25
+                        )
+                    elif st.session_state["ai_mode"] == "Gemini":
+                        out = gemini_ai_studio_generate(
+                            st.session_state.get("ai_api_key",""),
+                            st.session_state.get("gemini_model","gemini-2.5-flash"),
+                            "Trả lời đúng 1 từ: OK",
+                            timeout=25
+                        )
+                    else:
+                        out = "AI đang tắt."
+                    st.success(f"Kết quả: {str(out)[:120]}")
+                except Exception as e:
+                    st.error(f"Test lỗi: {e}")
+
+        # the school (and so the budget) is fixed by the server (RADETHI_SCHOOL); the teacher name is only a label
+        st.session_state["ai_teacher"] = st.text_input("Giáo viên", value=st.session_state.get("ai_teacher",""), key="ai_teacher_top")
+        usage_panel()
+
+    status = "🟢 AI đang bật" if st.session_state.get("ai_mode") != "Tắt" else "⚪ AI đang tắt"
+    st.caption(f"{status} — (Nếu muốn AI tạo câu, hãy mở expander ⚙️ ở trên để nhập key.)")
+
+api_panel()
 
 
 # ---------------- Helpers ----------------
+GRADES = [1,2,3,4,5]
 DEFAULT_SUBJECTS = ["Tin","Toán","Tiếng Việt","Khoa học","Lịch sử - Địa lý","Đạo đức","Công nghệ","Âm nhạc","Mĩ thuật"]
 
 def _norm_text(x: str) -> str:
@@ -132,152 +222,153 @@ def safe_index(options: list[str], current_value: str) -> int:
         pass
     return 0
 
-def norm_subject(s: str) -> str:
-    s0 = _norm_text(s).lower()
-    mapping = {
-        "tin học": "Tin",
-        "tin": "Tin",
-        "toán": "Toán",
-        "tieng viet": "Tiếng Việt",
-        "tiếng việt": "Tiếng Việt",
-        "khoa học": "Khoa học",
-        "lịch sử và địa lý": "Lịch sử - Địa lý",
-        "lịch sử - địa lý": "Lịch sử - Địa lý",
-        "ls-đl": "Lịch sử - Địa lý",
-        "đạo đức": "Đạo đức",
-        "cong nghe": "Công nghệ",
-        "công nghệ": "Công nghệ",
-        "âm nhạc": "Âm nhạc",
-        "am nhac": "Âm nhạc",
-        "mĩ thuật": "Mĩ thuật",
-        "mi thuat": "Mĩ thuật",
-    }
-    return mapping.get(s0, _norm_text(s))
-
-def norm_semester(s: str) -> str:
-    s0 = _norm_text(s).lower()
-    if not s0:
-        return ""
-    if "hk1" in s0 or "hki" in s0 or "học kì i" in s0 or "hoc ki i" in s0:
-        return "HK1"
-    if "hk2" in s0 or "hkii" in s0 or "học kì ii" in s0 or "hoc ki ii" in s0:
-        return "HK2"
-    if re.search(r"\\b1\\b", s0):
-        return "HK1"
-    if re.search(r"\\b2\\b", s0):
-        return "HK2"
-    return _norm_text(s)
+def _catalog_csv_version() -> str:
+    return f"csv:{os.stat(CATALOG_CSV).st_mtime_ns}" if os.path.exists(CATALOG_CSV) else "empty"
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def get_default_catalog(catalog_version: str) -> pd.DataFrame:
+    # Load CSV already committed; if missing/broken, rebuild from sources (once per process and file version)
+    try:
+        return load_catalog_csv(CATALOG_CSV)
+    except Exception:
+        return load_or_build_catalog(CATALOG_CSV, SOURCE_DIR)[0]  # errors: shown in the data tab
 
 def ensure_catalog_loaded():
     if st.session_state["catalog_df"] is None:
-        # Load CSV already committed; if missing/broken, rebuild from sources
-        try:
-            df = load_catalog_csv(CATALOG_CSV)
-        except Exception:
-            df = load_or_build_catalog(CATALOG_CSV, SOURCE_DIR)
-        st.session_state["catalog_df"] = df
-
-def prep_catalog(df: pd.DataFrame) -> pd.DataFrame:
-    if df is None or df.empty:
-        return pd.DataFrame(columns=["grade","subject","semester","topic","lesson","yccd","grade_norm","subject_norm","semester_norm"])
-    d = df.copy()
-    d["grade_norm"] = pd.to_numeric(d.get("grade", pd.Series([], dtype="float")), errors="coerce").fillna(-1).astype(int)
-    d["subject_norm"] = d.get("subject", "").fillna("").astype(str).map(norm_subject)
-    d["semester_norm"] = d.get("semester", "").fillna("").astype(str).map(norm_semester)
-    for c in ["topic","lesson","yccd"]:
-        d[c] = d.get(c, "").fillna("").astype(str).map(_norm_text)
-    return d
-
-def cascade_filter(cat: pd.DataFrame, grade: int, subject: str, semester: str) -> pd.DataFrame:
-    subj = norm_subject(subject)
-    sem = norm_semester(semester)
-    d1 = cat[(cat["grade_norm"] == int(grade)) | (cat["grade_norm"] == -1)]
-    d2 = d1[(d1["subject_norm"].str.lower() == subj.lower()) | (d1["subject_norm"].str.strip() == "")]
-    d3 = d2[(d2["semester_norm"].str.upper() == sem.upper()) | (d2["semester_norm"].str.strip() == "")]
-    return d3
+        version = _catalog_csv_version()
+        st.session_state["catalog_df"] = get_default_catalog(version)
+        st.session_state["catalog_version"] = version
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def get_cascade_index(catalog_version: str, _df: pd.DataFrame) -> CascadeIndex:
+    # compiled once per catalog version, shared by all sessions
+    return CascadeIndex.build(prep_catalog(_df))
 
 def reset_if_sig_changed(sig_key: str, sig_value, keys_to_clear: list[str]):
     if st.session_state.get(sig_key) != sig_value:
         for k in keys_to_clear:
             if k in st.session_state:
                 del st.session_state[k]
+            st.session_state["_kept"].pop(k, None)
         st.session_state[sig_key] = sig_value
 
+# Widgets of a tab that is not rendered lose their state; keep the last value aside and
+# feed it back as the widget default when the tab shows up again.
+def kept(key: str, default):
+    return st.session_state.get(key, st.session_state["_kept"].get(key, default))
+
+def keep(key: str, value):
+    st.session_state["_kept"][key] = value
+    return value
+
+# Messages that must survive the st.rerun() after an action (shown in the region that raised them)
+def flash(kind: str, text: str, area: str):
+    st.session_state["_flash"].append((area, kind, text))
+
+def show_flash(area: str):
+    rest = []
+    for a, kind, text in st.session_state["_flash"]:
+        if a == area:
+            getattr(st, kind)(text)
+        else:
+            rest.append((a, kind, text))
+    st.session_state["_flash"] = rest
+
+@st.cache_resource(show_spinner=False)
+def get_template_registry() -> TemplateRegistry:
+    return TemplateRegistry(TEMPLATE_DIR)
+
 def list_template_xlsx() -> list[str]:
-    if not os.path.isdir(TEMPLATE_DIR):
-        return []
-    return [f for f in os.listdir(TEMPLATE_DIR) if f.lower().endswith(".xlsx")]
+    return [os.path.basename(p) for p in get_template_registry().paths()]
 
 def list_template_docx() -> list[str]:
     if not os.path.isdir(TEMPLATE_DIR):
         return []
     return [f for f in os.listdir(TEMPLATE_DIR) if f.lower().endswith(".docx")]
 
-def pick_best_matrix_template(grade: int, subject: str, semester: str) -> str | None:
-    files = list_template_xlsx()
-    if not files:
+@st.cache_resource(show_spinner=False, max_entries=2)
+def get_default_bank(path: str, mtime_ns: int) -> Bank | None:
+    bank = load_bank_from_path(path)
+    ok, _ = bank.validate()
+    return bank if ok else None
+
+def default_bank() -> Bank | None:
+    """Bank preloaded for every session when RADETHI_BANK points at a CSV/XLSX."""
+    path = os.environ.get("RADETHI_BANK", "")
+    if not path or not os.path.exists(path):
         return None
-    best = None
-    best_score = -1
-    for f in files:
-        p = os.path.join(TEMPLATE_DIR, f)
-        try:
-            mx = load_matrix_template(p, total_points=10.0)
-            score = 0
-            if mx.grade == int(grade):
-                score += 3
-            if (mx.subject or "").lower() == norm_subject(subject).lower():
-                score += 3
-            if (mx.semester or "").upper() == norm_semester(semester).upper():
-                score += 2
-            if score > best_score:
-                best_score = score
-                best = p
-        except Exception:
-            continue
-    return best
-
-def matrix_to_editor_df(mx: MatrixTemplate) -> pd.DataFrame:
-    rows = []
-    for lr in mx.lessons:
-        r = {
-            "TT": lr.tt,
-            "Chủ đề": lr.topic,
-            "Bài": lr.lesson,
-            "Số tiết": lr.periods,
-        }
-        for q in QTYPE_ORDER:
-            for lv in LEVEL_ORDER:
-                r[qtype_level_label(q, lv)] = int(lr.counts.get((q, lv), 0))
-        rows.append(r)
-    return pd.DataFrame(rows)
-
-def editor_df_to_matrix(mx: MatrixTemplate, df_ed: pd.DataFrame) -> MatrixTemplate:
-    # apply edited counts back to matrix in-memory (do not write file)
-    lookup = {int(r.tt): r for r in mx.lessons}
-    for _, row in df_ed.iterrows():
-        try:
-            tt = int(row.get("TT"))
-        except Exception:
-            continue
-        lr = lookup.get(tt)
-        if not lr:
-            continue
-        for q in QTYPE_ORDER:
-            for lv in LEVEL_ORDER:
-                col = qtype_level_label(q, lv)
-                v = row.get(col, 0)
+    return get_default_bank(path, os.stat(path).st_mtime_ns)
+
+@st.cache_resource(show_spinner=False)
+def get_ai_store() -> BankStore:
+    """Accepted AI questions, persisted under data/ai_bank (or RADETHI_AI_BANK_DIR); one per process."""
+    return BankStore(default_root())
+
+@st.cache_resource(show_spinner=False)
+def warm_up() -> threading.Thread:
+    """Once per process: pay catalog/template/bank loading and the python-docx/openpyxl
+    imports in a background thread, so teachers' clicks hit warm caches."""
+    def run():
+        with timed("warmup"):
+            get_template_registry().refresh(force=True)
+            version = _catalog_csv_version()
+            get_cascade_index(version, get_default_catalog(version))
+            default_bank()
+            get_ai_store()
+            for name in list_template_docx():
                 try:
-                    lr.counts[(q, lv)] = int(float(v))
+                    get_spec_template(os.path.join(TEMPLATE_DIR, name))
                 except Exception:
-                    lr.counts[(q, lv)] = 0
-    return mx
+                    pass  # broken template: reported when a teacher exports with it
+            warm_export()
+    t = threading.Thread(target=run, name="radethi-warmup", daemon=True)
+    t.start()
+    return t
+
+warm_up()
+if not st.session_state.get("_bank_seeded"):
+    st.session_state["_bank_seeded"] = True
+    if st.session_state["bank"] is None:
+        st.session_state["bank"] = default_bank()
+
+# ---------------- Draft autosave ----------------
+@st.cache_resource(show_spinner=False)
+def get_draft_store() -> DraftStore:
+    return DraftStore(os.environ.get("RADETHI_DRAFT_DB", os.path.join(DATA_DIR, "drafts.sqlite")))
+
+def draft_id() -> str:
+    # kept in the URL (?draft=...), so a refresh or reconnect finds the same draft
+    did = st.query_params.get("draft") or st.session_state.get("_draft_id") or uuid.uuid4().hex[:16]
+    if st.query_params.get("draft") != did:
+        st.query_params["draft"] = did
+    st.session_state["_draft_id"] = did
+    return did
+
+def autosave_draft():
+    # only items that changed since the last call are written (DraftStore.sync)
+    try:
+        get_draft_store().sync(draft_id(), st.session_state["draft_items"])
+    except Exception:
+        pass  # autosave must never break the page; failures show up in the diagnostics panel
+
+if not st.session_state.get("_draft_restored"):
+    st.session_state["_draft_restored"] = True
+    restored = get_draft_store().load(draft_id())
+    if restored and not st.session_state["draft_items"]:
+        st.session_state["draft_items"] = restored
+        st.session_state["used_question_ids"] = {str(x["question_id"]) for x in restored if x.get("question_id")}
+        flash("info", f"Đã khôi phục bản nháp ({len(restored)} câu).", "draft")
 
-# ---------------- Tabs ----------------
-tab_soande, tab_dulieu, tab_xuat = st.tabs(["🧩 Soạn đề", "📚 Dữ liệu", "📤 Xuất Word"])
+@timed("template.pick_best")
+def pick_best_matrix_template(grade: int, subject: str, semester: str) -> str | None:
+    return get_template_registry().best(grade, subject, semester)
+
+# ---------------- Tabs (lazy: only the active tab runs) ----------------
+TABS = ["🧩 Soạn đề", "📚 Dữ liệu", "📤 Xuất Word"]
+active_tab = st.radio("Trang", TABS, horizontal=True, key="active_tab", label_visibility="collapsed")
 
 # ================= TAB: DATA =================
-with tab_dulieu:
+def render_data_tab():
     st.subheader("Nạp dữ liệu (YCCĐ + Kho câu hỏi)")
     st.info("Bạn có thể upload lại YCCĐ (CSV/XLSX) để thay thế dữ liệu đã nạp sẵn trong tool.")
 
@@ -286,13 +377,16 @@ with tab_dulieu:
     with col1:
         st.markdown("### 1) YCCĐ (Chủ đề – Bài – YCCĐ)")
         upl = st.file_uploader("Upload file YCCĐ (CSV/XLSX)", type=["csv","xlsx","xls"], key="upl_yccd")
+        merge = st.checkbox("Gộp mọi sheet có cột Chủ đề/Bài/YCCĐ", value=False, key="yccd_merge",
+                            help="Tắt: chỉ lấy sheet khớp đầu tiên.")
         if upl is not None:
             try:
                 if upl.name.lower().endswith(".csv"):
                     df = pd.read_csv(upl)
                 else:
-                    df = try_parse_catalog_from_excel(upl)
+                    df = try_parse_catalog_from_excel(upl, merge=merge)
                 st.session_state["catalog_df"] = df
+                st.session_state["catalog_version"] = "upload:" + hashlib.sha1(upl.getvalue()).hexdigest()
                 os.makedirs(DATA_DIR, exist_ok=True)
                 df.to_csv(CATALOG_CSV, index=False, encoding="utf-8-sig")
                 st.success("✅ Đã nạp YCCĐ và lưu lại data/yccd_catalog.csv (trong môi trường chạy).")
@@ -307,6 +401,11 @@ with tab_dulieu:
                 st.dataframe(df.head(250), use_container_width=True, height=320)
             else:
                 st.warning("Chưa có dữ liệu YCCĐ.")
+        build_errors = load_build_errors(SOURCE_DIR)
+        if build_errors:
+            st.warning(f"Lần dựng YCCĐ gần nhất bỏ qua {len(build_errors)} file nguồn KHGD lỗi:")
+            for name, err in sorted(build_errors.items()):
+                st.write(f"- `{name}`: {err}")
 
     with col2:
         st.markdown("### 2) Kho câu hỏi (không bắt buộc)")
@@ -329,80 +428,185 @@ with tab_dulieu:
             st.caption("Bạn có thể chạy hoàn toàn bằng AI nếu không có kho.")
 
 # ================= TAB: SOẠN ĐỀ =================
-with tab_soande:
-    ensure_catalog_loaded()
-    cat_prepped = prep_catalog(st.session_state["catalog_df"])
-
-    st.subheader("Thiết lập đề")
+# Regions below are st.fragment: a widget change inside one reruns only that region.
+# Actions that change draft_items trigger one full rerun so the list/summary refresh.
+
+def _new_item(qno, topic, lesson, yccd, qtype, level, points, qid, payload: dict) -> dict:
+    return {
+        "qno": qno,
+        "topic": topic,
+        "lesson": lesson,
+        "yccd": yccd,
+        "qtype": qtype,
+        "level": int(level),
+        "points": float(points),
+        "question_id": qid,
+        "stem": payload.get("stem",""),
+        "options": payload.get("options",""),
+        "answer": payload.get("answer",""),
+        "marking_guide": payload.get("marking_guide",""),
+    }
 
-    top = st.columns([1.0, 1.25, 1.0, 1.0, 1.2])
+def _bank_df(grade: int, subject: str, semester: str):
+    # teacher's own bank first, then accepted AI questions shared by everyone on this server
+    bank: Bank | None = st.session_state["bank"]
+    g, s, h = int(grade), normalize_subject(subject), normalize_semester(semester)
+    parts = [bank.filtered(g, s, h)] if bank is not None else []
+    ai = get_ai_store().filtered(g, s, h)
+    if not ai.empty:
+        parts.append(ai)
+    if not parts:
+        return None
+    return pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
 
-    with top[0]:
-        grade = st.selectbox("Lớp", [1,2,3,4,5], index=2, key="grade_sel")
+def _accept_ai(grade: int, subject: str, semester: str, item: dict) -> dict | None:
+    """AI bank row (content-hash question_id) for a valid AI question, None if it does not validate."""
+    row = bank_row(grade, subject, semester, item)
+    if validate_row(row):
+        return None
+    st.session_state["used_question_ids"].add(row["question_id"])
+    return row
 
-    # Subjects depend on grade (incl. wildcard grade=-1)
-    d_grade = cat_prepped[(cat_prepped["grade_norm"]==int(grade)) | (cat_prepped["grade_norm"]==-1)]
-    dyn_subjects = sorted([s for s in d_grade["subject_norm"].dropna().astype(str).unique().tolist() if s.strip()])
-    subject_options = []
-    for s in DEFAULT_SUBJECTS + dyn_subjects:
-        s = _norm_text(s)
-        if s and s not in subject_options:
-            subject_options.append(s)
+@timed("bank.pick")
+def pick_from_bank(bank_df, topic_: str, lesson_: str, qtype_: str, level_: int, yccd_: str):
+    if bank_df is None or bank_df.empty:
+        return None, {}
+    sub = bank_df[
+        (bank_df["topic"].astype(str)==str(topic_)) &
+        (bank_df["lesson"].astype(str)==str(lesson_)) &
+        (bank_df["qtype"].astype(str).str.upper()==qtype_) &
+        (bank_df["tt27_level"].astype(int)==int(level_))
+    ]
+    if yccd_:
+        sub2 = sub[sub["yccd"].astype(str)==str(yccd_)]
+        if not sub2.empty:
+            sub = sub2
+    if sub.empty:
+        return None, {}
+    used = set(st.session_state.get("used_question_ids", set()))
+    for _, r in sub.iterrows():
+        qid = str(r.get("question_id",""))
+        if qid and qid not in used:
+            used.add(qid)
+            st.session_state["used_question_ids"] = used
+            return qid, {
+                "stem": str(r.get("stem","")),
+                "options": str(r.get("options","")),
+                "answer": str(r.get("answer","")),
+                "marking_guide": str(r.get("marking_guide","")),
+                "yccd": str(r.get("yccd","")),
+            }
+    return None, {}
 
-    with top[1]:
-        reset_if_sig_changed("sig_grade", int(grade), ["subject_sel","semester_sel","topic_sel","lesson_sel","yccd_sel","yccd_free"])
-        subject = st.selectbox("Môn", subject_options, index=safe_index(subject_options, st.session_state.get("subject_sel","Tin")), key="subject_sel")
+def _build_items_from_matrix(cidx: CascadeIndex, grade: int, subject: str, semester: str,
+                             mx_local: MatrixTemplate, df_local: pd.DataFrame, replace: bool):
+    # Apply edits to matrix
+    mx_local = editor_df_to_matrix(mx_local, df_local)
 
-    # Semesters depend on grade+subject (incl. wildcard blank)
-    d_gs = d_grade[(d_grade["subject_norm"].str.lower()==norm_subject(subject).lower()) | (d_grade["subject_norm"].str.strip()=="")]
-    dyn_semesters = sorted([s for s in d_gs["semester_norm"].dropna().astype(str).unique().tolist() if s.strip()])
-    sem_options = ["HK1","HK2"]
-    for s in dyn_semesters:
-        if s not in sem_options:
-            sem_options.append(s)
+    if replace:
+        st.session_state["draft_items"] = []
+        st.session_state["used_question_ids"] = set()
 
-    with top[2]:
-        reset_if_sig_changed("sig_subject", norm_subject(subject).lower(), ["semester_sel","topic_sel","lesson_sel","yccd_sel","yccd_free"])
-        semester = st.selectbox("Học kì", sem_options, index=safe_index(sem_options, st.session_state.get("semester_sel","HK1")), key="semester_sel")
-
-    with top[3]:
-        exam_type = st.selectbox("Loại KT", ["GK","CKI","CKII"], index=1)
+    # yccd per (topic, lesson)
+    ymap = cidx.view(int(grade), subject, semester).yccd_rows
+    bank_df = _bank_df(grade, subject, semester)
 
-    with top[4]:
-        total_points = st.number_input("Tổng điểm", min_value=1.0, max_value=20.0, value=10.0, step=0.25)
+    pts = st.session_state["points_per_qtype"]
+    items = st.session_state["draft_items"]
+    next_qno = 1 if not items else max(int(x.get("qno",0)) for x in items) + 1
+
+    added = 0
+    for lr in mx_local.lessons:
+        t = lr.topic
+        l = lr.lesson
+        ylist = ymap.get((str(t), str(l)), [])
+        yidx = 0
+        for q in QTYPE_ORDER:
+            for lv in LEVEL_ORDER:
+                cnt = int(lr.counts.get((q, lv), 0) or 0)
+                for _ in range(cnt):
+                    yccd_pick = ""
+                    if ylist:
+                        yccd_pick = ylist[yidx % len(ylist)]
+                        yidx += 1
+
+                    qid, payload = pick_from_bank(bank_df, t, l, q, lv, yccd_pick)
+                    items.append(_new_item(next_qno, t, l, yccd_pick or payload.get("yccd",""), q, lv,
+                                           pts.get(q, 0.25), qid, payload))
+                    next_qno += 1
+                    added += 1
+
+    st.session_state["draft_items"] = items
+    return added
+
+def _ai_fill_missing(grade: int, subject: str, semester: str, limit_n: int):
+    if limit_n <= 0:
+        return 0
+    mode = st.session_state.get("ai_mode","Tắt")
+    if mode == "Tắt":
+        flash("warning", "AI đang tắt. Mở ⚙️ API/AI dưới tiêu đề để bật và nhập key.", "matrix")
+        return 0
 
-    
-    # ================== MATRIX (hidden by default) ==================
-    st.markdown("### Tạo đề theo ma trận (ẩn bảng — chỉ mở khi cần chỉnh)")
-    mtx_path = pick_best_matrix_template(int(grade), subject, semester)
+    items = st.session_state.get("draft_items", [])
+    missing_idx = [i for i,x in enumerate(items) if not str(x.get("stem","")).strip()]
+    if not missing_idx:
+        flash("info", "Không có câu trống để AI tạo.", "matrix")
+        return 0
 
-    mx = None
-    if not mtx_path:
-        st.info("Không có template ma trận cho lựa chọn hiện tại. Bạn vẫn có thể soạn theo luồng Chủ đề → Bài → YCCĐ và dùng AI tạo câu.")
-    else:
+    try:
+        ai_preflight(st.session_state)
+    except AIError as e:
+        flash("error", f"Chưa chạy AI: {e}", "matrix")
+        return 0
+
+    todo = missing_idx[:limit_n]
+    prog = st.progress(0.0, text="AI đang tạo câu...")
+    done = 0
+
+    for k, i in enumerate(todo, start=1):
+        x = items[i]
+        qtype_ = x.get("qtype","MCQ")
+        lv = int(x.get("level",1))
+        pts_one = float(x.get("points",0.25))
+        prompt = build_question_prompt(
+            grade, subject, semester, x.get('topic',''), x.get('lesson',''), x.get('yccd',''),
+            qtype_, lv, pts_one,
+        )
         try:
-            mx = load_matrix_template(mtx_path, total_points=float(total_points))
+            x.update(ai_generate(st.session_state, prompt, timeout=45, parse=parse_ai_question,
+                                 meta={"grade": grade, "subject": subject, "semester": semester,
+                                       "lesson": x.get("lesson",""), "qtype": qtype_, "level": lv}))
+            row = _accept_ai(grade, subject, semester, x)
+            if row:
+                x["question_id"] = row["question_id"]
+                # stored right away: a rerun/stop (BaseException) at the next progress call ends the loop
+                get_ai_store().add([row])
+            elif not x.get("question_id"):
+                x["question_id"] = f"AI_{grade}_{normalize_subject(subject)}_{normalize_semester(semester)}_{qtype_}_M{lv}_{x.get('qno',0):03d}"
+            done += 1
+        except BudgetExceeded as e:
+            flash("warning", str(e), "matrix")
+            break
         except Exception as e:
-            mx = None
-            st.error(f"Lỗi đọc ma trận: {e}")
-
-    # Init editor df when switching grade/subject/semester or first load
-    sig = (int(grade), norm_subject(subject), norm_semester(semester), os.path.basename(mtx_path) if mtx_path else "")
-    if mx is not None:
-        if st.session_state.get("matrix_sig") != sig or st.session_state.get("matrix_editor_df") is None:
-            st.session_state["matrix_editor_df"] = matrix_to_editor_df(mx)
-            st.session_state["matrix_sig"] = sig
-
+            # keep blank; continue
+            x["marking_guide"] = f"(AI lỗi: {e})"
+        autosave_draft()  # each paid generation is on disk before the next call
+        prog.progress(k/len(todo), text=f"AI đang tạo câu... {k}/{len(todo)}")
+    st.session_state["draft_items"] = items
+    return done
+
+@st.fragment
+def matrix_panel(cidx: CascadeIndex, grade: int, subject: str, semester: str, total_points: float, mx: MatrixTemplate | None):
     df_ed = st.session_state.get("matrix_editor_df")
     df_new = df_ed
 
     # Compact controls (no big table)
     cc1, cc2, cc3, cc4, cc5 = st.columns([1.2, 1.2, 1.8, 1.8, 1.2], gap="small")
     with cc1:
-        show_matrix = st.toggle("Hiện bảng ma trận", value=False)
+        show_matrix = keep("show_matrix", st.toggle("Hiện bảng ma trận", value=kept("show_matrix", False), key="show_matrix"))
     with cc2:
-        ai_batch = int(st.number_input("AI tạo/lượt", min_value=0, max_value=50, value=10, step=1,
-                                       help="Để tránh lag/time-out, AI sẽ tạo tối đa N câu trống mỗi lần bấm."))
+        ai_batch = int(keep("ai_batch", st.number_input("AI tạo/lượt", min_value=0, max_value=50, value=int(kept("ai_batch", 10)), step=1, key="ai_batch",
+                                                        help="Để tránh lag/time-out, AI sẽ tạo tối đa N câu trống mỗi lần bấm.")))
     with cc3:
         replace_by_matrix = st.button("⚡ Tạo mới theo ma trận", use_container_width=True, disabled=(mx is None or df_new is None))
     with cc4:
@@ -413,6 +617,38 @@ with tab_soande:
     # Optional: show editable matrix in expander
     if show_matrix and mx is not None and df_ed is not None:
         with st.expander("🧩 Bảng ma trận (GV chỉnh số câu theo ô) — có thể kéo ngang", expanded=True):
+            # ---- Tự phân bổ số câu theo số tiết + tỉ lệ mức TT27 ----
+            ac = st.columns([1.3, 2.0, 3.2], gap="small")
+            with ac[0]:
+                auto_alloc = keep("auto_alloc", st.toggle("🤖 Tự phân bổ theo số tiết", value=kept("auto_alloc", False), key="auto_alloc",
+                                                          help="Tự chia số câu cho từng bài theo tỉ lệ số tiết, bước 0,25 điểm."))
+            with ac[1]:
+                # one range slider: its two handles split 100% into Biết | Hiểu | Vận dụng, so the shares always sum to 100
+                cut_default = (round(DEFAULT_LEVEL_MIX[1] * 100), round((DEFAULT_LEVEL_MIX[1] + DEFAULT_LEVEL_MIX[2]) * 100))
+                cut1, cut2 = keep("level_cuts", st.slider("Tỉ lệ mức (%): Biết | Hiểu | Vận dụng", 0, 100, kept("level_cuts", cut_default), 5,
+                                                          key="level_cuts", disabled=not auto_alloc))
+                mix_m1, mix_m2 = cut1, cut2 - cut1
+                st.caption(f"Biết {mix_m1}% • Hiểu {mix_m2}% • Vận dụng {100 - cut2}%")
+            with ac[2]:
+                lcols = st.columns(5, gap="small")
+                qtype_limits = {}
+                for q, lc in zip(QTYPE_ORDER, lcols):
+                    with lc:
+                        qtype_limits[q] = int(keep(f"alloc_max_{q}", st.number_input(f"Tối đa {q}", 0, 60, int(kept(f"alloc_max_{q}", 20)), 1,
+                                                                                     key=f"alloc_max_{q}", disabled=not auto_alloc)))
+            if auto_alloc:
+                alloc = allocate_matrix(
+                    mx, st.session_state["points_per_qtype"],
+                    level_mix={1: mix_m1 / 100, 2: mix_m2 / 100, 3: (100 - mix_m1 - mix_m2) / 100},
+                    qtype_limits=qtype_limits, total_points=float(total_points),
+                )
+                df_ed = allocation_to_editor_df(df_ed, alloc)
+                st.session_state["matrix_editor_df"] = df_ed
+                st.caption(
+                    f"Tổng: {alloc.total:g}/{float(total_points):g} điểm • lệch so với tỉ lệ tiết: {alloc.deviation:g} • "
+                    + " • ".join(f"M{lv}: {alloc.level_points[lv]:g}đ" for lv in LEVEL_ORDER)
+                )
+
             col_cfg = {
                 "TT": st.column_config.NumberColumn("TT", disabled=True),
                 "Chủ đề": st.column_config.TextColumn("Chủ đề", disabled=True),
@@ -433,185 +669,28 @@ with tab_soande:
             )
             st.session_state["matrix_editor_df"] = df_new
 
-    def _build_items_from_matrix(mx_local: MatrixTemplate, df_local: pd.DataFrame, replace: bool):
-        # Apply edits to matrix
-        mx_local = editor_df_to_matrix(mx_local, df_local)
-
-        if replace:
-            st.session_state["draft_items"] = []
-            st.session_state["used_question_ids"] = set()
-
-        ensure_catalog_loaded()
-        filtered = cascade_filter(cat_prepped, int(grade), subject, semester)
-
-        # index yccd per (topic, lesson)
-        ymap = {}
-        if not filtered.empty:
-            for (t, l), gdf in filtered.groupby(["topic","lesson"]):
-                ymap[(str(t), str(l))] = gdf["yccd"].dropna().astype(str).tolist()
-
-        bank: Bank | None = st.session_state["bank"]
-        bank_df = bank.filtered(int(grade), norm_subject(subject), norm_semester(semester)) if bank is not None else None
-
-        def pick_from_bank(topic_: str, lesson_: str, qtype_: str, level_: int, yccd_: str):
-            if bank_df is None or bank_df.empty:
-                return None, {}
-            sub = bank_df[
-                (bank_df["topic"].astype(str)==str(topic_)) &
-                (bank_df["lesson"].astype(str)==str(lesson_)) &
-                (bank_df["qtype"].astype(str).str.upper()==qtype_) &
-                (bank_df["tt27_level"].astype(int)==int(level_))
-            ]
-            if yccd_:
-                sub2 = sub[sub["yccd"].astype(str)==str(yccd_)]
-                if not sub2.empty:
-                    sub = sub2
-            if sub.empty:
-                return None, {}
-            used = set(st.session_state.get("used_question_ids", set()))
-            for _, r in sub.iterrows():
-                qid = str(r.get("question_id",""))
-                if qid and qid not in used:
-                    used.add(qid)
-                    st.session_state["used_question_ids"] = used
-                    return qid, {
-                        "stem": str(r.get("stem","")),
-                        "options": str(r.get("options","")),
-                        "answer": str(r.get("answer","")),
-                        "marking_guide": str(r.get("marking_guide","")),
-                        "yccd": str(r.get("yccd","")),
-                    }
-            return None, {}
-
-        pts = st.session_state["points_per_qtype"]
-        items = st.session_state["draft_items"]
-        next_qno = 1 if not items else max(int(x.get("qno",0)) for x in items) + 1
-
-        added = 0
-        for lr in mx_local.lessons:
-            t = lr.topic
-            l = lr.lesson
-            ylist = ymap.get((str(t), str(l)), [])
-            yidx = 0
-            for q in QTYPE_ORDER:
-                for lv in LEVEL_ORDER:
-                    cnt = int(lr.counts.get((q, lv), 0) or 0)
-                    for _ in range(cnt):
-                        yccd_pick = ""
-                        if ylist:
-                            yccd_pick = ylist[yidx % len(ylist)]
-                            yidx += 1
-
-                        qid, payload = pick_from_bank(t, l, q, lv, yccd_pick)
-                        stem = payload.get("stem","")
-                        options = payload.get("options","")
-                        answer = payload.get("answer","")
-                        guide = payload.get("marking_guide","")
-
-                        items.append({
-                            "qno": next_qno,
-                            "topic": t,
-                            "lesson": l,
-                            "yccd": yccd_pick or payload.get("yccd",""),
-                            "qtype": q,
-                            "level": int(lv),
-                            "points": float(pts.get(q, 0.25)),
-                            "question_id": qid,
-                            "stem": stem,
-                            "options": options,
-                            "answer": answer,
-                            "marking_guide": guide,
-                        })
-                        next_qno += 1
-                        added += 1
-
-        st.session_state["draft_items"] = items
-        return added
-
-    def _ai_fill_missing(limit_n: int):
-        if limit_n <= 0:
-            return 0
-        mode = st.session_state.get("ai_mode","Tắt")
-        if mode == "Tắt":
-            st.warning("AI đang tắt. Mở ⚙️ API/AI dưới tiêu đề để bật và nhập key.")
-            return 0
-
-        items = st.session_state.get("draft_items", [])
-        missing_idx = [i for i,x in enumerate(items) if not str(x.get("stem","")).strip()]
-        if not missing_idx:
-            st.info("Không có câu trống để AI tạo.")
-            return 0
-
-        todo = missing_idx[:limit_n]
-        prog = st.progress(0.0)
-        done = 0
-
-        for k, i in enumerate(todo, start=1):
-            x = items[i]
-            qtype_ = x.get("qtype","MCQ")
-            lv = int(x.get("level",1))
-            pts_one = float(x.get("points",0.25))
-            lvl_name = LEVEL_NAME.get(int(lv), f"M{lv}")
-            prompt = f"""Hãy tạo 01 câu hỏi cho học sinh tiểu học (CTGDPT 2018, TT27).
-Lớp: {grade}
-Môn: {subject}
-Học kì: {semester}
-Chủ đề: {x.get('topic','')}
-Bài học: {x.get('lesson','')}
-YCCĐ: {x.get('yccd','') or '(tổng hợp)'}
-Dạng: {qtype_}
-Mức độ (TT27): {lvl_name}
-Điểm: {pts_one}
-
-Trả về JSON đúng cấu trúc:
-{{"stem":"...","options":["A...","B...","C...","D..."],"answer":"A","marking_guide":"..." }}
-Nếu không phải MCQ thì options = [] .
-Chỉ trả JSON, không thêm chữ khác."""
-            try:
-                if mode == "OpenAI-compatible":
-                    txt = openai_compatible_generate(
-                        base_url=st.session_state.get("ai_base_url","https://api.openai.com"),
-                        api_key=st.session_state.get("ai_api_key",""),
-                        model=st.session_state.get("ai_model","gpt-4o-mini"),
-                        prompt=prompt,
-                        timeout=45,
-                    )
-                else:
-                    txt = gemini_ai_studio_generate(
-                        api_key=st.session_state.get("ai_api_key",""),
-                        model=st.session_state.get("gemini_model","gemini-2.5-flash"),
-                        prompt=prompt,
-                        timeout=45,
-                    )
-                obj = json.loads(txt)
-                x["stem"] = obj.get("stem","")
-                opts = obj.get("options", [])
-                x["options"] = json.dumps(opts, ensure_ascii=False) if isinstance(opts, list) else str(opts)
-                x["answer"] = obj.get("answer","")
-                x["marking_guide"] = obj.get("marking_guide","")
-                if not x.get("question_id"):
-                    x["question_id"] = f"AI_{grade}_{norm_subject(subject)}_{norm_semester(semester)}_{qtype_}_M{lv}_{x.get('qno',0):03d}"
-                done += 1
-            except Exception as e:
-                # keep blank; continue
-                x["marking_guide"] = f"(AI lỗi: {e})"
-            prog.progress(k/len(todo))
-        st.session_state["draft_items"] = items
-        return done
-
+    changed = False
     if (replace_by_matrix or append_by_matrix) and mx is not None and df_new is not None:
-        added = _build_items_from_matrix(mx, df_new, replace=bool(replace_by_matrix))
-        st.success(f"✅ Đã tạo {added} dòng câu theo ma trận. (AI sẽ tạo nội dung theo lô để tránh lag.)")
+        added = _build_items_from_matrix(cidx, grade, subject, semester, mx, df_new, replace=bool(replace_by_matrix))
+        flash("success", f"✅ Đã tạo {added} dòng câu theo ma trận. (AI sẽ tạo nội dung theo lô để tránh lag.)", "matrix")
+        changed = True
         if ai_batch > 0:
-            created = _ai_fill_missing(ai_batch)
+            created = _ai_fill_missing(grade, subject, semester, ai_batch)
             if created:
-                st.success(f"✨ AI đã tạo {created} câu trong lượt này. Bạn có thể bấm 'AI tạo tiếp' để tạo thêm.")
+                flash("success", f"✨ AI đã tạo {created} câu trong lượt này. Bạn có thể bấm 'AI tạo tiếp' để tạo thêm.", "matrix")
 
     if gen_ai_missing:
-        created = _ai_fill_missing(ai_batch)
+        created = _ai_fill_missing(grade, subject, semester, ai_batch)
         if created:
-            st.success(f"✨ AI đã tạo {created} câu trong lượt này.")
-# ================== Points per qtype ==================
+            flash("success", f"✨ AI đã tạo {created} câu trong lượt này.", "matrix")
+            changed = True
+
+    if changed:
+        st.rerun()
+    show_flash("matrix")
+
+@st.fragment
+def points_panel():
     st.markdown("### Điểm/1 câu (bước 0,25)")
     pts = st.session_state["points_per_qtype"]
     pcols = st.columns(5)
@@ -627,160 +706,90 @@ Chỉ trả JSON, không thêm chữ khác."""
         pts["ESSAY"] = round_to_step(st.number_input("Tự luận", 0.0, 10.0, float(pts.get("ESSAY",1.0)), 0.25), 0.25)
     st.session_state["points_per_qtype"] = pts
 
-    # ================== CASCADE ==================
-    reset_if_sig_changed("sig_gss", (int(grade), norm_subject(subject).lower(), norm_semester(semester)), ["topic_sel","lesson_sel","yccd_sel","yccd_free"])
-    filtered = cascade_filter(cat_prepped, int(grade), subject, semester)
+@st.fragment
+def quick_add_panel(cidx: CascadeIndex, grade: int, subject: str, semester: str):
+    reset_if_sig_changed("sig_gss", (int(grade), normalize_subject(subject).lower(), normalize_semester(semester)), ["topic_sel","lesson_sel","yccd_sel","yccd_free"])
+    cview = cidx.view(int(grade), subject, semester)
+    pts = st.session_state["points_per_qtype"]
 
-    topics = sorted([t for t in filtered["topic"].dropna().astype(str).unique().tolist() if t.strip()])
+    topics = cview.topics
     st.markdown("### Thao tác nhanh (cùng một dòng ngang)")
     if not topics:
         st.warning("Không có luồng dữ liệu theo Lớp/Môn/HK đang chọn. Nếu bạn đã upload YCCĐ, hãy kiểm tra cột Lớp/Môn/Học kì trong file.")
     row = st.columns([1.2, 1.7, 2.0, 1.6, 0.9, 1.0])
 
     with row[0]:
-        topic = st.selectbox("Chủ đề", topics if topics else [""], index=safe_index(topics, st.session_state.get("topic_sel","")) if topics else 0, key="topic_sel")
+        topic = keep("topic_sel", st.selectbox("Chủ đề", topics if topics else [""], index=safe_index(topics, kept("topic_sel","")) if topics else 0, key="topic_sel"))
     reset_if_sig_changed("sig_topic", topic, ["lesson_sel","yccd_sel","yccd_free"])
 
-    lesson_options = sorted([x for x in filtered.loc[filtered["topic"].astype(str)==str(topic), "lesson"].dropna().astype(str).unique().tolist() if x.strip()])
+    lesson_options = cview.lessons.get(str(topic), [])
     with row[1]:
-        lesson = st.selectbox("Bài học", lesson_options if lesson_options else [""], index=safe_index(lesson_options, st.session_state.get("lesson_sel","")) if lesson_options else 0, key="lesson_sel")
+        lesson = keep("lesson_sel", st.selectbox("Bài học", lesson_options if lesson_options else [""], index=safe_index(lesson_options, kept("lesson_sel","")) if lesson_options else 0, key="lesson_sel"))
     reset_if_sig_changed("sig_lesson", lesson, ["yccd_sel","yccd_free"])
 
-    yccd_options = sorted([x for x in filtered.loc[(filtered["topic"].astype(str)==str(topic)) & (filtered["lesson"].astype(str)==str(lesson)), "yccd"].dropna().astype(str).unique().tolist() if x.strip()])
+    yccd_options = cview.yccds.get((str(topic), str(lesson)), [])
     with row[2]:
         if yccd_options:
-            yccd = st.selectbox("YCCĐ", ["(tất cả)"] + yccd_options, index=safe_index(["(tất cả)"] + yccd_options, st.session_state.get("yccd_sel","(tất cả)")), key="yccd_sel")
+            yccd = keep("yccd_sel", st.selectbox("YCCĐ", ["(tất cả)"] + yccd_options, index=safe_index(["(tất cả)"] + yccd_options, kept("yccd_sel","(tất cả)")), key="yccd_sel"))
             if yccd == "(tất cả)":
                 yccd = ""
         else:
-            yccd = st.text_input("YCCĐ", value="", placeholder="(chưa có YCCĐ)", key="yccd_free")
+            yccd = keep("yccd_free", st.text_input("YCCĐ", value=kept("yccd_free", ""), placeholder="(chưa có YCCĐ)", key="yccd_free"))
 
     with row[3]:
         qtype_level_opts = [qtype_level_label(q, lv) for q in QTYPE_ORDER for lv in LEVEL_ORDER]
-        sel_qtype_level = st.selectbox("Dạng/Mức (TT27)", qtype_level_opts, index=0, key="qtype_level_sel")
+        sel_qtype_level = keep("qtype_level_sel", st.selectbox("Dạng/Mức (TT27)", qtype_level_opts, index=safe_index(qtype_level_opts, kept("qtype_level_sel", "")), key="qtype_level_sel"))
     qtype, level = parse_qtype_level(sel_qtype_level)
 
     with row[4]:
-        default_pts = float(pts.get(qtype, 0.25))
-        points = round_to_step(st.number_input("Điểm", 0.0, 10.0, value=default_pts, step=0.25, key="points_one"), 0.25)
+        default_pts = float(kept("points_one", pts.get(qtype, 0.25)))
+        points = round_to_step(keep("points_one", st.number_input("Điểm", 0.0, 10.0, value=default_pts, step=0.25, key="points_one")), 0.25)
 
     with row[5]:
         add_btn = st.button("➕ Thêm", use_container_width=True)
 
+    if not add_btn:
+        show_flash("quick")
+        return
+
     # ================== Question pick / AI ==================
-    bank: Bank | None = st.session_state["bank"]
-    bank_df = bank.filtered(int(grade), norm_subject(subject), norm_semester(semester)) if bank is not None else None
-
-    def pick_from_bank():
-        if bank_df is None or bank_df.empty:
-            return None, {}
-        sub = bank_df[
-            (bank_df["topic"].astype(str)==str(topic)) &
-            (bank_df["lesson"].astype(str)==str(lesson)) &
-            (bank_df["qtype"].astype(str).str.upper()==qtype) &
-            (bank_df["tt27_level"].astype(int)==int(level))
-        ]
-        if yccd:
-            sub2 = sub[sub["yccd"].astype(str)==str(yccd)]
-            if not sub2.empty:
-                sub = sub2
-        if sub.empty:
-            return None, {}
-        used = set(st.session_state.get("used_question_ids", set()))
-        for _, r in sub.iterrows():
-            qid = str(r.get("question_id",""))
-            if qid and qid not in used:
-                used.add(qid)
-                st.session_state["used_question_ids"] = used
-                return qid, {
-                    "stem": str(r.get("stem","")),
-                    "options": str(r.get("options","")),
-                    "answer": str(r.get("answer","")),
-                    "marking_guide": str(r.get("marking_guide","")),
-                    "yccd": str(r.get("yccd","")),
-                }
-        return None, {}
+    items = st.session_state["draft_items"]
+    next_qno = 1 if not items else max(int(x.get("qno",0)) for x in items) + 1
 
-    def generate_with_ai():
-        mode = st.session_state.get("ai_mode","Tắt")
-        if mode == "Tắt":
-            raise AIError("AI đang tắt. Mở mục ⚙️ API/AI dưới tiêu đề để bật và nhập key.")
-        lvl_name = LEVEL_NAME.get(int(level), f"M{level}")
-        prompt = f"""Hãy tạo 01 câu hỏi cho học sinh tiểu học (CTGDPT 2018, TT27).
-Lớp: {grade}
-Môn: {subject}
-Học kì: {semester}
-Chủ đề: {topic}
-Bài học: {lesson}
-YCCĐ: {yccd or '(tổng hợp)'}
-Dạng: {qtype}
-Mức độ (TT27): {lvl_name}
-Điểm: {points}
-
-Trả về JSON đúng cấu trúc:
-{{"stem":"...","options":["A...","B...","C...","D..."],"answer":"A","marking_guide":"..." }}
-Nếu không phải MCQ thì options = [] .
-Chỉ trả JSON, không thêm chữ khác."""
-
-        if mode == "OpenAI-compatible":
-            txt = openai_compatible_generate(
-                base_url=st.session_state.get("ai_base_url","https://api.openai.com"),
-                api_key=st.session_state.get("ai_api_key",""),
-                model=st.session_state.get("ai_model","gpt-4o-mini"),
-                prompt=prompt,
-                timeout=45,
-            )
-        else:
-            txt = gemini_ai_studio_generate(
-                api_key=st.session_state.get("ai_api_key",""),
-                model=st.session_state.get("gemini_model","gemini-2.5-flash"),
-                prompt=prompt,
-                timeout=45,
-            )
-        return json.loads(txt)
+    qid, payload = pick_from_bank(_bank_df(grade, subject, semester), topic, lesson, qtype, level, yccd)
+    yccd_final = yccd or payload.get("yccd","")
 
-    if add_btn:
-        items = st.session_state["draft_items"]
-        next_qno = 1 if not items else max(int(x.get("qno",0)) for x in items) + 1
+    if qid is None:
+        # do NOT auto call AI if AI is off; allow user to click AI later
+        try:
+            if st.session_state.get("ai_mode","Tắt") == "Tắt":
+                raise AIError("AI đang tắt. Mở mục ⚙️ API/AI dưới tiêu đề để bật và nhập key.")
+            prompt = build_question_prompt(grade, subject, semester, topic, lesson, yccd, qtype, level, points)
+            payload = ai_generate(st.session_state, prompt, timeout=45, parse=parse_ai_question,
+                                  meta={"grade": grade, "subject": subject, "semester": semester,
+                                        "lesson": lesson, "qtype": qtype, "level": level})
+            row = _accept_ai(grade, subject, semester, _new_item(next_qno, topic, lesson, yccd, qtype, level, points, None, payload))
+            if row:
+                qid = row["question_id"]
+                get_ai_store().add([row])
+            else:
+                qid = f"AI_{grade}_{normalize_subject(subject)}_{normalize_semester(semester)}_{qtype}_M{level}_{next_qno:03d}"
+            flash("success", "✅ Đã tạo câu bằng AI (do kho không có câu phù hợp).", "quick")
+        except Exception as e:
+            flash("warning", f"Kho không có câu phù hợp và AI chưa tạo được: {e}", "quick")
+            qid = None
 
-        qid, payload = pick_from_bank()
-        stem = payload.get("stem","")
-        options = payload.get("options","")
-        answer = payload.get("answer","")
-        guide = payload.get("marking_guide","")
-        yccd_final = yccd or payload.get("yccd","")
+    st.session_state["draft_items"].append(_new_item(next_qno, topic, lesson, yccd_final, qtype, level, points, qid, payload))
+    st.rerun()
 
-        if qid is None:
-            # do NOT auto call AI if AI is off; allow user to click AI later
-            try:
-                obj = generate_with_ai()
-                stem = obj.get("stem","")
-                opts = obj.get("options", [])
-                options = json.dumps(opts, ensure_ascii=False) if isinstance(opts, list) else str(opts)
-                answer = obj.get("answer","")
-                guide = obj.get("marking_guide","")
-                qid = f"AI_{grade}_{norm_subject(subject)}_{norm_semester(semester)}_{qtype}_M{level}_{next_qno:03d}"
-                st.success("✅ Đã tạo câu bằng AI (do kho không có câu phù hợp).")
-            except Exception as e:
-                st.warning(f"Kho không có câu phù hợp và AI chưa tạo được: {e}")
-                qid = None
-
-        st.session_state["draft_items"].append({
-            "qno": next_qno,
-            "topic": topic,
-            "lesson": lesson,
-            "yccd": yccd_final,
-            "qtype": qtype,
-            "level": int(level),
-            "points": float(points),
-            "question_id": qid,
-            "stem": stem,
-            "options": options,
-            "answer": answer,
-            "marking_guide": guide,
-        })
+def _clear_draft():
+    # runs before the fragment re-renders, so the list below is already empty
+    st.session_state["draft_items"] = []
+    st.session_state["used_question_ids"] = set()
 
-    st.markdown("---")
+@st.fragment
+def draft_panel():
+    autosave_draft()
     left, right = st.columns([2.1, 1.2], gap="large")
 
     with left:
@@ -816,18 +825,87 @@ Chỉ trả JSON, không thêm chữ khác."""
 
         colA, colB = st.columns(2)
         with colA:
-            if st.button("🗑️ Xóa hết", use_container_width=True):
-                st.session_state["draft_items"] = []
-                st.session_state["used_question_ids"] = set()
+            st.button("🗑️ Xóa hết", use_container_width=True, on_click=_clear_draft)
         with colB:
             if st.button("🔁 Reset luồng chọn", use_container_width=True):
                 for k in ["topic_sel","lesson_sel","yccd_sel","yccd_free"]:
-                    if k in st.session_state:
-                        del st.session_state[k]
-                st.success("Đã reset luồng chọn.")
+                    st.session_state.pop(k, None)
+                    st.session_state["_kept"].pop(k, None)
+                flash("success", "Đã reset luồng chọn.", "draft")
+                st.rerun()
+        show_flash("draft")
+
+def render_soande_tab():
+    ensure_catalog_loaded()
+    cidx = get_cascade_index(st.session_state.get("catalog_version", ""), st.session_state["catalog_df"])
+
+    st.subheader("Thiết lập đề")
+
+    top = st.columns([1.0, 1.25, 1.0, 1.0, 1.2])
+
+    with top[0]:
+        grade = keep("grade_sel", st.selectbox("Lớp", GRADES, index=safe_index(GRADES, kept("grade_sel", 3)), key="grade_sel"))
+
+    # Subjects depend on grade (incl. wildcard grade=-1)
+    dyn_subjects = cidx.subject_options(int(grade))
+    subject_options = []
+    for s in DEFAULT_SUBJECTS + dyn_subjects:
+        s = _norm_text(s)
+        if s and s not in subject_options:
+            subject_options.append(s)
+
+    with top[1]:
+        reset_if_sig_changed("sig_grade", int(grade), ["subject_sel","semester_sel","topic_sel","lesson_sel","yccd_sel","yccd_free"])
+        subject = keep("subject_sel", st.selectbox("Môn", subject_options, index=safe_index(subject_options, kept("subject_sel","Tin")), key="subject_sel"))
+
+    # Semesters depend on grade+subject (incl. wildcard blank)
+    dyn_semesters = cidx.semester_options(int(grade), subject)
+    sem_options = ["HK1","HK2"]
+    for s in dyn_semesters:
+        if s not in sem_options:
+            sem_options.append(s)
+
+    with top[2]:
+        reset_if_sig_changed("sig_subject", normalize_subject(subject).lower(), ["semester_sel","topic_sel","lesson_sel","yccd_sel","yccd_free"])
+        semester = keep("semester_sel", st.selectbox("Học kì", sem_options, index=safe_index(sem_options, kept("semester_sel","HK1")), key="semester_sel"))
+
+    with top[3]:
+        exam_types = ["GK","CKI","CKII"]
+        keep("exam_type", st.selectbox("Loại KT", exam_types, index=safe_index(exam_types, kept("exam_type", "CKI")), key="exam_type"))
+
+    with top[4]:
+        total_points = keep("total_points", st.number_input("Tổng điểm", min_value=1.0, max_value=20.0, value=float(kept("total_points", 10.0)), step=0.25, key="total_points"))
+
+    # ================== MATRIX (hidden by default) ==================
+    st.markdown("### Tạo đề theo ma trận (ẩn bảng — chỉ mở khi cần chỉnh)")
+    mtx_path = pick_best_matrix_template(int(grade), subject, semester)
+
+    mx = None
+    if not mtx_path:
+        st.info("Không có template ma trận cho lựa chọn hiện tại. Bạn vẫn có thể soạn theo luồng Chủ đề → Bài → YCCĐ và dùng AI tạo câu.")
+    else:
+        try:
+            mx = get_template_registry().get(mtx_path, total_points=float(total_points))
+        except Exception as e:
+            mx = None
+            st.error(f"Lỗi đọc ma trận: {e}")
+
+    # Init editor df when switching grade/subject/semester or first load
+    sig = (int(grade), normalize_subject(subject), normalize_semester(semester), os.path.basename(mtx_path) if mtx_path else "")
+    if mx is not None:
+        if st.session_state.get("matrix_sig") != sig or st.session_state.get("matrix_editor_df") is None:
+            st.session_state["matrix_editor_df"] = matrix_to_editor_df(mx)
+            st.session_state["matrix_sig"] = sig
+
+    matrix_panel(cidx, int(grade), subject, semester, float(total_points), mx)
+    points_panel()
+    quick_add_panel(cidx, int(grade), subject, semester)
+    st.markdown("---")
+    draft_panel()
 
 # ================= TAB: EXPORT =================
-with tab_xuat:
+@st.fragment
+def export_panel():
     st.subheader("Xuất Word")
     items = st.session_state.get("draft_items", [])
     docx_files = list_template_docx()
@@ -847,29 +925,92 @@ with tab_xuat:
             if len(xlsx_files) > 1:
                 matrix_name = st.selectbox("Template Ma trận", xlsx_files, index=0)
 
-            title = st.text_input("Tiêu đề đề (hiển thị trong Word)", value="ĐỀ KIỂM TRA CUỐI KÌ")
+            title = keep("export_title", st.text_input("Tiêu đề đề (hiển thị trong Word)", value=kept("export_title", "ĐỀ KIỂM TRA CUỐI KÌ"), key="export_title"))
 
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("Xuất Bảng đặc tả.docx", type="primary", use_container_width=True):
                     try:
-                        matrix = load_matrix_template(os.path.join(TEMPLATE_DIR, matrix_name), total_points=float(10.0))
-                        out_path = os.path.join("outputs","Bang_dac_ta.docx")
-                        export_spec_from_template(os.path.join(TEMPLATE_DIR, spec_name), out_path, matrix, items)
-                        with open(out_path, "rb") as f:
-                            st.download_button("⬇️ Tải Bang_dac_ta.docx", f, file_name="Bang_dac_ta.docx", use_container_width=True)
+                        matrix = get_template_registry().get(os.path.join(TEMPLATE_DIR, matrix_name), total_points=float(10.0))
+                        data = export_spec_from_template(os.path.join(TEMPLATE_DIR, spec_name), matrix, items)
+                        st.download_button("⬇️ Tải Bang_dac_ta.docx", data, file_name="Bang_dac_ta.docx", use_container_width=True)
                         st.success("✅ Đã xuất Bảng đặc tả.")
                     except Exception as e:
                         st.error(f"Lỗi xuất đặc tả: {e}")
             with col2:
                 if st.button("Xuất De.docx", use_container_width=True):
                     try:
-                        out_path = os.path.join("outputs","De.docx")
-                        export_exam_docx(out_path, title=title, total_points=float(10.0), items=items)
-                        with open(out_path, "rb") as f:
-                            st.download_button("⬇️ Tải De.docx", f, file_name="De.docx", use_container_width=True)
+                        data = export_exam_docx(title=title, total_points=float(10.0), items=items)
+                        st.download_button("⬇️ Tải De.docx", data, file_name="De.docx", use_container_width=True)
                         st.success("✅ Đã xuất Đề.")
                     except Exception as e:
                         st.error(f"Lỗi xuất đề: {e}")
 
+            if st.button("Xuất trọn bộ (Đề + Đáp án + Đặc tả)", use_container_width=True):
+                try:
+                    matrix = get_template_registry().get(os.path.join(TEMPLATE_DIR, matrix_name), total_points=float(10.0))
+                    bundle = export_bundle(title, float(10.0), items, matrix, os.path.join(TEMPLATE_DIR, spec_name))
+                    b1, b2, b3 = st.columns(3)
+                    for col, (fname, data) in zip((b1, b2, b3), bundle.files()):
+                        with col:
+                            st.download_button(f"⬇️ {fname}", data, file_name=fname, use_container_width=True, key=f"bundle_{fname}")
+                    st.download_button("⬇️ Tải trọn bộ .zip", bundle.to_zip(), file_name="De_tron_bo.zip", mime="application/zip", use_container_width=True)
+                    st.success("✅ Đã xuất trọn bộ.")
+                except Exception as e:
+                    st.error(f"Lỗi xuất trọn bộ: {e}")
+
+            with st.expander("📦 Xuất hàng loạt (ZIP)", expanded=False):
+                st.caption("Mỗi mã đề đảo thứ tự câu; ZIP gồm Đề, Đáp án và Bảng đặc tả cho từng mã đề.")
+                bc1, bc2 = st.columns(2)
+                with bc1:
+                    n_variants = int(keep("bulk_n", st.number_input("Số mã đề", min_value=1, max_value=50, value=int(kept("bulk_n", 4)), step=1, key="bulk_n")))
+                with bc2:
+                    first_code = int(keep("bulk_first", st.number_input("Mã đề bắt đầu", min_value=1, max_value=999, value=int(kept("bulk_first", 101)), step=1, key="bulk_first")))
+                if st.button("Xuất ZIP", use_container_width=True, key="bulk_zip_btn"):
+                    try:
+                        matrix = get_template_registry().get(os.path.join(TEMPLATE_DIR, matrix_name), total_points=float(10.0))
+                        jobs = []
+                        for k in range(n_variants):
+                            code = first_code + k
+                            order = list(items)
+                            if k:
+                                random.Random(code).shuffle(order)
+                            shuffled = [{**it, "qno": i} for i, it in enumerate(order, start=1)]
+                            jobs.append(ExportJob(name=f"MaDe_{code}", title=f"{title} - MÃ ĐỀ {code}", matrix=matrix, items=shuffled))
+                        with st.spinner("Đang xuất..."):
+                            # in-process: no per-click process pool inside the server (forked children can inherit
+                            # locks held by tornado/warm-up/AI threads; spawned ones would re-run app.py as __main__)
+                            data = export_bulk_zip(jobs, os.path.join(TEMPLATE_DIR, spec_name), workers=1)
+                        st.download_button("⬇️ Tải De_hang_loat.zip", data, file_name="De_hang_loat.zip", mime="application/zip", use_container_width=True)
+                        st.success(f"✅ Đã xuất {n_variants} mã đề.")
+                    except Exception as e:
+                        st.error(f"Lỗi xuất hàng loạt: {e}")
+
+if active_tab == TABS[0]:
+    render_soande_tab()
+elif active_tab == TABS[1]:
+    render_data_tab()
+else:
+    export_panel()
+
+# ================= Diagnostics (hidden: ?debug=1 or RADETHI_DEBUG=1) =================
+if st.query_params.get("debug") == "1" or os.environ.get("RADETHI_DEBUG") == "1":
+    with st.expander("🩺 Chẩn đoán hiệu năng", expanded=False):
+        stage_stats = profiling.stats()
+        if not stage_stats:
+            st.caption("Chưa có số liệu.")
+        else:
+            st.dataframe(
+                pd.DataFrame([{"stage": k, **v} for k, v in stage_stats.items()]).round(2),
+                use_container_width=True, hide_index=True,
+            )
+            d1, d2, d3 = st.columns(3)
+            with d1:
+                st.download_button("⬇️ spans.jsonl", profiling.to_jsonl(), file_name="spans.jsonl", use_container_width=True)
+            with d2:
+                st.download_button("⬇️ metrics.prom", profiling.to_prometheus(), file_name="metrics.prom", use_container_width=True)
+            with d3:
+                if st.button("Xóa số liệu", use_container_width=True):
+                    profiling.reset()
+
 # ================= TAB: AI =================
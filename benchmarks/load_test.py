@@ -0,0 +1,211 @@
+"""Multi-session load test of app.py with Streamlit's AppTest (headless, offline).
+
+Usage::
+
+    python -m benchmarks.load_test --sessions 20 --concurrency 8
+    python -m benchmarks.load_test --sessions 50 --concurrency 25 --ai-latency 0.5 --think 0.2
+
+Every simulated teacher runs the same scenario in its own session: open the app, pick
+Lớp/Môn/Học kì, open and auto-fill the matrix, switch AI to the mock backend, build the
+exam from the matrix, let AI fill the gaps, switch to the export tab and export the bundle.
+
+AppTest keeps a single Runtime per process, so concurrent sessions cannot share one
+interpreter: `--concurrency` worker processes each run their share of the sessions back to
+back. Latencies therefore include CPU contention between sessions, and memory per session is
+the RSS growth of a worker divided by the sessions it kept alive.
+
+Reported: latency percentiles per step and over all reruns, throughput (reruns/s) and
+resident memory per session (RSS growth / sessions). Results are written next to the
+benchmark results (benchmarks/results/load_<commit>.json).
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from streamlit.testing.v1 import AppTest
+
+from .mock_llm import MockConfig, MockLLMServer
+from .run import RESULTS_DIR, _git_rev
+from .synth import ROOT
+
+APP = os.path.join(ROOT, "app.py")
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _pct(vals: List[float], q: float) -> float:
+    if not vals:
+        return 0.0
+    s = sorted(vals)
+    k = (len(s) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+def _button(at: AppTest, prefix: str):
+    for b in at.button:
+        if b.label.startswith(prefix):
+            return b
+    raise LookupError(f"không thấy nút '{prefix}'")
+
+def _by_key(elems, key: str):
+    for e in elems:
+        if e.key == key:
+            return e
+    raise LookupError(f"không thấy widget key='{key}'")
+
+def _by_label(elems, label: str):
+    for e in elems:
+        if e.label == label:
+            return e
+    raise LookupError(f"không thấy widget '{label}'")
+
+def scenario(mock_url: str, rng: random.Random) -> List[Tuple[str, Callable[[AppTest], None]]]:
+    """(step name, action before the rerun). Each step is one rerun."""
+    grade = rng.choice([3, 4, 5])
+    return [
+        ("open", lambda at: None),
+        ("select_grade", lambda at: _by_key(at.selectbox, "grade_sel").set_value(grade)),
+        ("select_subject", lambda at: _by_key(at.selectbox, "subject_sel").set_value("Tin")),
+        ("select_semester", lambda at: _by_key(at.selectbox, "semester_sel").set_value(rng.choice(["HK1", "HK2"]))),
+        ("show_matrix", lambda at: _by_label(at.toggle, "Hiện bảng ma trận").set_value(True)),
+        ("auto_allocate", lambda at: _by_key(at.toggle, "auto_alloc").set_value(True)),
+        ("ai_settings", lambda at: _by_key(at.selectbox, "ai_mode_ui_top").set_value("OpenAI-compatible")),
+        ("ai_endpoint", lambda at: (_by_key(at.text_input, "ai_base_top").set_value(mock_url),
+                                    _by_key(at.text_input, "ai_key_top").set_value("mock"))),
+        ("build_from_matrix", lambda at: _button(at, "⚡ Tạo mới theo ma trận").click()),
+        ("ai_fill", lambda at: _button(at, "✨ AI tạo tiếp").click()),
+        ("open_export", lambda at: _by_key(at.radio, "active_tab").set_value("📤 Xuất Word")),
+        ("export_bundle", lambda at: _button(at, "Xuất trọn bộ").click()),
+    ]
+
+def run_session(idx: int, mock_url: str, think: float, timeout: float, seed: int) -> Dict:
+    rng = random.Random(seed + idx)
+    at = AppTest.from_file(APP, default_timeout=timeout)
+    timings: List[Tuple[str, float]] = []
+    error = ""
+    for name, action in scenario(mock_url, rng):
+        try:
+            action(at)
+            t0 = time.perf_counter()
+            at.run()
+            timings.append((name, time.perf_counter() - t0))
+            if at.exception:
+                error = f"{name}: {at.exception[0].message}"
+                break
+        except Exception as e:
+            error = f"{name}: {e}"
+            break
+        if think > 0:
+            time.sleep(rng.uniform(0, 2 * think))
+    n_items = len(at.session_state["draft_items"]) if "draft_items" in at.session_state else 0
+    return {"session": idx, "timings": timings, "error": error, "items": n_items, "_at": at}
+
+def _worker(indices: List[int], mock_url: str, think: float, timeout: float, seed: int, scratch: str) -> Tuple[List[Dict], int]:
+    """Run sessions back to back in this process; keep them alive to measure their memory."""
+    # keep the app's persistent stores (AI bank, drafts, usage ledger) out of data/
+    os.environ.update(RADETHI_AI_BANK_DIR=os.path.join(scratch, "ai_bank"), RADETHI_DRAFT_DB=os.path.join(scratch, "drafts.sqlite"),
+                      RADETHI_AI_LEDGER=os.path.join(scratch, "ai_ledger.jsonl"), RADETHI_AI_BUDGETS="")
+    gc.collect()
+    rss0 = _rss_bytes()
+    keep, results = [], []
+    for i in indices:
+        r = run_session(i, mock_url, think, timeout, seed)
+        keep.append(r.pop("_at"))
+        results.append(r)
+    gc.collect()
+    return results, _rss_bytes() - rss0
+
+def load_test(sessions: int, concurrency: int, think: float = 0.0, ai_latency: float = 0.2,
+              ai_error_rate: float = 0.0, timeout: float = 120.0, seed: int = 0) -> Dict:
+    workers = max(1, min(concurrency, sessions))
+    shares = [list(range(w, sessions, workers)) for w in range(workers)]
+    with MockLLMServer(cfg=MockConfig(latency=ai_latency, jitter=ai_latency / 2, error_rate=ai_error_rate, seed=seed)) as srv:
+        t0 = time.perf_counter()
+        with tempfile.TemporaryDirectory(prefix="radethi_load_") as scratch, ProcessPoolExecutor(max_workers=workers) as ex:
+            futs = [ex.submit(_worker, share, srv.base_url, think, timeout, seed, os.path.join(scratch, f"w{w}"))
+                    for w, share in enumerate(shares)]
+            outs = [f.result() for f in futs]
+        wall = time.perf_counter() - t0
+        ai_requests = srv.requests
+    results = sorted((r for rs, _ in outs for r in rs), key=lambda r: r["session"])
+    rss_per_session = statistics.fmean(d / len(share) for (_, d), share in zip(outs, shares) if share)
+
+    all_t = [t for r in results for _, t in r["timings"]]
+    steps: Dict[str, List[float]] = {}
+    for r in results:
+        for name, t in r["timings"]:
+            steps.setdefault(name, []).append(t)
+
+    def summary(v: List[float]) -> Dict[str, float]:
+        return {"n": len(v), "p50_ms": _pct(v, .5) * 1000, "p95_ms": _pct(v, .95) * 1000,
+                "p99_ms": _pct(v, .99) * 1000, "max_ms": max(v) * 1000 if v else 0.0,
+                "mean_ms": statistics.fmean(v) * 1000 if v else 0.0}
+    return {
+        "sessions": sessions,
+        "concurrency": concurrency,
+        "think_s": think,
+        "ai_latency_s": ai_latency,
+        "ai_error_rate": ai_error_rate,
+        "wall_s": wall,
+        "reruns": len(all_t),
+        "throughput_rps": len(all_t) / wall if wall else 0.0,
+        "sessions_per_min": sessions / wall * 60 if wall else 0.0,
+        "rerun": summary(all_t),
+        "steps": {k: summary(v) for k, v in steps.items()},
+        "rss_per_session_mb": rss_per_session / 2**20,
+        "ai_requests": ai_requests,
+        "errors": [f"#{r['session']} {r['error']}" for r in results if r["error"]],
+        "items_per_session": statistics.fmean([r["items"] for r in results]) if results else 0,
+    }
+
+def _print(rep: Dict) -> None:
+    print(f"{rep['sessions']} phiên, song song {rep['concurrency']}: {rep['wall_s']:.1f}s, "
+          f"{rep['reruns']} lần chạy lại, {rep['throughput_rps']:.2f} rerun/s, {rep['sessions_per_min']:.1f} phiên/phút")
+    print(f"{'bước':<22}{'n':>5}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)")
+    for name, s in list(rep["steps"].items()) + [("(tất cả)", rep["rerun"])]:
+        print(f"{name:<22}{s['n']:>5}{s['p50_ms']:>10.0f}{s['p95_ms']:>10.0f}{s['p99_ms']:>10.0f}{s['max_ms']:>10.0f}")
+    print(f"RSS ~{rep['rss_per_session_mb']:.1f} MB/phiên, "
+          f"{rep['ai_requests']} lời gọi AI, trung bình {rep['items_per_session']:.0f} câu/phiên")
+    for e in rep["errors"][:10]:
+        print(f"[LỖI] {e}", file=sys.stderr)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m benchmarks.load_test", description="Thử tải nhiều phiên Streamlit (AppTest).")
+    ap.add_argument("--sessions", type=int, default=10, help="Số giáo viên giả lập")
+    ap.add_argument("--concurrency", type=int, default=4, help="Số phiên chạy đồng thời")
+    ap.add_argument("--think", type=float, default=0.0, help="Thời gian nghĩ trung bình giữa hai thao tác (giây)")
+    ap.add_argument("--ai-latency", type=float, default=0.2, help="Độ trễ server AI giả lập (giây)")
+    ap.add_argument("--ai-error-rate", type=float, default=0.0)
+    ap.add_argument("--timeout", type=float, default=120.0, help="Giới hạn mỗi lần chạy lại (giây)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="File JSON kết quả (mặc định benchmarks/results/load_<commit>.json)")
+    args = ap.parse_args(argv)
+
+    rep = load_test(args.sessions, args.concurrency, args.think, args.ai_latency, args.ai_error_rate, args.timeout, args.seed)
+    _print(rep)
+    rep["commit"] = _git_rev()
+    out = args.out or os.path.join(RESULTS_DIR, f"load_{rep['commit']}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(rep, f, ensure_ascii=False, indent=2)
+    print(f"Đã ghi {out}")
+    return 1 if rep["errors"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
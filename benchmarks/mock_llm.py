@@ -0,0 +1,207 @@
+"""Offline mock of the OpenAI-compatible and Gemini REST endpoints used by tool/ai_provider.py.
+
+Usage::
+
+    python -m benchmarks.mock_llm --port 8765 --latency 0.2 --jitter 0.1 --error-rate 0.05
+
+Then point the app at it: OpenAI base URL ``http://127.0.0.1:8765`` or
+``GEMINI_BASE_URL=http://127.0.0.1:8765``. Any API key is accepted.
+
+Endpoints:
+- POST /v1/chat/completions
+- GET  /v1beta/models
+- POST /v1beta/models/<model>:generateContent   (404 for models not in MODELS)
+- POST /v1beta/models/<model>:countTokens       (same rough count as the usage fields)
+- POST /v1beta/cachedContents   (context caching; `cache_hits` counts requests reusing one)
+
+Every reply is a question JSON that parse_ai_question accepts.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+MODELS = ["gemini-2.5-flash", "gemini-2.5-pro", "gemini-2.0-flash"]
+
+@dataclass
+class MockConfig:
+    latency: float = 0.2        # seconds, base delay per request
+    jitter: float = 0.0         # seconds, uniform extra delay [0, jitter]
+    error_rate: float = 0.0     # share of requests answered with HTTP 500 (429 every 3rd error)
+    seed: int = 0
+    slow_rate: float = 0.0      # share of requests that stall (tail latency)
+    slow_s: float = 5.0         # extra delay of a stalled request
+
+def _question_json(prompt: str) -> str:
+    m = re.search(r"Dạng:\s*(\w+)", prompt or "")
+    qtype = (m.group(1) if m else "MCQ").upper()
+    m = re.search(r"Bài học:\s*(.+)", prompt or "")
+    lesson = m.group(1).strip() if m else "bài học"
+    obj = {
+        "stem": f"Câu hỏi mẫu về {lesson}?",
+        "options": ["Phương án A", "Phương án B", "Phương án C", "Phương án D"] if qtype == "MCQ" else [],
+        "answer": "A" if qtype == "MCQ" else "(gợi ý)",
+        "marking_guide": "Trả lời đúng được trọn điểm.",
+    }
+    return json.dumps(obj, ensure_ascii=False)
+
+def _tokens(obj) -> int:
+    """Rough token count (~4 chars per token) for the usage fields."""
+    return len(json.dumps(obj, ensure_ascii=False)) // 4
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "MockLLMServer"
+
+    def log_message(self, fmt, *args):  # keep benchmark output clean
+        pass
+
+    def _send(self, code: int, obj) -> None:
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _delay_or_fail(self) -> bool:
+        """Sleep the configured latency; True if this request should fail."""
+        srv = self.server
+        with srv.lock:
+            extra = srv.rng.uniform(0, srv.cfg.jitter) if srv.cfg.jitter > 0 else 0.0
+            if srv.cfg.slow_rate > 0 and srv.rng.random() < srv.cfg.slow_rate:
+                extra += srv.cfg.slow_s
+            fail = srv.rng.random() < srv.cfg.error_rate
+            srv.requests += 1
+            if fail:
+                srv.errors += 1
+            n_err = srv.errors
+        time.sleep(srv.cfg.latency + extra)
+        if fail:
+            if n_err % 3 == 0:
+                self._send(429, {"error": {"code": 429, "message": "Resource exhausted (mock)."}})
+            else:
+                self._send(500, {"error": {"code": 500, "message": "Internal error (mock)."}})
+        return fail
+
+    def _read_json(self) -> dict:
+        n = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(n) or b"{}")
+        except Exception:
+            return {}
+
+    def do_GET(self):
+        if self.path.startswith("/v1beta/models"):
+            self._send(200, {"models": [
+                {"name": f"models/{m}", "supportedGenerationMethods": ["generateContent", "countTokens"]} for m in MODELS
+            ] + [{"name": "models/text-embedding-004", "supportedGenerationMethods": ["embedContent"]}]})
+        else:
+            self._send(404, {"error": {"code": 404, "message": "Not found"}})
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        payload = self._read_json()
+        if path == "/v1/chat/completions":
+            if self._delay_or_fail():
+                return
+            msgs = payload.get("messages") or [{}]
+            prompt = str(msgs[-1].get("content", ""))
+            self._send(200, {
+                "id": "mock", "object": "chat.completion", "model": payload.get("model", ""),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": _question_json(prompt)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": _tokens(msgs), "completion_tokens": 60, "prompt_tokens_details": {"cached_tokens": 0}},
+            })
+        elif path == "/v1beta/cachedContents":
+            with self.server.lock:
+                self.server.caches += 1
+                n = self.server.caches
+                self.server.cache_tokens[f"cachedContents/mock{n}"] = _tokens(payload.get("systemInstruction"))
+            self._send(200, {"name": f"cachedContents/mock{n}", "model": payload.get("model", ""),
+                             "expireTime": "2099-01-01T00:00:00Z"})
+        elif path.startswith("/v1beta/models/") and path.endswith(":countTokens"):
+            self._send(200, {"totalTokens": _tokens(payload.get("contents"))})
+        elif path.startswith("/v1beta/models/") and path.endswith(":generateContent"):
+            model = path[len("/v1beta/models/"):-len(":generateContent")]
+            if model not in MODELS:
+                self._send(404, {"error": {"code": 404, "message": f"models/{model} is not found (mock)."}})
+                return
+            if self._delay_or_fail():
+                return
+            if payload.get("cachedContent"):
+                with self.server.lock:
+                    self.server.cache_hits += 1
+            try:
+                prompt = "".join(p.get("text", "") for c in payload.get("contents", []) for p in c.get("parts", []))
+            except Exception:
+                prompt = ""
+            self._send(200, {"candidates": [{"content": {"role": "model", "parts": [{"text": _question_json(prompt)}]}}],
+                             "usageMetadata": {"promptTokenCount": _tokens(payload), "candidatesTokenCount": 60,
+                                               "cachedContentTokenCount": self.server.cache_tokens.get(payload.get("cachedContent"), 0)}})
+        else:
+            self._send(404, {"error": {"code": 404, "message": "Not found"}})
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, cfg: Optional[MockConfig] = None):
+        super().__init__((host, port), _Handler)
+        self.cfg = cfg or MockConfig()
+        self.rng = random.Random(self.cfg.seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.caches = 0
+        self.cache_hits = 0
+        self.cache_tokens: Dict[str, int] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> "MockLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m benchmarks.mock_llm", description="Mock OpenAI/Gemini server (offline).")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=0.2)
+    ap.add_argument("--jitter", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--slow-rate", type=float, default=0.0, help="Tỉ lệ request bị treo thêm --slow-s giây")
+    ap.add_argument("--slow-s", type=float, default=5.0)
+    args = ap.parse_args(argv)
+    srv = MockLLMServer(args.host, args.port, MockConfig(args.latency, args.jitter, args.error_rate, args.seed, args.slow_rate, args.slow_s))
+    print(f"Mock LLM on {srv.base_url} (latency {args.latency}s, jitter {args.jitter}s, lỗi {args.error_rate:.0%})")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
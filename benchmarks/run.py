@@ -0,0 +1,241 @@
+"""Offline benchmark suite.
+
+Usage::
+
+    python -m benchmarks.run                   # quick sizes, results -> benchmarks/results/<commit>.json
+    python -m benchmarks.run --full            # bank up to 1M rows, bigger catalogs/templates
+    python -m benchmarks.run --only bank,export
+    python -m benchmarks.run --compare benchmarks/results/abc1234.json benchmarks/results/def5678.json
+
+Everything runs on synthetic data generated from the shapes of data/ and templates/;
+AI calls go to the local mock server (benchmarks/mock_llm.py), never to the network.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from tool import ai_ledger, ai_provider
+from tool.ai_provider import ai_generate
+from tool.catalog_builder import build_catalog_from_sources, parse_docx_to_catalog
+from tool.catalog_index import CascadeIndex, prep_catalog
+from tool.data_loader import try_parse_catalog_from_excel
+from tool.export_docx import ExportJob, export_bulk_zip, export_bundle
+from tool.generation import assign_auto, build_question_prompt, build_slots_from_matrix, parse_ai_question
+from tool.matrix_template import load_matrix_template
+from tool.question_bank import load_bank_from_path
+
+from . import synth
+from .mock_llm import MockConfig, MockLLMServer
+
+RESULTS_DIR = os.path.join(synth.ROOT, "benchmarks", "results")
+SOURCE_DIR = os.path.join(synth.ROOT, "data", "khgd_sources")
+PTS = {"MCQ": 0.5, "TF": 0.5, "MATCH": 1.0, "FILL": 1.0, "ESSAY": 1.0}
+
+QUICK = {"bank_rows": [1_000, 10_000, 100_000], "catalog_factor": [1, 10], "lessons": [30, 300],
+         "ai_prompts": 40, "ai_workers": [1, 8], "export_items": [40, 400], "bulk_variants": 8,
+         "khgd_workbooks": [(3, 500), (8, 5000)], "yccd_docs": [(3, 50), (5, 2000)]}
+FULL = {"bank_rows": [1_000, 10_000, 100_000, 1_000_000], "catalog_factor": [1, 10, 100], "lessons": [30, 300, 3000],
+        "ai_prompts": 200, "ai_workers": [1, 8, 32], "export_items": [40, 400, 4000], "bulk_variants": 32,
+        "khgd_workbooks": [(3, 500), (8, 5000), (12, 20000)], "yccd_docs": [(3, 50), (5, 2000), (5, 10000)]}
+
+def measure(fn: Callable[[], object], repeat: int = 3) -> Dict[str, float]:
+    times = []
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return {"median_s": statistics.median(times), "min_s": min(times), "repeat": len(times)}
+
+class Suite:
+    def __init__(self, sizes: Dict, workdir: str, repeat: int = 3):
+        self.sizes = sizes
+        self.workdir = workdir
+        self.repeat = repeat
+        self.results: Dict[str, Dict] = {}
+
+    def add(self, name: str, fn: Callable[[], object], repeat: Optional[int] = None, **extra) -> None:
+        r = measure(fn, self.repeat if repeat is None else repeat)
+        r.update(extra)
+        self.results[name] = r
+        print(f"  {name:<40} {r['median_s'] * 1000:10.1f} ms  (min {r['min_s'] * 1000:.1f})", flush=True)
+
+    # ---- groups ----
+    def bench_bank(self) -> None:
+        cat = synth.base_catalog()
+        grade, subject, semester = synth.largest_group(cat)
+        mx = load_matrix_template(synth.synthetic_matrix_xlsx(os.path.join(self.workdir, "mx_bank.xlsx"), 30, cat))
+        for n in self.sizes["bank_rows"]:
+            path = synth.write_bank(synth.synthetic_bank(n, cat), os.path.join(self.workdir, f"bank_{n}.csv"))
+            rep = 1 if n >= 1_000_000 else None
+            bank = load_bank_from_path(path)
+            self.add(f"bank.load[{n}]", lambda: load_bank_from_path(path), repeat=rep)
+            self.add(f"bank.validate[{n}]", bank.validate, repeat=rep)
+            self.add(f"bank.filter[{n}]", lambda: bank.filtered(grade, subject, semester))
+            self.add(f"bank.assign_auto[{n}]",
+                     lambda: assign_auto(build_slots_from_matrix(mx, PTS), bank, grade, subject, semester), repeat=rep)
+
+    def bench_catalog(self) -> None:
+        if os.path.isdir(SOURCE_DIR):
+            cache = os.path.join(self.workdir, "catalog_cache")
+
+            def cold():
+                shutil.rmtree(cache, ignore_errors=True)
+                build_catalog_from_sources(SOURCE_DIR, cache_dir=cache, workers=1)
+            self.add("catalog.build_cold", cold, repeat=1)
+            self.add("catalog.build_warm", lambda: build_catalog_from_sources(SOURCE_DIR, cache_dir=cache))
+        for f in self.sizes["catalog_factor"]:
+            cat = synth.scaled_catalog(f)
+            prepped = prep_catalog(cat)
+            self.add(f"catalog.prep[x{f}]", lambda: prep_catalog(cat), rows=len(cat))
+            self.add(f"catalog.index[x{f}]", lambda: CascadeIndex.build(prepped), rows=len(cat))
+        self.bench_catalog_excel()
+
+    def bench_catalog_excel(self) -> None:
+        for sheets, rows in self.sizes["khgd_workbooks"]:
+            path = synth.synthetic_khgd_xlsx(os.path.join(self.workdir, f"khgd_{sheets}x{rows}.xlsx"), sheets, rows)
+            self.add(f"catalog.excel[{sheets}x{rows}]", lambda: try_parse_catalog_from_excel(path))
+            self.add(f"catalog.excel_merge[{sheets}x{rows}]", lambda: try_parse_catalog_from_excel(path, merge=True))
+        for grades, rows in self.sizes["yccd_docs"]:
+            path = synth.synthetic_yccd_docx(os.path.join(self.workdir, f"yccd_{grades}x{rows}.docx"), grades, rows)
+            self.add(f"catalog.docx[{grades}x{rows}]", lambda: parse_docx_to_catalog(path))
+
+    def bench_template(self) -> None:
+        for n in self.sizes["lessons"]:
+            path = synth.synthetic_matrix_xlsx(os.path.join(self.workdir, f"mx_{n}.xlsx"), n)
+            self.add(f"template.load[{n}]", lambda: load_matrix_template(path))
+
+    def bench_ai(self) -> None:
+        n = self.sizes["ai_prompts"]
+        prompts = [build_question_prompt(3, "Tin", "HK1", "Chủ đề", f"Bài {i}", "", "MCQ", 1, 0.5) for i in range(n)]
+        ai_ledger.use_ledger(ai_ledger.Ledger(os.path.join(self.workdir, "ai_ledger.jsonl"), budgets_path=""))
+        with MockLLMServer(cfg=MockConfig(latency=0.05, jitter=0.02, error_rate=0.0)) as srv:
+            old = ai_provider.GEMINI_BASE_URL
+            ai_provider.GEMINI_BASE_URL = srv.base_url
+            try:
+                cfgs = {
+                    "openai": {"ai_mode": "OpenAI-compatible", "ai_base_url": srv.base_url, "ai_api_key": "mock", "ai_model": "mock"},
+                    "gemini": {"ai_mode": "Gemini", "ai_api_key": "mock", "gemini_model": "gemini-2.5-flash"},
+                }
+                for prov, cfg in cfgs.items():
+                    for w in self.sizes["ai_workers"]:
+                        def fill(cfg=cfg, w=w):
+                            with ThreadPoolExecutor(max_workers=w) as ex:
+                                return list(ex.map(lambda p: parse_ai_question(ai_generate(cfg, p, timeout=10)), prompts))
+                        self.add(f"ai.fill[{prov},{n}x,w{w}]", fill, repeat=1, mock_latency_s=0.05)
+            finally:
+                ai_provider.GEMINI_BASE_URL = old
+        self.bench_ai_tail(prompts)
+        ai_ledger.use_ledger(None)
+
+    def bench_ai_tail(self, prompts: List) -> None:
+        """Sequential fill against a server where 3% of requests stall: per-call tail with and without hedging."""
+        for hedge in (False, True):
+            with MockLLMServer(cfg=MockConfig(latency=0.05, jitter=0.02, slow_rate=0.03, slow_s=2.0, seed=1)) as srv:
+                ai_provider.latency = ai_provider.LatencyStats()
+                cfg = {"ai_mode": "OpenAI-compatible", "ai_base_url": srv.base_url, "ai_api_key": "mock",
+                       "ai_model": "mock-tail", "ai_hedge": hedge}
+                for p in prompts[:ai_provider.LatencyStats.MIN_SAMPLES]:  # fill the latency window first
+                    ai_generate(dict(cfg, ai_hedge=False), p, timeout=10)
+                warm, lat = srv.requests, []
+
+                def fill():
+                    for p in prompts * 2:
+                        t0 = time.perf_counter()
+                        ai_generate(cfg, p, timeout=10)
+                        lat.append(time.perf_counter() - t0)
+                name = f"ai.tail[{'hedge' if hedge else 'plain'},{2 * len(prompts)}x]"
+                self.add(name, fill, repeat=1)
+                lat.sort()
+                self.results[name].update(p50_call_s=statistics.median(lat), p99_call_s=lat[int(0.99 * (len(lat) - 1))],
+                                          max_call_s=lat[-1], calls=len(lat), requests=srv.requests - warm)
+                print(f"    p50 {self.results[name]['p50_call_s'] * 1000:.0f} ms, p99 {self.results[name]['p99_call_s'] * 1000:.0f} ms, "
+                      f"max {lat[-1] * 1000:.0f} ms, {srv.requests - warm} request / {len(lat)} câu", flush=True)
+        ai_provider.latency = ai_provider.LatencyStats()
+
+    def bench_export(self) -> None:
+        spec = next((os.path.join(synth.TEMPLATE_DIR, f) for f in sorted(os.listdir(synth.TEMPLATE_DIR)) if f.lower().endswith(".docx")), None)
+        mx = load_matrix_template(synth.synthetic_matrix_xlsx(os.path.join(self.workdir, "mx_export.xlsx"), 30))
+        for n in self.sizes["export_items"]:
+            items = synth.items_for_export(n)
+            self.add(f"export.bundle[{n}]", lambda: export_bundle("ĐỀ KIỂM TRA", 10.0, items, mx, spec, use_cache=False))
+        items = synth.items_for_export(40)
+        jobs = [ExportJob(f"MaDe_{101 + k}", "ĐỀ KIỂM TRA", mx, items) for k in range(self.sizes["bulk_variants"])]
+        for w in sorted({1, os.cpu_count() or 1}):
+            self.add(f"export.bulk_zip[{len(jobs)}x,w{w}]", lambda: export_bulk_zip(jobs, spec, workers=w), repeat=1)
+
+GROUPS = ["bank", "catalog", "template", "ai", "export"]
+
+def _git_rev() -> str:
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=synth.ROOT, capture_output=True, text=True, timeout=10).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=synth.ROOT, capture_output=True, text=True, timeout=30).stdout.strip()
+        return (rev or "nogit") + ("-dirty" if dirty else "")
+    except Exception:
+        return "nogit"
+
+def compare(paths: List[str]) -> None:
+    runs = []
+    for p in paths:
+        with open(p, "r", encoding="utf-8") as f:
+            runs.append(json.load(f))
+    names = sorted({n for r in runs for n in r["results"]})
+    head = f"{'benchmark':<40}" + "".join(f"{r['commit']:>16}" for r in runs)
+    if len(runs) > 1:
+        head += f"{'ratio':>10}"
+    print(head)
+    for n in names:
+        vals = [r["results"].get(n, {}).get("median_s") for r in runs]
+        line = f"{n:<40}" + "".join(f"{v * 1000:14.1f}ms" if v is not None else f"{'-':>16}" for v in vals)
+        if len(runs) > 1 and vals[0] and vals[-1]:
+            line += f"{vals[-1] / vals[0]:9.2f}x"
+        print(line)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m benchmarks.run", description="Benchmark offline với dữ liệu tổng hợp.")
+    ap.add_argument("--full", action="store_true", help="Kích thước lớn (kho 1 triệu câu, ...)")
+    ap.add_argument("--only", default="", help=f"Chỉ chạy các nhóm: {','.join(GROUPS)}")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--out", help="File JSON kết quả (mặc định benchmarks/results/<commit>.json)")
+    ap.add_argument("--compare", nargs="+", metavar="RESULT_JSON", help="So sánh các file kết quả rồi thoát")
+    args = ap.parse_args(argv)
+
+    if args.compare:
+        compare(args.compare)
+        return 0
+
+    groups = [g for g in args.only.split(",") if g] or GROUPS
+    sizes = FULL if args.full else QUICK
+    commit = _git_rev()
+    with tempfile.TemporaryDirectory(prefix="radethi_bench_") as wd:
+        suite = Suite(sizes, wd, repeat=args.repeat)
+        for g in groups:
+            print(f"[{g}]", flush=True)
+            getattr(suite, f"bench_{g}")()
+    out = args.out or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": commit,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "profile": "full" if args.full else "quick",
+            "results": suite.results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"Đã ghi {out}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
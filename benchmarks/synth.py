@@ -0,0 +1,182 @@
+"""Synthetic inputs shaped like the shipped data (question bank, YCCĐ catalog, matrix templates)."""
+from __future__ import annotations
+
+import json
+import os
+import random
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from tool.question_bank import REQUIRED_COLS
+from tool.matrix_template import QTYPE_COL_RANGE, DATA_START_ROW
+from tool.utils import QTYPE_ORDER, LEVEL_ORDER
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CATALOG_CSV = os.path.join(ROOT, "data", "yccd_catalog.csv")
+SAMPLE_BANK_CSV = os.path.join(ROOT, "data", "sample_question_bank.csv")
+TEMPLATE_DIR = os.path.join(ROOT, "templates")
+BANK_COLS = REQUIRED_COLS + ["marking_guide"]
+
+def base_catalog() -> pd.DataFrame:
+    return pd.read_csv(CATALOG_CSV).fillna("")
+
+def scaled_catalog(factor: int, seed: int = 0) -> pd.DataFrame:
+    """The shipped catalog repeated `factor` times; copies get distinct topic/lesson suffixes."""
+    cat = base_catalog()
+    if factor <= 1:
+        return cat
+    parts = [cat]
+    for k in range(1, factor):
+        c = cat.copy()
+        c["topic"] = c["topic"].astype(str) + f" (bản {k})"
+        c["lesson"] = c["lesson"].astype(str) + f" [{k}]"
+        parts.append(c)
+    return pd.concat(parts, ignore_index=True).sample(frac=1.0, random_state=seed).reset_index(drop=True)
+
+def synthetic_bank(n_rows: int, catalog: Optional[pd.DataFrame] = None, seed: int = 0) -> pd.DataFrame:
+    """`n_rows` questions spread over catalog lessons × qtype × level, same columns as the sample bank."""
+    cat = catalog if catalog is not None else base_catalog()
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, len(cat), size=n_rows)
+    qtypes = np.array(QTYPE_ORDER)[rng.integers(0, len(QTYPE_ORDER), size=n_rows)]
+    levels = rng.choice(np.array(LEVEL_ORDER), size=n_rows, p=[0.5, 0.4, 0.1])
+    rows = cat.iloc[idx].reset_index(drop=True)
+    opts = json.dumps(["Phương án A", "Phương án B", "Phương án C", "Phương án D"], ensure_ascii=False)
+    df = pd.DataFrame({
+        "question_id": [f"SYN_{i:07d}" for i in range(n_rows)],
+        "grade": rows["grade"].values,
+        "subject": rows["subject"].values,
+        "semester": rows["semester"].values,
+        "topic": rows["topic"].values,
+        "lesson": rows["lesson"].values,
+        "yccd": rows["yccd"].values,
+        "qtype": qtypes,
+        "tt27_level": levels,
+        "stem": [f"Câu hỏi tổng hợp số {i}?" for i in range(n_rows)],
+        "answer": np.where(qtypes == "MCQ", "A", "(gợi ý)"),
+        "options": np.where(qtypes == "MCQ", opts, ""),
+        "marking_guide": "Trả lời đúng được trọn điểm.",
+    })
+    return df[BANK_COLS]
+
+def write_bank(df: pd.DataFrame, path: str) -> str:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    df.to_csv(path, index=False, encoding="utf-8-sig")
+    return path
+
+def largest_group(cat: pd.DataFrame) -> Tuple[int, str, str]:
+    """(grade, subject, semester) with the most catalog lessons: the most demanding real selection."""
+    g = cat[cat["semester"].astype(str).str.strip() != ""]
+    key = g.groupby(["grade", "subject", "semester"])["lesson"].nunique().idxmax()
+    return int(key[0]), str(key[1]), str(key[2])
+
+def synthetic_matrix_xlsx(path: str, n_lessons: int, catalog: Optional[pd.DataFrame] = None,
+                          group: Optional[Tuple[int, str, str]] = None, seed: int = 0,
+                          questions_per_lesson: int = 2) -> str:
+    """A "ma trận" workbook in the layout load_matrix_template reads (title C2, rows from DATA_START_ROW)."""
+    cat = catalog if catalog is not None else base_catalog()
+    grade, subject, semester = group or largest_group(cat)
+    sel = cat[(cat["grade"] == grade) & (cat["subject"] == subject) & (cat["semester"] == semester)]
+    pairs = sel[["topic", "lesson"]].drop_duplicates().values.tolist() or [["Chủ đề", "Bài"]]
+    rng = random.Random(seed)
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "ma trận"
+    ws.cell(row=2, column=3, value=f"MA TRẬN ĐỀ KIỂM TRA MÔN {subject.upper()} LỚP {grade} {semester}")
+    first_col = QTYPE_COL_RANGE[0]
+    prev_topic = None
+    for i in range(n_lessons):
+        topic, lesson = pairs[i % len(pairs)]
+        if i >= len(pairs):
+            lesson = f"{lesson} [{i // len(pairs)}]"
+        r = DATA_START_ROW + i
+        ws.cell(row=r, column=1, value=i + 1)
+        ws.cell(row=r, column=2, value=topic if topic != prev_topic else None)
+        ws.cell(row=r, column=3, value=lesson)
+        ws.cell(row=r, column=4, value=rng.randint(1, 4))
+        prev_topic = topic
+        for _ in range(questions_per_lesson):
+            c = first_col + rng.randrange(QTYPE_COL_RANGE[1] - first_col + 1)
+            ws.cell(row=r, column=c, value=(ws.cell(row=r, column=c).value or 0) + 1)
+    ws.cell(row=DATA_START_ROW + n_lessons, column=1, value="Tổng số câu")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    wb.save(path)
+    return path
+
+def items_for_export(n_items: int, seed: int = 0) -> List[Dict]:
+    """Filled draft items (dicts as stored in session state) for export benchmarks."""
+    rng = random.Random(seed)
+    cat = base_catalog()
+    out = []
+    for i in range(n_items):
+        row = cat.iloc[rng.randrange(len(cat))]
+        qtype = QTYPE_ORDER[i % len(QTYPE_ORDER)]
+        out.append({
+            "qno": i + 1, "topic": str(row["topic"]), "lesson": str(row["lesson"]), "yccd": str(row["yccd"]),
+            "qtype": qtype, "level": LEVEL_ORDER[i % 3], "points": 0.5 if qtype in ("MCQ", "TF") else 1.0,
+            "question_id": f"SYN_{i:07d}", "stem": f"Câu hỏi tổng hợp số {i}?",
+            "options": json.dumps(["A1", "B1", "C1", "D1"], ensure_ascii=False) if qtype == "MCQ" else "",
+            "answer": "A" if qtype == "MCQ" else "(gợi ý)", "marking_guide": "Đúng được trọn điểm.",
+        })
+    return out
+
+def synthetic_khgd_xlsx(path: str, n_sheets: int, rows_per_sheet: int, seed: int = 0,
+                        title_rows: int = 0) -> str:
+    """A KHGD-like workbook: a cover sheet, then `n_sheets` sheets of catalog rows
+    (Lớp | Môn | Học kì | Chủ đề | Bài học | Yêu cầu cần đạt | Số tiết), optionally under title rows."""
+    cat = base_catalog()
+    rng = random.Random(seed)
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Bìa"
+    ws.append(["KẾ HOẠCH GIÁO DỤC"])
+    ws.append(["Năm học 2025-2026"])
+    for k in range(n_sheets):
+        ws = wb.create_sheet(f"Phần {k + 1}")
+        for t in range(title_rows):
+            ws.append([f"PHỤ LỤC {k + 1}" if t == 0 else None])
+        ws.append(["Lớp", "Môn", "Học kì", "Chủ đề", "Bài học", "Yêu cầu cần đạt", "Số tiết"])
+        for _ in range(rows_per_sheet):
+            r = cat.iloc[rng.randrange(len(cat))]
+            ws.append([int(r["grade"]), r["subject"], r["semester"], r["topic"], r["lesson"], r["yccd"], rng.randint(1, 3)])
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    wb.save(path)
+    return path
+
+def synthetic_yccd_docx(path: str, n_grades: int, rows_per_grade: int, seed: int = 0) -> str:
+    """A YCCĐ Word file shaped like data/khgd_sources/*.docx: a "LỚP n" heading per grade, then a
+    "Nội dung | Yêu cầu cần đạt" table with "Chủ đề ..." rows and lessons in vertically merged cells.
+    Table XML is written directly (python-docx add_row/merge are quadratic in the row count)."""
+    from xml.sax.saxutils import escape
+    from docx import Document
+    from docx.oxml import parse_xml
+    from docx.oxml.ns import nsdecls
+
+    def tc(text: str, vmerge: str = "") -> str:
+        pr = f'<w:tcPr><w:vMerge w:val="{vmerge}"/></w:tcPr>' if vmerge == "restart" else ("<w:tcPr><w:vMerge/></w:tcPr>" if vmerge else "")
+        return f"<w:tc>{pr}<w:p><w:r><w:t xml:space=\"preserve\">{escape(text)}</w:t></w:r></w:p></w:tc>"
+
+    cat = base_catalog()
+    rng = random.Random(seed)
+    doc = Document()
+    doc.add_paragraph("YÊU CẦU CẦN ĐẠT MÔN TIN HỌC")
+    for g in range(n_grades):
+        doc.add_paragraph(f"LỚP {g % 5 + 1}")
+        rows = [f"<w:tr>{tc('Nội dung')}{tc('Yêu cầu cần đạt')}</w:tr>"]
+        i = 0
+        while i < rows_per_grade:
+            r = cat.iloc[rng.randrange(len(cat))]
+            rows.append(f"<w:tr>{tc(f'Chủ đề {chr(65 + i % 6)}. {r.topic}')}{tc('')}</w:tr>")
+            n = min(rng.randint(1, 3), rows_per_grade - i)
+            for k in range(n):
+                lesson = tc(str(r.lesson), "restart" if n > 1 else "") if k == 0 else tc("", "continue")
+                rows.append(f"<w:tr>{lesson}{tc(str(cat.iloc[rng.randrange(len(cat))].yccd))}</w:tr>")
+            i += n
+        tbl = parse_xml(f'<w:tbl {nsdecls("w")}><w:tblGrid><w:gridCol/><w:gridCol/></w:tblGrid>{"".join(rows)}</w:tbl>')
+        doc.element.body.insert(len(doc.element.body) - 1, tbl)   # before sectPr
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    doc.save(path)
+    return path
@@ -0,0 +1,44 @@
+import tool.bank_store as bank_store
+from tool.bank_store import BankStore, bank_row
+
+def _item(i: int, **kw) -> dict:
+    item = {"topic": "Máy tính", "lesson": f"Bài {i}", "yccd": "Nhận biết", "qtype": "TF",
+            "level": 1, "stem": f"Câu hỏi số {i}?", "answer": "Đúng"}
+    item.update(kw)
+    return item
+
+def _rows(n: int, start: int = 0):
+    return [bank_row(3, "Tin học", "HK1", _item(i)) for i in range(start, start + n)]
+
+def test_same_content_stored_once(tmp_path):
+    store = BankStore(str(tmp_path))
+    row = _rows(1)[0]
+    assert store.add([row]) == 1
+    assert store.add([dict(row, source="again"), row]) == 0
+    assert len(store) == 1 and row["question_id"] in store
+    other = bank_row(3, "Tin học", "HK1", _item(0, answer="Sai"))
+    assert other["question_id"] != row["question_id"]
+    assert store.add([other]) == 1
+    with open(store.log_path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 2
+
+def test_reload_from_snapshot_and_log(tmp_path):
+    store = BankStore(str(tmp_path))
+    store.add(_rows(3))
+    assert store.compact(force=True)
+    store.add(_rows(2, start=3))
+    again = BankStore(str(tmp_path))
+    assert len(again) == 5
+    assert set(again.filtered(3, "Tin", "HK1")["question_id"]) == {r["question_id"] for r in _rows(5)}
+    assert again.add(_rows(5)) == 0
+
+def test_compacts_after_threshold(tmp_path, monkeypatch):
+    monkeypatch.setattr(bank_store, "COMPACT_AFTER", 3)
+    store = BankStore(str(tmp_path))
+    store.add(_rows(2))
+    assert store._log_lines == 2
+    store.add(_rows(1, start=2))
+    assert store._log_lines == 0
+    with open(store.log_path, encoding="utf-8") as f:
+        assert f.read() == ""
+    assert len(BankStore(str(tmp_path))) == 3
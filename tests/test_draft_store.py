@@ -0,0 +1,21 @@
+from tool.draft_store import DraftStore
+
+def _items(*qnos):
+    return [{"qno": q, "stem": f"Câu {q}", "answer": "A"} for q in qnos]
+
+def test_sync_deletes_removed_qnos(tmp_path):
+    path = str(tmp_path / "drafts.sqlite")
+    store = DraftStore(path)
+    assert store.sync("d1", _items(1, 2, 3)) == 3
+    assert store.sync("d1", _items(1, 2, 3)) == 0
+    assert store.sync("d1", _items(1, 3)) == 1
+    assert [it["qno"] for it in DraftStore(path).load("d1")] == [1, 3]
+
+def test_sync_after_reload_deletes_removed_qnos(tmp_path):
+    path = str(tmp_path / "drafts.sqlite")
+    DraftStore(path).sync("d1", _items(1, 2))
+    store = DraftStore(path)
+    assert len(store.load("d1")) == 2
+    assert store.sync("d1", _items(2)) == 1
+    assert [it["qno"] for it in store.load("d1")] == [2]
+    assert store.load("other") == []
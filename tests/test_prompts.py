@@ -0,0 +1,11 @@
+from tool.prompts import CACHE_MIN_TOKENS, SYSTEM_PREFIX, question_prompt
+
+def test_prefix_long_enough_for_provider_caches():
+    # tokenizers split on whitespace first, so the word count is a lower bound on tokens
+    assert len(SYSTEM_PREFIX.split()) >= CACHE_MIN_TOKENS * 1.2
+
+def test_prefix_shared_by_every_slot():
+    a = question_prompt(3, "Tin", "HK1", "Máy tính", "Bài 1", "", "MCQ", 1, 0.5)
+    b = question_prompt(5, "Toán", "HK2", "Số học", "Bài 9", "Cộng", "ESSAY", 3, 2.0)
+    assert a.system == b.system == SYSTEM_PREFIX
+    assert "Toán" in b.user and "Toán" not in a.user
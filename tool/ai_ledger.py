@@ -0,0 +1,214 @@
+"""AI usage ledger: one JSON line per AI call, daily per-school totals and budgets.
+
+Every call made through ai_provider.ai_generate is appended to ``data/ai_ledger.jsonl``
+(``RADETHI_AI_LEDGER``). Totals per school and day are kept in memory, so budget checks and
+the summary shown in the app never re-read the file after start-up.
+
+The school whose budget applies is server configuration (``RADETHI_SCHOOL``), never a value
+typed into a session. Budgets come from ``data/ai_budgets.json`` (``RADETHI_AI_BUDGETS``),
+limits per day, 0 = no limit::
+
+    {"default": {"calls_per_day": 0, "tokens_per_day": 0},
+     "schools": {"TH Kim Đồng": {"calls_per_day": 400, "tokens_per_day": 400000, "throttle_at": 0.8, "throttle_s": 2}}}
+
+Above ``throttle_at`` of a limit every call waits ``throttle_s`` first; at the limit calls are refused.
+Calls count when answered; tokens count always (including the losing copy of a hedged call).
+"""
+from __future__ import annotations
+
+import json
+import os
+import statistics
+import threading
+import time
+from dataclasses import asdict, dataclass, field, fields
+from typing import Dict, List, Optional, Tuple
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+RECENT = 2000   # records kept in memory for latency percentiles
+
+@dataclass
+class UsageRecord:
+    provider: str
+    model: str
+    latency_s: float
+    ok: bool
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    cache_hit: bool = False
+    parse_ok: Optional[bool] = None    # None when the caller did not parse the answer
+    hedged: bool = False               # a duplicate request was sent (see ai_provider.LatencyStats)
+    duplicate: bool = False            # the losing attempt of a hedged call: billed, so budgets count it
+    error: str = ""
+    school: str = ""
+    teacher: str = ""
+    slot: Dict = field(default_factory=dict)
+    ts: float = field(default_factory=time.time)
+
+    @property
+    def day(self) -> str:
+        return time.strftime("%Y-%m-%d", time.localtime(self.ts))
+
+@dataclass
+class Budget:
+    calls_per_day: int = 0
+    tokens_per_day: int = 0
+    throttle_at: float = 0.8
+    throttle_s: float = 2.0
+
+def _budget(spec, where: str, warnings: List[str]) -> Optional[Budget]:
+    if not isinstance(spec, dict):
+        warnings.append(f"{where}: cần một đối tượng JSON, bỏ qua.")
+        return None
+    known = {f.name: type(f.default) for f in fields(Budget)}   # int / float
+    for k in spec.keys() - known.keys():
+        warnings.append(f"{where}: bỏ qua khóa lạ '{k}'.")
+    try:
+        b = Budget(**{k: known[k](v) for k, v in spec.items() if k in known})
+    except (TypeError, ValueError):
+        warnings.append(f"{where}: giá trị không hợp lệ, bỏ qua.")
+        return None
+    if min(b.calls_per_day, b.tokens_per_day, b.throttle_s) < 0 or not 0 <= b.throttle_at <= 1:
+        warnings.append(f"{where}: giá trị âm hoặc throttle_at ngoài 0..1, bỏ qua.")
+        return None
+    return b
+
+def load_budgets(path: str) -> Tuple[Budget, Dict[str, Budget], List[str]]:
+    """(default budget, per-school budgets, warnings). A broken file or entry never raises:
+    it is reported in the warnings and that entry falls back to the default (no limit if the
+    default itself is unusable)."""
+    warnings: List[str] = []
+    if not path or not os.path.exists(path):
+        return Budget(), {}, warnings
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cfg = json.load(f)
+        if not isinstance(cfg, dict):
+            raise ValueError("cần một đối tượng JSON")
+    except (OSError, ValueError) as e:
+        return Budget(), {}, [f"Không đọc được {os.path.basename(path)} ({e}); AI đang chạy không giới hạn."]
+    default = _budget(cfg.get("default", {}), "default", warnings) or Budget()
+    schools = cfg.get("schools") or {}
+    if not isinstance(schools, dict):
+        warnings.append("schools: cần một đối tượng JSON, bỏ qua.")
+        schools = {}
+    budgets = {str(k): b for k, v in schools.items() if (b := _budget(v, f"schools.{k}", warnings)) is not None}
+    return default, budgets, warnings
+
+class Ledger:
+    def __init__(self, path: Optional[str] = None, budgets_path: Optional[str] = None, school: Optional[str] = None):
+        self.path = path or os.environ.get("RADETHI_AI_LEDGER", os.path.join(DATA_DIR, "ai_ledger.jsonl"))
+        if budgets_path is None:
+            budgets_path = os.environ.get("RADETHI_AI_BUDGETS", os.path.join(DATA_DIR, "ai_budgets.json"))
+        self.school = os.environ.get("RADETHI_SCHOOL", "") if school is None else school
+        self._lock = threading.Lock()
+        self._daily: Dict[Tuple[str, str], List[int]] = {}   # (day, school) -> [calls, tokens]
+        self._recent: List[UsageRecord] = []
+        self.default_budget, self.budgets, self.warnings = load_budgets(budgets_path)
+        self._load()
+
+    def _count(self, rec: UsageRecord, reserved: bool = False) -> None:
+        tot = self._daily.setdefault((rec.day, rec.school), [0, 0])
+        if rec.ok != reserved:
+            tot[0] += 1 if rec.ok else -1   # answered and not reserved yet / reservation given back
+        tot[1] += rec.prompt_tokens + rec.completion_tokens
+        self._recent.append(rec)
+        if len(self._recent) > 2 * RECENT:
+            del self._recent[:-RECENT]
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    self._count(UsageRecord(**json.loads(line)))
+                except (ValueError, TypeError):
+                    continue
+
+    def record(self, rec: UsageRecord, reserved: bool = False) -> None:
+        """Append a record; `reserved` if its call was taken with reserve() (then counted already)."""
+        line = json.dumps(asdict(rec), ensure_ascii=False) + "\n"
+        with self._lock:
+            self._count(rec, reserved)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def budget(self, school: str) -> Budget:
+        return self.budgets.get(school, self.default_budget)
+
+    def used_today(self, school: str) -> Tuple[int, int]:
+        with self._lock:
+            calls, tokens = self._daily.get((time.strftime("%Y-%m-%d"), school), [0, 0])
+        return calls, tokens
+
+    def check(self, school: str) -> Tuple[Optional[str], float]:
+        """(reason to refuse or None, seconds to wait before calling)."""
+        with self._lock:
+            return self._check(school)
+
+    def reserve(self, school: str) -> Tuple[Optional[str], float]:
+        """check() and, if allowed, take one call of today's budget in the same locked step, so
+        sessions racing at limit-1 cannot all get through. The matching record(..., reserved=True)
+        keeps the call if it was answered and gives it back if it failed."""
+        with self._lock:
+            refuse, wait = self._check(school)
+            if refuse is None:
+                self._daily.setdefault((time.strftime("%Y-%m-%d"), school), [0, 0])[0] += 1
+            return refuse, wait
+
+    def _check(self, school: str) -> Tuple[Optional[str], float]:
+        b = self.budget(school)
+        calls, tokens = self._daily.get((time.strftime("%Y-%m-%d"), school), [0, 0])
+        ratio = 0.0
+        for used, limit, what in [(calls, b.calls_per_day, "lượt gọi"), (tokens, b.tokens_per_day, "token")]:
+            if limit > 0:
+                if used >= limit:
+                    return f"Đã dùng hết hạn mức AI hôm nay ({used}/{limit} {what}) của '{school or 'mặc định'}'.", 0.0
+                ratio = max(ratio, used / limit)
+        return None, (b.throttle_s if ratio >= b.throttle_at and (b.calls_per_day or b.tokens_per_day) else 0.0)
+
+    def summary(self, school: Optional[str] = None, day: Optional[str] = None) -> List[Dict]:
+        """Per provider/model rows over the in-memory records (today by default).
+        Calls, errors and latencies are per answered call; tokens include hedge duplicates."""
+        day = day or time.strftime("%Y-%m-%d")
+        with self._lock:
+            recs = [r for r in self._recent if r.day == day and (school is None or r.school == school)]
+        groups: Dict[Tuple[str, str], List[UsageRecord]] = {}
+        for r in recs:
+            groups.setdefault((r.provider, r.model), []).append(r)
+        out = []
+        for (prov, model), every in sorted(groups.items()):
+            rs = [r for r in every if not r.duplicate] or every
+            lat = sorted(r.latency_s for r in rs if r.ok)
+            out.append({
+                "provider": prov, "model": model, "calls": len(rs),
+                "errors": sum(not r.ok for r in rs),
+                "parse_fail": sum(r.parse_ok is False for r in rs),
+                "hedged": sum(r.hedged for r in rs),
+                "prompt_tokens": sum(r.prompt_tokens for r in every),
+                "completion_tokens": sum(r.completion_tokens for r in every),
+                "cache_hit_pct": 100.0 * sum(r.cache_hit for r in rs) / len(rs),
+                "p50_s": statistics.median(lat) if lat else 0.0,
+                "p95_s": lat[int(0.95 * (len(lat) - 1))] if lat else 0.0,
+            })
+        return out
+
+_ledger: Optional[Ledger] = None
+_ledger_lock = threading.Lock()
+
+def use_ledger(ledger: Optional[Ledger]) -> None:
+    """Replace the process-wide ledger (benchmarks point it at a scratch file)."""
+    global _ledger
+    with _ledger_lock:
+        _ledger = ledger
+
+def get_ledger() -> Ledger:
+    """Process-wide ledger (created on first AI call, paths from the environment at that time)."""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = Ledger()
+        return _ledger
@@ -1,11 +1,32 @@
 from __future__ import annotations
+import hashlib
 import json
-import requests
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from .ai_ledger import UsageRecord, get_ledger
+from .profiling import timed
+from .prompts import Prompt
+
+# overridable for self-hosted proxies / the offline mock server in benchmarks/
+GEMINI_BASE_URL = os.environ.get("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com")
+
+DEFAULT_SYSTEM = "Bạn là chuyên gia ra đề tiểu học theo CTGDPT 2018 và TT27. Trả lời đúng yêu cầu."
 
 class AIError(Exception):
     pass
 
-def openai_compatible_generate(base_url: str, api_key: str, model: str, prompt: str, timeout: int = 45) -> str:
+class BudgetExceeded(AIError):
+    """The school's daily AI budget is used up."""
+
+@timed("ai.openai")
+def openai_compatible_generate(base_url: str, api_key: str, model: str, prompt: str, timeout: int = 45,
+                               system: Optional[str] = None, usage: Optional[dict] = None) -> str:
+    """`usage`, if given, is filled with prompt/completion/cached token counts from the response."""
     if not api_key:
         raise AIError("Chưa có API key.")
     base_url = (base_url or "https://api.openai.com").rstrip("/")
@@ -14,11 +35,13 @@ def openai_compatible_generate(base_url: str, api_key: str, model: str, prompt:
     payload = {
         "model": model,
         "messages": [
-            {"role": "system", "content": "Bạn là chuyên gia ra đề tiểu học theo CTGDPT 2018 và TT27. Trả lời đúng yêu cầu."},
+            # stable system prefix first: providers with automatic prefix caching reuse it
+            {"role": "system", "content": system or DEFAULT_SYSTEM},
             {"role": "user", "content": prompt},
         ],
         "temperature": 0.4,
     }
+    import requests  # deferred: only needed once AI is used
     try:
         r = requests.post(url, headers=headers, data=json.dumps(payload), timeout=timeout)
     except Exception as e:
@@ -27,16 +50,20 @@ def openai_compatible_generate(base_url: str, api_key: str, model: str, prompt:
         raise AIError(f"API lỗi {r.status_code}: {r.text[:300]}")
     try:
         data = r.json()
+        if usage is not None:
+            u = data.get("usage") or {}
+            usage.update(prompt_tokens=int(u.get("prompt_tokens") or 0), completion_tokens=int(u.get("completion_tokens") or 0),
+                         cached_tokens=int((u.get("prompt_tokens_details") or {}).get("cached_tokens") or 0))
         return data["choices"][0]["message"]["content"].strip()
     except Exception:
         raise AIError("Không parse được phản hồi API.")
 
-def gemini_list_models(api_key: str, timeout: int = 25):
-    """Return list of model names that support generateContent."""
+def _fetch_gemini_models(api_key: str, timeout: int = 25) -> List[str]:
     if not api_key:
         raise AIError("Chưa có API key.")
-    url = f"https://generativelanguage.googleapis.com/v1beta/models?key={api_key}"
+    url = f"{GEMINI_BASE_URL.rstrip('/')}/v1beta/models?key={api_key}"
     headers = {"Content-Type": "application/json"}
+    import requests
     try:
         r = requests.get(url, headers=headers, timeout=timeout)
     except Exception as e:
@@ -53,21 +80,472 @@ def gemini_list_models(api_key: str, timeout: int = 25):
             out.append(name.replace("models/",""))
     return sorted(set(out))
 
-def gemini_ai_studio_generate(api_key: str, model: str, prompt: str, timeout: int = 45) -> str:
+def gemini_list_models(api_key: str, timeout: int = 25, force: bool = False) -> List[str]:
+    """Return list of model names that support generateContent (cached per key, see GeminiModelRegistry)."""
+    return gemini_models.models(api_key, timeout=timeout, force=force)
+
+@dataclass
+class ModelProbe:
+    model: str
+    ok: bool
+    json_ok: Optional[bool] = False   # accepts responseMimeType=application/json; None: accepted, reply not checkable
+    latency_s: float = 0.0
+    error: str = ""
+    at: float = 0.0
+
+class GeminiModelRegistry:
+    """ListModels results and one-off model probes, cached per API-key hash.
+
+    `models()` hits the network at most once per MODELS_TTL_S for a key; `probe()` sends one
+    tiny JSON-mode request per model (latency + structured output), kept for PROBE_TTL_S.
+    Lookups (`supports_json`, `best`, `cached_probe`) never touch the network."""
+    MODELS_TTL_S = 6 * 3600
+    PROBE_TTL_S = 6 * 3600
+    FAILED_TTL_S = 120
+    MAX_PROBES = 6
+    # text models worth probing, in order of preference when several work
+    PREFERRED = ("gemini-2.5-flash", "gemini-2.5-flash-lite", "gemini-2.0-flash", "gemini-2.0-flash-lite", "gemini-2.5-pro")
+    SKIP = ("embedding", "tts", "image", "vision", "audio", "live", "aqa", "learnlm", "thinking-exp")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: Dict[str, Tuple[List[str], float]] = {}
+        self._probes: Dict[Tuple[str, str], ModelProbe] = {}
+
+    @staticmethod
+    def _kh(api_key: str) -> str:
+        return hashlib.sha1((api_key or "").encode("utf-8")).hexdigest()
+
+    def models(self, api_key: str, timeout: int = 25, force: bool = False) -> List[str]:
+        kh = self._kh(api_key)
+        with self._lock:
+            hit = self._models.get(kh)
+        if hit and not force and time.time() - hit[1] < self.MODELS_TTL_S:
+            return list(hit[0])
+        names = _fetch_gemini_models(api_key, timeout=timeout)
+        with self._lock:
+            self._models[kh] = (names, time.time())
+        return list(names)
+
+    def candidates(self, api_key: str) -> List[str]:
+        names = [m for m in self.models(api_key) if m.startswith("gemini") and not any(x in m for x in self.SKIP)]
+        rank = {m: i for i, m in enumerate(self.PREFERRED)}
+        return sorted(names, key=lambda m: (rank.get(m, len(rank)), "preview" in m or "exp" in m, m))[:self.MAX_PROBES]
+
+    def cached_models(self, api_key: str) -> List[str]:
+        with self._lock:
+            hit = self._models.get(self._kh(api_key))
+        return list(hit[0]) if hit and time.time() - hit[1] < self.MODELS_TTL_S else []
+
+    def cached_probe(self, api_key: str, model: str) -> Optional[ModelProbe]:
+        with self._lock:
+            p = self._probes.get((self._kh(api_key), model))
+        # failures may be transient (network, quota): keep them only briefly
+        ttl = self.PROBE_TTL_S if p and p.ok else self.FAILED_TTL_S
+        return p if p and time.time() - p.at < ttl else None
+
+    def probe(self, api_key: str, model: str, timeout: int = 20, force: bool = False) -> ModelProbe:
+        """One request to `model`: working at all, JSON mode honoured, round-trip latency."""
+        if not force:
+            p = self.cached_probe(api_key, model)
+            if p:
+                return p
+        url = f"{GEMINI_BASE_URL.rstrip('/')}/v1beta/models/{model}:generateContent?key={api_key}"
+        gen = {"temperature": 0, "maxOutputTokens": 32, "responseMimeType": "application/json"}
+        if "2.5-flash" in model:
+            # 2.5 models count thinking against maxOutputTokens; Flash/Flash-Lite may turn it off
+            gen["thinkingConfig"] = {"thinkingBudget": 0}
+        payload = {"contents": [{"role": "user", "parts": [{"text": 'Trả về đúng JSON: {"ok": true}'}]}], "generationConfig": gen}
+        import requests
+        p = ModelProbe(model, ok=False, at=time.time())
+        try:
+            for _ in range(3):
+                t0 = time.perf_counter()
+                r = requests.post(url, headers={"Content-Type": "application/json"}, data=json.dumps(payload), timeout=timeout)
+                if r.status_code != 400:
+                    break
+                # model without structured output / thinking control: still usable without the field
+                drop = next((f for f in ("responseMimeType", "thinkingConfig") if f in gen and f.lower() in r.text.lower()), None)
+                if drop is None:
+                    break
+                del gen[drop]
+            p.latency_s = time.perf_counter() - t0
+            if r.status_code >= 400:
+                p.error = f"{r.status_code}: {r.text[:200]}"
+            else:
+                # any 2xx means the model answers; a reply cut off by maxOutputTokens (thinking models)
+                # has no parts, so JSON support stays unknown instead of failing the model
+                p.ok = True
+                p.json_ok = None if "responseMimeType" in gen else False
+                try:
+                    json.loads(r.json()["candidates"][0]["content"]["parts"][0]["text"])
+                    p.json_ok = "responseMimeType" in gen
+                except Exception:
+                    pass
+        except Exception as e:
+            p.error = str(e)[:200]
+        with self._lock:
+            self._probes[(self._kh(api_key), model)] = p
+        return p
+
+    def probe_all(self, api_key: str, workers: int = 4) -> List[ModelProbe]:
+        cands = self.candidates(api_key)
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(cands) or 1))) as ex:
+            return list(ex.map(lambda m: self.probe(api_key, m), cands))
+
+    def best(self, api_key: str) -> Optional[str]:
+        """Fastest probed model that works (JSON-capable first); None before any probe."""
+        with self._lock:
+            kh = self._kh(api_key)
+            ps = [p for (k, _), p in self._probes.items() if k == kh and p.ok]
+        if not ps:
+            return None
+        return min(ps, key=lambda p: (not p.json_ok, p.latency_s)).model
+
+    def supports_json(self, api_key: str, model: str) -> bool:
+        p = self.cached_probe(api_key, model)
+        return bool(p and p.ok and p.json_ok is not False)
+
+    def check(self, api_key: str, model: str) -> ModelProbe:
+        """Raise AIError before a run if `model` does not answer (probe cached)."""
+        p = self.probe(api_key, model)
+        if not p.ok:
+            hint = self.best(api_key)
+            raise AIError(f"Model Gemini '{model}' không dùng được ({p.error or 'không phản hồi'})."
+                          + (f" Thử '{hint}'." if hint and hint != model else ""))
+        return p
+
+    def warm(self, api_key: str) -> threading.Thread:
+        """List and probe models in the background (off the request path)."""
+        def run():
+            try:
+                self.probe_all(api_key)
+            except Exception:
+                pass
+        t = threading.Thread(target=run, name="gemini-probe", daemon=True)
+        t.start()
+        return t
+
+gemini_models = GeminiModelRegistry()
+
+# Gemini explicit context caching: one cachedContents entry per (key, model, system prefix).
+# Entries are created off the request path (background thread, one per key) after countTokens
+# shows the prefix meets the model's minimum; until then, or if creation fails, the prefix is
+# sent inline as systemInstruction. A too-small prefix is remembered for a day, failures for a while.
+GEMINI_CACHE_TTL_S = 3600
+_GEMINI_RETRY_S = 600
+_GEMINI_TOO_SMALL_S = 86400
+_gemini_caches: Dict[Tuple[str, str, str], Tuple[Optional[str], float]] = {}
+_gemini_lock = threading.Lock()                           # guards the dict/set, never held over HTTP
+_gemini_inflight: set = set()                             # keys whose creation thread is running
+
+def _gemini_cache_key(api_key: str, model: str, system: str) -> Tuple[str, str, str]:
+    h = lambda x: hashlib.sha1(x.encode("utf-8")).hexdigest()
+    return h(api_key), model, h(system)
+
+def _gemini_cache_min_tokens(model: str) -> int:
+    return 4096 if "pro" in model else 1024
+
+def gemini_cached_content(api_key: str, model: str, system: str) -> Optional[str]:
+    """Name of a live cachedContents entry holding `system`, or None (send it inline).
+
+    Never waits: a missing entry is created in the background for later calls.
+    """
+    key = _gemini_cache_key(api_key, model, system)
+    with _gemini_lock:
+        name, until = _gemini_caches.get(key, (None, 0.0))
+        if time.time() < until - 60:
+            return name
+        if key in _gemini_inflight:
+            return None
+        _gemini_inflight.add(key)
+    threading.Thread(target=_gemini_create_cache, args=(key, api_key, model, system),
+                     name="gemini-cache", daemon=True).start()
+    return None
+
+def _gemini_create_cache(key: Tuple[str, str, str], api_key: str, model: str, system: str, timeout: int = 25) -> None:
+    import requests
+    base = GEMINI_BASE_URL.rstrip("/")
+    headers = {"Content-Type": "application/json"}
+    name, retry = None, _GEMINI_RETRY_S
+    try:
+        r = requests.post(f"{base}/v1beta/models/{model}:countTokens?key={api_key}", headers=headers,
+                          data=json.dumps({"contents": [{"role": "user", "parts": [{"text": system}]}]}), timeout=timeout)
+        n = int(r.json().get("totalTokens") or 0) if r.status_code < 400 else None
+        if n is not None and n < _gemini_cache_min_tokens(model):
+            retry = _GEMINI_TOO_SMALL_S
+        else:  # big enough, or size unknown: let cachedContents decide
+            payload = {
+                "model": f"models/{model}",
+                "systemInstruction": {"parts": [{"text": system}]},
+                "ttl": f"{GEMINI_CACHE_TTL_S}s",
+            }
+            r = requests.post(f"{base}/v1beta/cachedContents?key={api_key}", headers=headers, data=json.dumps(payload), timeout=timeout)
+            if r.status_code < 400:
+                name = r.json().get("name") or None
+    except Exception:
+        pass
+    finally:
+        with _gemini_lock:
+            _gemini_caches[key] = (name, time.time() + (GEMINI_CACHE_TTL_S if name else retry))
+            _gemini_inflight.discard(key)
+
+def _gemini_drop_cache(api_key: str, model: str, system: str) -> None:
+    with _gemini_lock:
+        _gemini_caches[_gemini_cache_key(api_key, model, system)] = (None, time.time() + _GEMINI_RETRY_S)
+
+@timed("ai.gemini")
+def gemini_ai_studio_generate(api_key: str, model: str, prompt: str, timeout: int = 45,
+                              system: Optional[str] = None, usage: Optional[dict] = None) -> str:
     if not api_key:
         raise AIError("Chưa có API key.")
     model = model or "gemini-2.5-flash"
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}"
+    url = f"{GEMINI_BASE_URL.rstrip('/')}/v1beta/models/{model}:generateContent?key={api_key}"
     headers = {"Content-Type": "application/json"}
-    payload = {"contents": [{"parts": [{"text": prompt}]}], "generationConfig": {"temperature": 0.4}}
+    payload = {"contents": [{"role": "user", "parts": [{"text": prompt}]}], "generationConfig": {"temperature": 0.4}}
+    if gemini_models.supports_json(api_key, model):
+        payload["generationConfig"]["responseMimeType"] = "application/json"
+    cached = gemini_cached_content(api_key, model, system) if system else None
+    if cached:
+        payload["cachedContent"] = cached
+    elif system:
+        payload["systemInstruction"] = {"parts": [{"text": system}]}
+    import requests
     try:
         r = requests.post(url, headers=headers, data=json.dumps(payload), timeout=timeout)
+        if cached and r.status_code in (400, 403, 404):
+            # cache expired or deleted server-side: resend the prefix inline
+            _gemini_drop_cache(api_key, model, system)
+            del payload["cachedContent"]
+            payload["systemInstruction"] = {"parts": [{"text": system}]}
+            r = requests.post(url, headers=headers, data=json.dumps(payload), timeout=timeout)
     except Exception as e:
         raise AIError(f"Lỗi mạng: {e}")
     if r.status_code >= 400:
         raise AIError(f"Gemini lỗi {r.status_code}: {r.text[:300]}")
     try:
         data = r.json()
+        if usage is not None:
+            u = data.get("usageMetadata") or {}
+            usage.update(prompt_tokens=int(u.get("promptTokenCount") or 0), completion_tokens=int(u.get("candidatesTokenCount") or 0),
+                         cached_tokens=int(u.get("cachedContentTokenCount") or 0), cache_hit=bool(payload.get("cachedContent")))
         return data["candidates"][0]["content"]["parts"][0]["text"].strip()
     except Exception:
         raise AIError("Không parse được phản hồi Gemini.")
+
+class LatencyStats:
+    """Rolling latencies of successful calls per (provider, model) -> adaptive deadline and hedge delay.
+
+    Until MIN_SAMPLES calls have succeeded the caller's timeout is used unchanged and nothing is
+    hedged. Afterwards each attempt gets `max(MIN_DEADLINE_S, DEADLINE_X * p99)` (capped by the
+    caller's timeout), and a call still running after p95 gets one duplicate request, as long as
+    duplicates stay under HEDGE_MAX_SHARE of all calls and a hedge worker is free."""
+    WINDOW = 200
+    MIN_SAMPLES = 20
+    MIN_DEADLINE_S = 8.0
+    DEADLINE_X = 3.0
+    HEDGE_MAX_SHARE = 0.1
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lat: Dict[Tuple[str, str], deque] = {}
+        self._calls = 0
+        self._hedges = 0
+
+    def add(self, key: Tuple[str, str], seconds: float) -> None:
+        with self._lock:
+            self._lat.setdefault(key, deque(maxlen=self.WINDOW)).append(seconds)
+
+    def quantile(self, key: Tuple[str, str], q: float) -> Optional[float]:
+        with self._lock:
+            lat = sorted(self._lat.get(key, ()))
+        if len(lat) < self.MIN_SAMPLES:
+            return None
+        return lat[min(len(lat) - 1, int(q * len(lat)))]
+
+    def deadline(self, key: Tuple[str, str], timeout: float) -> float:
+        p99 = self.quantile(key, 0.99)
+        return float(timeout) if p99 is None else min(float(timeout), max(self.MIN_DEADLINE_S, self.DEADLINE_X * p99))
+
+    def hedge_after(self, key: Tuple[str, str]) -> Optional[float]:
+        with self._lock:
+            self._calls += 1
+        return self.quantile(key, 0.95)
+
+    def allow_hedge(self) -> bool:
+        with self._lock:
+            if self._hedges + 1 > self.HEDGE_MAX_SHARE * self._calls + 1:
+                return False
+            self._hedges += 1
+            return True
+
+latency = LatencyStats()
+HEDGE_WORKERS = 8   # duplicates in flight at once, process-wide; no hedge is sent while all are busy
+_hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="ai-hedge")
+_hedge_slots = threading.BoundedSemaphore(HEDGE_WORKERS)
+
+def _provider_model(cfg: dict) -> Tuple[str, str]:
+    if cfg.get("ai_mode") == "Gemini":
+        return "gemini", cfg.get("gemini_model", "gemini-2.5-flash")
+    return "openai", cfg.get("ai_model", "gpt-4o-mini")
+
+def _hedged(cfg: dict, system: Optional[str], prompt: str, timeout: int, usage: dict,
+            on_dropped: Optional[Callable[[dict, str, float], None]] = None) -> Tuple[str, str, str]:
+    """_dispatch with an adaptive deadline and, for a slow call, one duplicate request.
+
+    The first attempt never waits for a pool: it runs on the caller's thread until hedging is
+    armed, then on its own thread so the caller can return as soon as either attempt answers.
+    Only the duplicate uses the (small) hedge pool. A request cannot be cancelled once sent, so
+    every attempt that does not win, including one finishing after the caller returned, is
+    reported to `on_dropped(usage, error, seconds)` to be counted as the paid call it is."""
+    key = _provider_model(cfg)
+    deadline = latency.deadline(key, timeout)
+    after = latency.hedge_after(key) if cfg.get("ai_hedge", True) else None
+    if after is None:
+        t0 = time.perf_counter()
+        out = _dispatch(cfg, system, prompt, deadline, usage)
+        latency.add(key, time.perf_counter() - t0)
+        return out
+
+    cond = threading.Condition()
+    box: Dict[str, Any] = {"results": [], "closed": False}
+
+    def dropped(res) -> None:
+        if on_dropped is not None:
+            _, u, e, secs = res
+            on_dropped(u, "" if e is None else str(e)[:200], secs)
+
+    def attempt(slot: bool = False) -> None:
+        u: dict = {}
+        t0 = time.perf_counter()
+        try:
+            out, e = _dispatch(cfg, system, prompt, deadline, u), None
+            latency.add(key, time.perf_counter() - t0)
+        except Exception as exc:
+            out, e = None, exc
+        finally:
+            if slot:
+                _hedge_slots.release()
+        res = (out, u, e, time.perf_counter() - t0)
+        with cond:
+            if not box["closed"]:
+                box["results"].append(res)
+                cond.notify()
+                return
+        dropped(res)
+
+    threading.Thread(target=attempt, name="ai-call", daemon=True).start()
+    sent = 1
+    with cond:
+        early = cond.wait_for(lambda: box["results"], timeout=after)
+    if not early and _hedge_slots.acquire(blocking=False):
+        if latency.allow_hedge():
+            _hedge_pool.submit(attempt, True)
+            sent = 2
+            usage["hedged"] = True
+        else:
+            _hedge_slots.release()
+    got, losers = 0, []
+    while True:
+        with cond:
+            cond.wait_for(lambda: box["results"])
+            out, u, e, secs = res = box["results"].pop(0)
+            got += 1
+            if e is not None and got < sent:
+                losers.append(res)   # wait for the other attempt
+                continue
+            box["closed"] = True
+            losers += box["results"]
+            box["results"] = []
+        for r in losers:
+            dropped(r)
+        usage.update(u)
+        if e is not None:
+            raise e
+        return out
+
+def _dispatch(cfg: dict, system: Optional[str], prompt: str, timeout: int, usage: dict) -> Tuple[str, str, str]:
+    """(provider, model, text) for one call."""
+    mode = cfg.get("ai_mode", "Tắt")
+    if mode == "OpenAI-compatible":
+        model = cfg.get("ai_model", "gpt-4o-mini")
+        return "openai", model, openai_compatible_generate(
+            base_url=cfg.get("ai_base_url", "https://api.openai.com"),
+            api_key=cfg.get("ai_api_key", ""),
+            model=model,
+            prompt=prompt,
+            timeout=timeout,
+            system=system,
+            usage=usage,
+        )
+    if mode == "Gemini":
+        model = cfg.get("gemini_model", "gemini-2.5-flash")
+        return "gemini", model, gemini_ai_studio_generate(
+            api_key=cfg.get("ai_api_key", ""),
+            model=model,
+            prompt=prompt,
+            timeout=timeout,
+            system=system,
+            usage=usage,
+        )
+    raise AIError("AI đang tắt.")
+
+def ai_generate(cfg: dict, prompt: Union[str, Prompt], timeout: int = 45,
+                meta: Optional[dict] = None, parse: Optional[Callable[[str], Any]] = None):
+    """Dispatch one prompt according to an AI config dict (same keys as the app's session state).
+
+    A `Prompt` sends its stable prefix as the system message / cached context. Every call takes
+    one call of the server's school budget (Ledger.school, from RADETHI_SCHOOL; never from `cfg`)
+    and is written to the usage ledger with `meta` as slot info; with `parse` the parsed answer
+    is returned and parse failures are logged too.
+    """
+    system = prompt.system if isinstance(prompt, Prompt) else None
+    prompt = prompt.user if isinstance(prompt, Prompt) else prompt
+    if cfg.get("ai_mode", "Tắt") not in ("OpenAI-compatible", "Gemini"):
+        raise AIError("AI đang tắt.")
+    ledger = get_ledger()
+    school = ledger.school
+    refuse, wait = ledger.reserve(school)
+    if refuse:
+        raise BudgetExceeded(refuse)
+    usage: dict = {}
+    provider, model, ok, err, parsed, parse_ok = cfg.get("ai_mode", ""), "", False, "", None, None
+    teacher = str(cfg.get("ai_teacher", "") or "")
+
+    def dropped(u: dict, error: str, seconds: float) -> None:
+        # the losing copy of a hedged call was still sent and billed: it counts against the budget
+        prov, mdl = _provider_model(cfg)
+        ledger.record(UsageRecord(
+            provider=prov, model=mdl, latency_s=seconds, ok=not error,
+            prompt_tokens=u.get("prompt_tokens", 0), completion_tokens=u.get("completion_tokens", 0),
+            cached_tokens=u.get("cached_tokens", 0), cache_hit=bool(u.get("cache_hit") or u.get("cached_tokens")),
+            hedged=True, duplicate=True, error=error, school=school, teacher=teacher, slot=meta or {},
+        ))
+    t0 = time.perf_counter()
+    try:
+        if wait:
+            time.sleep(wait)
+        provider, model, text = _hedged(cfg, system, prompt, timeout, usage, on_dropped=dropped)
+        ok = True
+        if parse is not None:
+            try:
+                parsed, parse_ok = parse(text), True
+            except Exception:
+                parse_ok = False
+                raise
+        return parsed if parse is not None else text
+    except Exception as e:
+        err = str(e)[:200]
+        raise
+    finally:
+        ledger.record(UsageRecord(
+            provider=provider, model=model, latency_s=time.perf_counter() - t0, ok=ok,
+            prompt_tokens=usage.get("prompt_tokens", 0), completion_tokens=usage.get("completion_tokens", 0),
+            cached_tokens=usage.get("cached_tokens", 0), cache_hit=bool(usage.get("cache_hit") or usage.get("cached_tokens")),
+            parse_ok=parse_ok, hedged=bool(usage.get("hedged")), error=err, school=school, teacher=teacher, slot=meta or {},
+        ), reserved=True)
+
+def ai_preflight(cfg: dict) -> None:
+    """Cheap check before a multi-question run: raises AIError if the configured model cannot answer."""
+    if cfg.get("ai_mode", "Tắt") == "Gemini":
+        gemini_models.check(cfg.get("ai_api_key", ""), cfg.get("gemini_model", "gemini-2.5-flash") or "gemini-2.5-flash")
@@ -0,0 +1,135 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from math import gcd
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from .utils import QTYPE_ORDER, LEVEL_ORDER, qtype_level_label
+from .matrix_template import MatrixTemplate
+
+# TT27 default mix (share of points): 50% Biết, 40% Hiểu, 10% Vận dụng
+DEFAULT_LEVEL_MIX = {1: 0.5, 2: 0.4, 3: 0.1}
+
+@dataclass
+class Allocation:
+    counts: List[Dict[Tuple[str, int], int]]      # per lesson, same order as matrix.lessons
+    lesson_points: List[float]
+    lesson_targets: List[float]                   # targets snapped to the step grid
+    level_points: Dict[int, float] = field(default_factory=dict)
+    qtype_counts: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def total(self) -> float:
+        return float(sum(self.lesson_points))
+
+    @property
+    def deviation(self) -> float:
+        return float(sum(abs(a - b) for a, b in zip(self.lesson_points, self.lesson_targets)))
+
+def _snap_targets(raw: List[float], total_units: int) -> List[int]:
+    """Largest-remainder rounding of lesson targets to integer step units summing to total_units."""
+    s = sum(raw)
+    if s <= 0:
+        return [0] * len(raw)
+    exact = [r / s * total_units for r in raw]
+    units = [int(x) for x in exact]
+    rest = total_units - sum(units)
+    order = sorted(range(len(raw)), key=lambda i: exact[i] - units[i], reverse=True)
+    for i in order[:rest]:
+        units[i] += 1
+    return units
+
+def _best_combo(target: int, weights: Dict[str, int], remaining: Dict[str, int]) -> Dict[str, int]:
+    """Bounded knapsack: qtype counts whose units hit `target` exactly (or the closest reachable sum),
+    preferring few questions and qtypes with plenty of budget left."""
+    qtypes = [q for q in QTYPE_ORDER if weights.get(q, 0) > 0 and remaining.get(q, 0) > 0]
+    INF = float("inf")
+    cap = target + max([weights[q] for q in qtypes], default=0)
+    # best[v] = (cost, counts) reaching exactly v units
+    best: List[Tuple[float, Dict[str, int]]] = [(INF, {})] * (cap + 1)
+    best[0] = (0.0, {})
+    for q in qtypes:
+        w = weights[q]
+        c = 1.0 + 1.0 / (1 + remaining[q])
+        new = list(best)
+        for v in range(cap + 1):
+            cost, combo = best[v]
+            if cost == INF:
+                continue
+            for n in range(1, remaining[q] + 1):
+                nv = v + n * w
+                if nv > cap:
+                    break
+                nc = cost + n * c
+                if nc < new[nv][0]:
+                    new[nv] = (nc, {**combo, q: n})
+        best = new
+    reachable = [v for v in range(cap + 1) if best[v][0] < INF]
+    v = min(reachable, key=lambda x: (abs(x - target), x > target, best[x][0]))
+    return dict(best[v][1])
+
+def allocate_matrix(matrix: MatrixTemplate, points_per_qtype: Dict[str, float],
+                    level_mix: Optional[Dict[int, float]] = None,
+                    qtype_limits: Optional[Dict[str, int]] = None,
+                    total_points: Optional[float] = None, step: float = 0.25) -> Allocation:
+    """Distribute question counts over the 15 qtype×level cells of every lesson.
+
+    Lesson targets follow `points_target` (periods ratio), snapped to the `step` grid (or the coarser
+    grid the qtype points allow) so they sum to the total. Each lesson gets the cheapest exact combination of qtypes within the per-qtype limits
+    (`qtype_limits[q]` = max questions of that qtype in the whole exam, 0 = not used); levels are then
+    assigned globally to follow `level_mix` (share of points per TT27 level).
+    """
+    total = float(total_points if total_points is not None else matrix.total_points)
+    level_mix = level_mix or DEFAULT_LEVEL_MIX
+    weights = {q: int(round(float(points_per_qtype.get(q, 0)) / step)) for q in QTYPE_ORDER}
+    total_units = int(round(total / step))
+    remaining = {q: (10 ** 6 if qtype_limits is None or q not in qtype_limits else int(qtype_limits[q])) for q in QTYPE_ORDER}
+
+    raw = [max(0.0, float(lr.points_target)) for lr in matrix.lessons]
+    if sum(raw) <= 0:
+        raw = [float(lr.periods) for lr in matrix.lessons]
+    # snap to the finest grid the usable qtypes can actually hit (e.g. 0.5 when all items are 0.5/1.0)
+    grid = 0
+    for q in QTYPE_ORDER:
+        if weights[q] > 0 and remaining[q] > 0:
+            grid = gcd(grid, weights[q])
+    grid = grid or 1
+    targets = [u * grid for u in _snap_targets(raw, total_units // grid)]
+
+    # bigger lessons first so the qtype budget is spent where it matters most
+    combos: List[Dict[str, int]] = [{} for _ in matrix.lessons]
+    for i in sorted(range(len(targets)), key=lambda k: targets[k], reverse=True):
+        if targets[i] <= 0:
+            continue
+        combo = _best_combo(targets[i], weights, remaining)
+        for q, n in combo.items():
+            remaining[q] -= n
+        combos[i] = combo
+
+    # levels: largest items first, each to the level with the biggest remaining deficit
+    mix_sum = sum(level_mix.get(lv, 0) for lv in LEVEL_ORDER) or 1.0
+    placed_units = sum(n * weights[q] for c in combos for q, n in c.items())
+    deficit = {lv: placed_units * level_mix.get(lv, 0) / mix_sum for lv in LEVEL_ORDER}
+    slots = [(weights[q], i, q) for i, c in enumerate(combos) for q, n in c.items() for _ in range(n)]
+    slots.sort(key=lambda s: (-s[0], s[1]))
+    counts: List[Dict[Tuple[str, int], int]] = [{(q, lv): 0 for q in QTYPE_ORDER for lv in LEVEL_ORDER} for _ in combos]
+    for w, i, q in slots:
+        lv = max(LEVEL_ORDER, key=lambda x: (deficit[x], -x))
+        deficit[lv] -= w
+        counts[i][(q, lv)] += 1
+
+    lesson_points = [sum(n * weights[q] for (q, _), n in c.items()) * step for c in counts]
+    level_points = {lv: sum(c[(q, lv)] * weights[q] for c in counts for q in QTYPE_ORDER) * step for lv in LEVEL_ORDER}
+    qtype_counts = {q: sum(c[(q, lv)] for c in counts for lv in LEVEL_ORDER) for q in QTYPE_ORDER}
+    return Allocation(counts=counts, lesson_points=lesson_points, lesson_targets=[t * step for t in targets],
+                      level_points=level_points, qtype_counts=qtype_counts)
+
+def allocation_to_editor_df(df_ed: pd.DataFrame, alloc: Allocation) -> pd.DataFrame:
+    """Write solved counts into a matrix editor frame (rows in lesson order); apply with editor_df_to_matrix."""
+    df = df_ed.copy()
+    for pos, c in enumerate(alloc.counts[:len(df)]):
+        for q in QTYPE_ORDER:
+            for lv in LEVEL_ORDER:
+                df.iat[pos, df.columns.get_loc(qtype_level_label(q, lv))] = int(c[(q, lv)])
+    return df
@@ -0,0 +1,169 @@
+"""Persistent local bank of accepted AI questions.
+
+Layout of the store directory::
+
+    log.jsonl      append-only, one accepted question per line (REQUIRED_COLS + marking_guide + meta)
+    snapshot.csv   compacted copy of the log, rewritten by `compact()` once the log passes
+                   COMPACT_AFTER lines (checked at startup and after every add)
+
+Ids are content hashes, so the same question generated twice is stored once. An in-memory
+index (grade, subject, semester) -> rows is kept up to date on every append, so pickers see
+new questions immediately without re-reading the files.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from .normalize import normalize_subject, normalize_semester
+from .question_bank import REQUIRED_COLS, Bank
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+STORE_COLS = REQUIRED_COLS + ["marking_guide", "source", "created_at"]
+COMPACT_AFTER = 5000   # log lines beyond the snapshot before compaction kicks in
+
+def default_root() -> str:
+    """Store directory shared by the app and batch runs: RADETHI_AI_BANK_DIR or data/ai_bank."""
+    return os.environ.get("RADETHI_AI_BANK_DIR", os.path.join(DATA_DIR, "ai_bank"))
+
+def content_id(row: Dict) -> str:
+    """Stable id from the fields that make a question: same content -> same id."""
+    key = "\x1f".join(str(row.get(c, "")).strip() for c in
+                      ["grade", "subject", "semester", "lesson", "qtype", "tt27_level", "stem", "options", "answer"])
+    return "AIH_" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+def bank_row(grade, subject: str, semester: str, item: Dict, source: str = "ai") -> Dict:
+    """Store row from a draft item (dict as kept in session state)."""
+    row = {
+        "grade": int(grade),
+        "subject": normalize_subject(subject),
+        "semester": normalize_semester(semester),
+        "topic": str(item.get("topic", "")),
+        "lesson": str(item.get("lesson", "")),
+        "yccd": str(item.get("yccd", "")),
+        "qtype": str(item.get("qtype", "")).upper().strip(),
+        "tt27_level": int(item.get("level", item.get("tt27_level", 1))),
+        "stem": str(item.get("stem", "")).strip(),
+        "answer": str(item.get("answer", "")).strip(),
+        "options": str(item.get("options", "") or ""),
+        "marking_guide": str(item.get("marking_guide", "")),
+        "source": source,
+    }
+    row["question_id"] = content_id(row)
+    return row
+
+def validate_row(row: Dict) -> List[str]:
+    """Bank.validate on a single row, plus non-empty stem/answer."""
+    errs = []
+    if not row.get("stem") or not row.get("answer"):
+        errs.append("Thiếu nội dung câu hỏi hoặc đáp án.")
+    _, more = Bank(df=pd.DataFrame([row])).validate()
+    return errs + more
+
+class BankStore:
+    def __init__(self, root: str):
+        self.root = root
+        self.log_path = os.path.join(root, "log.jsonl")
+        self.snapshot_path = os.path.join(root, "snapshot.csv")
+        self._lock = threading.Lock()
+        self._rows: List[Dict] = []
+        self._ids: set = set()
+        self._index: Dict[Tuple[int, str, str], List[int]] = {}
+        self._log_lines = 0
+        self._bank: Optional[Bank] = None
+        self._load()
+        self.compact()
+
+    # ---- loading / index ----
+    def _add_mem(self, row: Dict) -> bool:
+        qid = row["question_id"]
+        if qid in self._ids:
+            return False
+        self._ids.add(qid)
+        self._index.setdefault((int(row["grade"]), str(row["subject"]).lower(), str(row["semester"]).lower()), []).append(len(self._rows))
+        self._rows.append(row)
+        self._bank = None
+        return True
+
+    def _load(self) -> None:
+        if os.path.exists(self.snapshot_path):
+            snap = pd.read_csv(self.snapshot_path, dtype=str, keep_default_na=False)
+            for row in snap.to_dict("records"):
+                row["grade"], row["tt27_level"] = int(row["grade"]), int(row["tt27_level"])
+                self._add_mem(row)
+        if os.path.exists(self.log_path):
+            with open(self.log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line after a crash
+                    self._log_lines += 1
+                    self._add_mem(row)
+
+    # ---- public ----
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add(self, rows: Iterable[Dict]) -> int:
+        """Validate and append rows; returns how many were new. Invalid rows are skipped."""
+        new = []
+        with self._lock:
+            for row in rows:
+                row = dict(row)
+                row.setdefault("question_id", content_id(row))
+                row.setdefault("created_at", time.strftime("%Y-%m-%dT%H:%M:%S"))
+                if row["question_id"] in self._ids or validate_row(row):
+                    continue
+                self._add_mem(row)
+                new.append(row)
+            if new:
+                os.makedirs(self.root, exist_ok=True)
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps({c: r.get(c, "") for c in STORE_COLS}, ensure_ascii=False) + "\n" for r in new))
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._log_lines += len(new)
+                if self._log_lines >= COMPACT_AFTER:
+                    self._compact()
+        return len(new)
+
+    def __contains__(self, question_id: str) -> bool:
+        return question_id in self._ids
+
+    def filtered(self, grade: int, subject: str, semester: str) -> pd.DataFrame:
+        """Same result shape as Bank.filtered, served from the in-memory index."""
+        with self._lock:
+            pos = list(self._index.get((int(grade), str(subject).lower(), str(semester).lower()), []))
+            rows = [self._rows[i] for i in pos]
+        return Bank(df=pd.DataFrame(rows, columns=STORE_COLS)).normalize().df if rows else pd.DataFrame(columns=STORE_COLS)
+
+    def bank(self) -> Bank:
+        with self._lock:
+            if self._bank is None:
+                self._bank = Bank(df=pd.DataFrame(self._rows, columns=STORE_COLS)).normalize()
+            return self._bank
+
+    def compact(self, force: bool = False) -> bool:
+        """Rewrite snapshot.csv with every row and start an empty log (if the log is long enough)."""
+        with self._lock:
+            if not force and self._log_lines < COMPACT_AFTER:
+                return False
+            self._compact()
+            return True
+
+    def _compact(self) -> None:
+        # Caller holds the lock. Snapshot first, then truncate: a crash in between only leaves
+        # rows in both files, which _load dedups by content id.
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self.snapshot_path + ".tmp"
+        pd.DataFrame(self._rows, columns=STORE_COLS).to_csv(tmp, index=False, encoding="utf-8")
+        os.replace(tmp, self.snapshot_path)
+        open(self.log_path, "w", encoding="utf-8").close()
+        self._log_lines = 0
@@ -0,0 +1,296 @@
+"""Headless batch exam generation.
+
+Usage::
+
+    python -m tool.batch manifest.json --workers 8 --out outputs/batch
+
+Manifest (JSON)::
+
+    {
+      "bank": "data/sample_question_bank.csv",
+      "spec_template": "templates/đặc tả.docx",
+      "output_dir": "outputs/batch",
+      "points_per_qtype": {"MCQ": 0.5, "TF": 0.5, "MATCH": 1.0, "FILL": 1.0, "ESSAY": 1.0},
+      "ai": {"ai_mode": "Gemini", "api_key_env": "GEMINI_API_KEY", "gemini_model": "gemini-2.5-flash"},
+      "jobs": [
+        {"template": "templates/MA TRẬN - bảng đặc tả TIN 3 HK1.xlsx", "exam_type": "CKI"},
+        {"template": "...", "grade": 4, "subject": "Toán", "semester": "HK2", "exam_type": "CKII"},
+        {"template": "...", "exam_type": "CKII", "seed": 7, "name": "tin4_hk2_de2"}
+      ]
+    }
+
+Each job builds slots from its matrix, assigns questions from the bank, lets AI fill
+the missing ones (if enabled) and exports the exam (+ spec if a spec template is given).
+Files are named after the job's "name", else template + grade/subject/semester given in the
+job + exam type; two jobs with the same name are rejected before anything runs.
+Jobs run in a process pool; the bank is loaded once per worker, together with the shared AI
+bank ("ai_bank": directory, default RADETHI_AI_BANK_DIR or data/ai_bank; false to skip it).
+Valid AI questions come back with each result and are appended to the AI bank by the parent
+process only, so workers never write the store concurrently.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from .normalize import normalize_key, normalize_subject, normalize_semester
+from .matrix_template import load_matrix_template
+from .question_bank import Bank, load_bank_from_path
+from .bank_store import BankStore, bank_row, default_root, validate_row
+from .generation import build_slots_from_matrix, assign_auto, build_question_prompt, parse_ai_question
+from .ai_provider import AIError, BudgetExceeded, ai_generate, ai_preflight
+from .export_docx import export_exam_docx, export_spec_from_template
+
+DEFAULT_POINTS_PER_QTYPE = {"MCQ": 0.5, "TF": 0.5, "MATCH": 1.0, "FILL": 1.0, "ESSAY": 1.0}
+EXAM_TYPE_TITLES = {
+    "GK": "ĐỀ KIỂM TRA GIỮA KÌ",
+    "CKI": "ĐỀ KIỂM TRA CUỐI HỌC KÌ I",
+    "CKII": "ĐỀ KIỂM TRA CUỐI HỌC KÌ II",
+}
+
+@dataclass
+class BatchJob:
+    template: str
+    grade: Optional[int] = None
+    subject: Optional[str] = None
+    semester: Optional[str] = None
+    exam_type: str = "CKI"
+    title: str = ""
+    total_points: float = 10.0
+    seed: int = 42
+    name: str = ""          # output file prefix; default from template/grade/subject/semester/exam_type
+
+@dataclass
+class BatchResult:
+    name: str
+    ok: bool
+    files: List[str] = field(default_factory=list)
+    n_items: int = 0
+    from_bank: int = 0
+    ai_filled: int = 0
+    warnings: List[str] = field(default_factory=list)
+    error: str = ""
+    ai_rows: List[Dict] = field(default_factory=list)   # valid AI questions for the AI bank
+
+# ---- per-worker state (set once by the pool initializer) ----
+_BANK: Optional[Bank] = None
+
+def _init_worker(bank_path: Optional[str], ai_bank_dir: Optional[str] = None) -> None:
+    """Load the question bank plus accepted AI questions (read-only here; the parent appends)."""
+    global _BANK
+    parts = [load_bank_from_path(bank_path).df] if bank_path else []
+    store = BankStore(ai_bank_dir) if ai_bank_dir else None
+    if store is not None and len(store):
+        parts.append(store.bank().df)
+    _BANK = Bank(df=pd.concat(parts, ignore_index=True)) if parts else None
+
+def _job_name(job: BatchJob) -> str:
+    """Output file prefix, known before the template is read (so duplicates can be rejected up front)."""
+    if job.name:
+        return job.name.replace("/", "_").replace("\\", "_")
+    parts = [os.path.splitext(os.path.basename(job.template))[0], f"lop{job.grade}" if job.grade is not None else "",
+             job.subject or "", job.semester or "", job.exam_type]
+    return "_".join(k for k in (normalize_key(str(x)).replace(" ", "") for x in parts) if k)
+
+def check_job_names(jobs: List[BatchJob]) -> None:
+    """Raise ValueError if two jobs would write the same files."""
+    seen: Dict[str, int] = {}
+    dups = []
+    for i, job in enumerate(jobs, start=1):
+        name = _job_name(job)
+        key = name.casefold()     # case-insensitive filesystems
+        if key in seen:
+            dups.append(f"việc #{seen[key]} và #{i} cùng tên '{name}'")
+        seen.setdefault(key, i)
+    if dups:
+        raise ValueError("Trùng tên đề (đặt \"name\" khác nhau cho từng việc): " + "; ".join(dups))
+
+def _ai_fill(items, ai_cfg: Dict, grade, subject: str, semester: str, rows: List[Dict]) -> int:
+    """Fill blank slots with AI; valid questions get content-hash ids and are appended to `rows`."""
+    if not any(not it.stem.strip() for it in items):
+        return 0
+    try:
+        ai_preflight(ai_cfg)
+    except AIError as e:
+        for it in items:
+            if not it.stem.strip():
+                it.marking_guide = f"(AI lỗi: {e})"
+        return 0
+    done = 0
+    for it in items:
+        if it.stem.strip():
+            continue
+        prompt = build_question_prompt(grade, subject, semester, it.topic, it.lesson, it.yccd, it.qtype, it.level, it.points)
+        try:
+            it.__dict__.update(ai_generate(ai_cfg, prompt, timeout=45, parse=parse_ai_question,
+                                           meta={"grade": grade, "subject": subject, "semester": semester,
+                                                 "lesson": it.lesson, "qtype": it.qtype, "level": it.level, "batch": True}))
+        except BudgetExceeded as e:
+            it.marking_guide = f"(AI lỗi: {e})"
+            break
+        except Exception as e:
+            it.marking_guide = f"(AI lỗi: {e})"
+            continue
+        row = bank_row(grade, subject, semester, asdict(it)) if grade is not None else None
+        if row and not validate_row(row):
+            it.question_id = row["question_id"]
+            rows.append(row)
+        elif not it.question_id:
+            it.question_id = f"AI_{grade}_{normalize_subject(subject)}_{normalize_semester(semester)}_{it.qtype}_M{it.level}_{it.qno:03d}"
+        done += 1
+    return done
+
+def _write(path: str, data: bytes) -> str:
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+def run_job(job: BatchJob, output_dir: str, points_per_qtype: Dict[str, float],
+            ai_cfg: Optional[Dict] = None, spec_template: Optional[str] = None,
+            bank: Optional[Bank] = None) -> BatchResult:
+    """Generate and export one exam. `bank` defaults to the worker's shared bank."""
+    bank = bank if bank is not None else _BANK
+    mx = load_matrix_template(job.template, total_points=float(job.total_points))
+    grade = job.grade if job.grade is not None else mx.grade
+    subject = normalize_subject(job.subject or mx.subject or "")
+    semester = normalize_semester(job.semester or mx.semester or "")
+    name = _job_name(job)
+    res = BatchResult(name=name, ok=False)
+    try:
+        items = build_slots_from_matrix(mx, points_per_qtype)
+        res.n_items = len(items)
+        if bank is not None and grade is not None:
+            items, warns = assign_auto(items, bank, int(grade), subject, semester, seed=job.seed)
+            res.warnings.extend(warns)
+        res.from_bank = sum(1 for it in items if it.question_id)
+        if ai_cfg and ai_cfg.get("ai_mode", "Tắt") != "Tắt":
+            res.ai_filled = _ai_fill(items, ai_cfg, grade, subject, semester, res.ai_rows)
+
+        dicts = [asdict(it) for it in items]
+        title = job.title or f"{EXAM_TYPE_TITLES.get(job.exam_type, 'ĐỀ KIỂM TRA')} - MÔN {subject.upper()} LỚP {grade}"
+        res.files.append(_write(os.path.join(output_dir, f"{name}_De.docx"),
+                                export_exam_docx(title=title, total_points=float(job.total_points), items=dicts, use_cache=False)))
+        if spec_template:
+            res.files.append(_write(os.path.join(output_dir, f"{name}_Bang_dac_ta.docx"),
+                                    export_spec_from_template(spec_template, mx, dicts, use_cache=False)))
+        res.ok = True
+    except Exception as e:
+        res.error = str(e)
+    return res
+
+def _resolve_ai_cfg(ai: Optional[Dict]) -> Optional[Dict]:
+    if not ai:
+        return None
+    cfg = dict(ai)
+    env = cfg.pop("api_key_env", None)
+    if env and not cfg.get("ai_api_key"):
+        cfg["ai_api_key"] = os.environ.get(env, "")
+    return cfg
+
+def run_batch(jobs: List[BatchJob], output_dir: str, bank_path: Optional[str] = None,
+              points_per_qtype: Optional[Dict[str, float]] = None, ai_cfg: Optional[Dict] = None,
+              spec_template: Optional[str] = None, workers: Optional[int] = None,
+              ai_bank_dir: Optional[str] = None) -> List[BatchResult]:
+    """Run independent exam jobs in a process pool (banks loaded once per worker).
+
+    AI questions of each finished job are added to the store at `ai_bank_dir` here, in this
+    process, as soon as the job's result arrives.
+    """
+    check_job_names(jobs)
+    os.makedirs(output_dir, exist_ok=True)
+    pts = dict(points_per_qtype or DEFAULT_POINTS_PER_QTYPE)
+    workers = workers or os.cpu_count() or 1
+    store = BankStore(ai_bank_dir) if ai_bank_dir else None
+    results: List[BatchResult] = []
+
+    def done(res: BatchResult) -> None:
+        if store is not None and res.ai_rows:
+            store.add(res.ai_rows)
+        results.append(res)
+
+    if workers <= 1 or len(jobs) <= 1:
+        _init_worker(bank_path, ai_bank_dir)
+        for j in jobs:
+            done(_safe_run(j, output_dir, pts, ai_cfg, spec_template))
+        return results
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), initializer=_init_worker,
+                             initargs=(bank_path, ai_bank_dir)) as ex:
+        futs = {ex.submit(_safe_run, j, output_dir, pts, ai_cfg, spec_template): j for j in jobs}
+        for fut in as_completed(futs):
+            done(fut.result())
+    return sorted(results, key=lambda r: r.name)
+
+def _safe_run(job: BatchJob, output_dir: str, pts: Dict[str, float], ai_cfg: Optional[Dict],
+              spec_template: Optional[str]) -> BatchResult:
+    try:
+        return run_job(job, output_dir, pts, ai_cfg, spec_template)
+    except Exception as e:
+        return BatchResult(name=_job_name(job), ok=False, error=str(e))
+
+def load_manifest(path: str) -> Dict:
+    with open(path, "r", encoding="utf-8") as f:
+        man = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+
+    def _abs(p: Optional[str]) -> Optional[str]:
+        return p if not p or os.path.isabs(p) else os.path.join(base, p)
+
+    jobs = []
+    for j in man.get("jobs", []):
+        j = dict(j)
+        j["template"] = _abs(j["template"])
+        jobs.append(BatchJob(**j))
+    return {
+        "jobs": jobs,
+        "bank": _abs(man.get("bank")),
+        "spec_template": _abs(man.get("spec_template")),
+        "output_dir": _abs(man.get("output_dir")) or os.path.join(base, "outputs"),
+        "points_per_qtype": man.get("points_per_qtype"),
+        "ai": _resolve_ai_cfg(man.get("ai")),
+        "ai_bank": None if man.get("ai_bank") is False else (_abs(man.get("ai_bank")) or default_root()),
+    }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m tool.batch", description="Tạo hàng loạt đề kiểm tra (không cần giao diện).")
+    ap.add_argument("manifest", help="File JSON mô tả các đề cần tạo")
+    ap.add_argument("--out", help="Thư mục xuất (ghi đè output_dir trong manifest)")
+    ap.add_argument("--bank", help="Kho câu hỏi CSV/XLSX (ghi đè bank trong manifest)")
+    ap.add_argument("--workers", type=int, default=None, help="Số tiến trình song song (mặc định: số CPU)")
+    ap.add_argument("--no-ai", action="store_true", help="Không gọi AI, chỉ lấy từ kho")
+    args = ap.parse_args(argv)
+
+    man = load_manifest(args.manifest)
+    try:
+        check_job_names(man["jobs"])
+    except ValueError as e:
+        print(f"[LỖI] {e}", file=sys.stderr)
+        return 2
+    results = run_batch(
+        man["jobs"],
+        output_dir=args.out or man["output_dir"],
+        bank_path=args.bank or man["bank"],
+        points_per_qtype=man["points_per_qtype"],
+        ai_cfg=None if args.no_ai else man["ai"],
+        spec_template=man["spec_template"],
+        workers=args.workers,
+        ai_bank_dir=man["ai_bank"],
+    )
+    n_fail = 0
+    for r in results:
+        if r.ok:
+            print(f"[OK]   {r.name}: {r.n_items} câu (kho {r.from_bank}, AI {r.ai_filled}) -> {', '.join(r.files)}")
+        else:
+            n_fail += 1
+            print(f"[LỖI] {r.name}: {r.error}", file=sys.stderr)
+    print(f"Xong {len(results) - n_fail}/{len(results)} đề.")
+    return 1 if n_fail else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
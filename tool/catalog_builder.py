@@ -1,14 +1,18 @@
 
 from __future__ import annotations
 
+import hashlib
+import json
 import os
 import re
-from typing import Dict, List, Optional
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
-import openpyxl
-from docx import Document
+
+from .normalize import SUBJECT_ALIASES, normalize_key
 
 # ====== Helpers ======
 def _clean(x) -> str:
@@ -44,25 +48,27 @@ def _parse_grade_from_filename(name: str) -> Optional[int]:
     m = re.search(r"([1-5])", name)
     return int(m.group(1)) if m else None
 
-def _find_header_rows(df: pd.DataFrame) -> List[int]:
-    hdr: List[int] = []
-    for i in range(len(df)):
-        row = [_clean(x) for x in df.iloc[i].tolist()]
-        joined = " ".join(row).lower()
-        if ("yêu cầu" in joined or "ycc" in joined) and ("bài" in joined or "các bài" in joined):
-            if any(k in joined for k in ["chủ đề", "tên chủ đề", "chủ điểm", "phần", "mạch"]):
-                hdr.append(i)
-    if not hdr:
-        for i in range(len(df)):
-            joined = " ".join([_clean(x) for x in df.iloc[i].tolist()]).lower()
-            if ("yêu cầu" in joined) and ("bài" in joined):
-                hdr.append(i)
-    # de-dup
-    out: List[int] = []
-    for x in hdr:
-        if x not in out:
-            out.append(x)
-    return out
+def _joined_lower(sdf: pd.DataFrame) -> pd.Series:
+    """Lower-cased " ".join of every row of an all-str frame (vectorised per column)."""
+    if sdf.shape[1] == 0:
+        return pd.Series([""] * len(sdf), index=sdf.index, dtype=object)
+    first, rest = sdf.iloc[:, 0], [sdf.iloc[:, j] for j in range(1, sdf.shape[1])]
+    return (first.str.cat(rest, sep=" ") if rest else first).str.lower()
+
+def _header_mask(joined: pd.Series, strict: bool = True) -> pd.Series:
+    if not strict:
+        return joined.str.contains("yêu cầu", regex=False) & joined.str.contains("bài", regex=False)
+    return (joined.str.contains("yêu cầu|ycc", regex=True)
+            & joined.str.contains("bài", regex=False)
+            & joined.str.contains("chủ đề|chủ điểm|phần|mạch", regex=True))
+
+def _find_header_rows(df: pd.DataFrame, joined: Optional[pd.Series] = None) -> List[int]:
+    if joined is None:
+        joined = _joined_lower(df.map(_clean))
+    hdr = np.flatnonzero(_header_mask(joined).to_numpy())
+    if not len(hdr):
+        hdr = np.flatnonzero(_header_mask(joined, strict=False).to_numpy())
+    return [int(i) for i in hdr]
 
 def _map_cols(header_row: List[str]) -> Dict[str, int]:
     cols: Dict[str, int] = {}
@@ -119,42 +125,74 @@ def _subject_from_sheet(sheet: str) -> Optional[str]:
     }
     return mapping.get(s)
 
+def _cell_str(v) -> str:
+    # same text pandas.read_excel would give (integral floats -> int)
+    if v is None:
+        return ""
+    if isinstance(v, float):
+        if np.isnan(v):
+            return ""
+        if v.is_integer():
+            v = int(v)
+    return str(v).strip()
+
+def _iter_sheet_frames(xlsx_path: str):
+    """Yield (sheet name, all-str DataFrame) streaming each sheet once in read-only mode."""
+    import openpyxl  # deferred: catalog sources are parsed rarely (cached CSV/fragments)
+    wb = openpyxl.load_workbook(xlsx_path, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            if not _subject_from_sheet(ws.title):
+                continue
+            rows = [[_cell_str(v) for v in row] for row in ws.iter_rows(values_only=True)]
+            while rows and not any(rows[-1]):
+                rows.pop()
+            width = max((len(r) for r in rows), default=0)
+            yield ws.title, pd.DataFrame([r + [""] * (width - len(r)) for r in rows], dtype=object)
+    finally:
+        wb.close()
+
+def _ffill_str(col: pd.Series) -> pd.Series:
+    return col.replace("", np.nan).ffill().fillna("")
+
+def _norm_spaces_col(col: pd.Series) -> pd.Series:
+    return col.str.replace(r"\s+", " ", regex=True).str.strip()
+
 def parse_xlsx_to_catalog(xlsx_path: str) -> pd.DataFrame:
     """Parse the provided KHGD excel format into a normalized YCCĐ catalog."""
     grade = _parse_grade_from_filename(os.path.basename(xlsx_path))
     if grade is None:
         raise ValueError(f"Không xác định được lớp từ tên file: {os.path.basename(xlsx_path)}")
 
-    wb = openpyxl.load_workbook(xlsx_path, data_only=True)
-    out_rows: List[dict] = []
+    parts: List[pd.DataFrame] = []
 
-    for sheet in wb.sheetnames:
+    for sheet, df in _iter_sheet_frames(xlsx_path):
         subject = _subject_from_sheet(sheet)
-        if not subject:
-            continue
-        # pandas read
-        df = pd.read_excel(xlsx_path, sheet_name=sheet, header=None)
-        if df is None or df.empty:
+        if df.empty:
             continue
 
-        hdrs = _find_header_rows(df)
+        joined = _joined_lower(df)
+        hdrs = _find_header_rows(df, joined)
         if not hdrs:
             continue
 
         # TV2 topic order (for semester splitting)
         tv2_order: List[str] = []
-        if grade == 2 and subject == "Tiếng Việt":
+        if grade == 2 and subject == "Tiếng Việt" and df.shape[1] > 1:
             # header row 0; topic in col 1 usually
-            for i in range(hdrs[0] + 1, len(df)):
-                t = _clean(df.iloc[i, 1] if df.shape[1] > 1 else "")
-                if t and t.lower() not in {"tên chủ đề"} and t not in tv2_order:
-                    tv2_order.append(t)
+            t = df.iloc[hdrs[0] + 1:, 1]
+            tv2_order = pd.unique(t[(t != "") & (t.str.lower() != "tên chủ đề")]).tolist()
+
+        # accidental duplicated header rows inside a segment
+        dup_hdr = (joined.str.contains("yêu cầu", regex=False) & joined.str.contains("bài", regex=False)
+                   & (joined.str.contains("chủ đề", regex=False) | joined.str.contains("chủ điểm", regex=False))).to_numpy()
 
         for seg_idx, h in enumerate(hdrs):
-            header = [_clean(x) for x in df.iloc[h].tolist()]
-            cols = _map_cols(header)
+            cols = _map_cols(df.iloc[h].tolist())
             start = h + 1
             end = (hdrs[seg_idx + 1] - 1) if seg_idx + 1 < len(hdrs) else (len(df) - 1)
+            if end < start:
+                continue
 
             seg_sem = ""
             if "semester" not in cols and len(hdrs) >= 2:
@@ -163,65 +201,49 @@ def parse_xlsx_to_catalog(xlsx_path: str) -> pd.DataFrame:
                 elif seg_idx == 1:
                     seg_sem = "HK2"
 
-            last_topic = ""
-            last_lesson = ""
-            last_bai = ""
-            for r in range(start, end + 1):
-                row = df.iloc[r].tolist()
-                joined = " ".join([_clean(x) for x in row]).lower()
-                # skip accidental duplicated header rows
-                if ("yêu cầu" in joined and "bài" in joined and ("chủ đề" in joined or "chủ điểm" in joined)) and r != start:
-                    continue
-
-                topic = _clean(row[cols["topic"]]) if "topic" in cols else ""
-                if topic:
-                    last_topic = topic
-                else:
-                    topic = last_topic
-
-                lesson = _clean(row[cols["lesson"]]) if "lesson" in cols else ""
-                if lesson:
-                    last_lesson = lesson
+            keep = ~dup_hdr[start:end + 1]
+            keep[0] = True
+            seg = df.iloc[start:end + 1][keep]
+            empty = pd.Series("", index=seg.index, dtype=object)
+            topic = _ffill_str(seg[cols["topic"]]) if "topic" in cols else empty
+            lesson = _ffill_str(seg[cols["lesson"]]) if "lesson" in cols else empty
+            bai = _ffill_str(seg[cols["bai"]]) if "bai" in cols else empty
+            yccd = seg[cols["yccd"]] if "yccd" in cols else empty
+
+            ok = (yccd != "").to_numpy()
+            if not ok.any():
+                continue
+            topic, lesson, bai, yccd = topic[ok], lesson[ok], bai[ok], yccd[ok]
+
+            if "semester" in cols:
+                semester = seg[cols["semester"]][ok].map(_semester_from_value)
+            else:
+                semester = empty[ok]
+            if (semester == "").any():
+                if grade == 2 and subject == "Toán":
+                    fb = topic.map(_infer_semester_grade2_toan)
+                elif grade == 2 and subject == "Tiếng Việt":
+                    fb = topic.map(lambda t: _semester_tv2(t, tv2_order))
                 else:
-                    lesson = last_lesson
-
-                bai = _clean(row[cols["bai"]]) if "bai" in cols else ""
-                if bai:
-                    last_bai = bai
-                else:
-                    bai = last_bai
-
-                yccd = _clean(row[cols["yccd"]]) if "yccd" in cols else ""
-                if not yccd:
-                    continue
-
-                semester = ""
-                if "semester" in cols:
-                    semester = _semester_from_value(row[cols["semester"]])
-                if not semester:
-                    if grade == 2 and subject == "Toán":
-                        semester = _infer_semester_grade2_toan(topic)
-                    elif grade == 2 and subject == "Tiếng Việt":
-                        semester = _semester_tv2(topic, tv2_order)
-                    else:
-                        semester = seg_sem
-
-                lesson_str = _norm_spaces(lesson)
-                if bai and bai != "-" and lesson_str and not re.match(r"^\s*Bài", lesson_str, flags=re.I):
-                    lesson_str = _norm_spaces(f"Bài {bai}: {lesson_str}")
-                elif bai and bai != "-" and not lesson_str:
-                    lesson_str = f"Bài {bai}"
-
-                out_rows.append({
-                    "grade": grade,
-                    "subject": subject,
-                    "semester": semester,
-                    "topic": _norm_spaces(topic),
-                    "lesson": _norm_spaces(lesson_str),
-                    "yccd": _norm_spaces(yccd),
-                })
-
-    df_out = pd.DataFrame(out_rows)
+                    fb = pd.Series(seg_sem, index=topic.index, dtype=object)
+                semester = semester.where(semester != "", fb)
+
+            lesson_str = _norm_spaces_col(lesson)
+            has_bai = (bai != "") & (bai != "-")
+            prefix = has_bai & (lesson_str != "") & ~lesson_str.str.match(r"^\s*Bài", case=False)
+            lesson_str = lesson_str.where(~prefix, _norm_spaces_col("Bài " + bai + ": " + lesson_str))
+            lesson_str = lesson_str.where(~(has_bai & (lesson_str == "")), "Bài " + bai)
+
+            parts.append(pd.DataFrame({
+                "grade": grade,
+                "subject": subject,
+                "semester": semester.to_numpy(),
+                "topic": _norm_spaces_col(topic).to_numpy(),
+                "lesson": _norm_spaces_col(lesson_str).to_numpy(),
+                "yccd": _norm_spaces_col(yccd).to_numpy(),
+            }))
+
+    df_out = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
     if df_out.empty:
         return df_out
 
@@ -230,55 +252,282 @@ def parse_xlsx_to_catalog(xlsx_path: str) -> pd.DataFrame:
     df_out = df_out.drop_duplicates(subset=["grade","subject","semester","topic","lesson","yccd"]).reset_index(drop=True)
     return df_out
 
-def parse_tin_doc_grade5(doc_path: str) -> pd.DataFrame:
-    """Fallback Tin lớp 5 from docx (no semester info -> blank semester)."""
-    doc = Document(doc_path)
-    if len(doc.tables) < 4:
-        return pd.DataFrame(columns=["grade","subject","semester","topic","lesson","yccd"])
-    t = doc.tables[3]  # grade 5 details in provided doc
-    rows = []
-    current_topic = ""
-    for ridx, row in enumerate(t.rows):
-        if ridx == 0:
+# ====== DOCX (Word) sources ======
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+(_W_TR, _W_TC, _W_P, _W_T, _W_TAB, _W_BR, _W_CR, _W_TRPR, _W_TCPR, _W_GRIDBEFORE, _W_GRIDSPAN, _W_VMERGE, _W_VAL) = (
+    _W + t for t in "tr tc p t tab br cr trPr tcPr gridBefore gridSpan vMerge val".split())
+_RE_GRADE = re.compile(r"^(?:lop|khoi)\s*([1-5])\b")
+_RE_TOPIC_ROW = re.compile(r"^(chủ đề|chủ điểm|mạch|phần)\b", re.I)
+
+def _docx_text(el) -> str:
+    """Paragraph text the way python-docx reports it (runs joined, tab/br kept)."""
+    out = []
+    for node in el.iter(_W_T, _W_TAB, _W_BR, _W_CR):
+        tag = node.tag
+        out.append(node.text or "" if tag == _W_T else ("\t" if tag == _W_TAB else "\n"))
+    return "".join(out)
+
+def _docx_grid(tbl) -> List[List[str]]:
+    """Rows of a w:tbl as grid-aligned, space-normalised cell texts.
+
+    gridSpan: the text sits in the first spanned column, the others are "".
+    vMerge continuation: repeats the text of the merged cell above (as python-docx does)."""
+    grid: List[List[str]] = []
+    above: Dict[int, str] = {}
+    for tr in tbl.iterchildren(_W_TR):
+        row: List[str] = []
+        trpr = tr.find(_W_TRPR)
+        before = trpr.find(_W_GRIDBEFORE) if trpr is not None else None
+        if before is not None:
+            row.extend([""] * int(before.get(_W_VAL, "0") or 0))
+        for tc in tr.iterchildren(_W_TC):
+            tcpr = tc.find(_W_TCPR)
+            span, cont = 1, False
+            if tcpr is not None:
+                g = tcpr.find(_W_GRIDSPAN)
+                if g is not None:
+                    span = max(1, int(g.get(_W_VAL, "1") or 1))
+                vm = tcpr.find(_W_VMERGE)
+                cont = vm is not None and vm.get(_W_VAL, "continue") != "restart"
+            col = len(row)
+            if cont:
+                text = above.get(col, "")
+            else:
+                text = _norm_spaces("\n".join(_docx_text(p) for p in tc.iterchildren(_W_P)))
+                above[col] = text
+            row.extend([text] + [""] * (span - 1))
+        grid.append(row)
+    width = max((len(r) for r in grid), default=0)
+    return [r + [""] * (width - len(r)) for r in grid]
+
+def _subject_from_text(text: str) -> Optional[str]:
+    """Subject named after "môn ..." (or anywhere as a last resort) in a file name / heading."""
+    k = normalize_key(text)
+    m = re.search(r"\bmon\s+(.+)$", k)
+    for scope in ([m.group(1)] if m else []) + [k]:
+        for alias in sorted(SUBJECT_ALIASES, key=len, reverse=True):
+            if len(alias) > 3 and re.search(rf"(?:^|\b){re.escape(alias)}\b", scope):
+                return SUBJECT_ALIASES[alias]
+    return None
+
+def _docx_table_rows(grid: List[List[str]], grade: int, subject: str) -> List[dict]:
+    df = pd.DataFrame(grid, dtype=object)
+    joined = _joined_lower(df)
+    # header cells are short labels; a long YCCĐ cell that happens to mention "yêu cầu ... bài" is data
+    hdrs = [h for h in _find_header_rows(df, joined) if df.iloc[h].str.len().max() <= 60]
+    if not hdrs:
+        # two-column "Nội dung | Yêu cầu cần đạt" tables: header = first rows mapping yccd + lesson/topic
+        hdrs = [i for i in range(min(3, len(df)))
+                if "yccd" in (c := _map_cols(df.iloc[i].tolist())) and ({"lesson", "topic"} & set(c))][:1]
+    out: List[dict] = []
+    for seg_idx, h in enumerate(hdrs):
+        cols = _map_cols(df.iloc[h].tolist())
+        if "yccd" not in cols:
             continue
-        c0 = _norm_spaces(row.cells[0].text)
-        c1 = _norm_spaces(row.cells[1].text if len(row.cells) > 1 else "")
-        if not c0:
+        end = hdrs[seg_idx + 1] if seg_idx + 1 < len(hdrs) else len(df)
+        seg_sem = "" if "semester" in cols or len(hdrs) < 2 else ("HK1" if seg_idx == 0 else "HK2" if seg_idx == 1 else "")
+        topic = lesson = bai = ""
+        for row in grid[h + 1:end]:
+            get = lambda f: row[cols[f]] if f in cols else ""
+            yccd = get("yccd")
+            if not yccd:
+                first = next((v for v in row if v), "")
+                if _RE_TOPIC_ROW.match(first):
+                    topic = first
+                continue
+            topic = get("topic") or topic
+            lesson = get("lesson") or lesson
+            bai = get("bai") or bai
+            if not lesson and not bai:
+                continue
+            name = lesson
+            if bai and bai != "-":
+                name = lesson if re.match(r"^\s*Bài", lesson, flags=re.I) else (f"Bài {bai}: {lesson}" if lesson else f"Bài {bai}")
+            out.append({
+                "grade": grade,
+                "subject": subject,
+                "semester": _semester_from_value(get("semester")) or seg_sem,
+                "topic": topic,
+                "lesson": _norm_spaces(name),
+                "yccd": yccd,
+            })
+    return out
+
+def parse_docx_to_catalog(docx_path: str) -> pd.DataFrame:
+    """YCCĐ catalog rows from every table of a curriculum Word file, one pass over document.xml.
+
+    Tables are recognised by their header row (same rules as the Excel sources). The grade is
+    taken from the last "LỚP n"/"KHỐI n" heading above a table (else from the file name), the
+    subject from "môn ..." in the file name or the headings; tables without a grade are skipped."""
+    import zipfile
+    from lxml import etree  # python-docx dependency; raw XML is much faster than Table.rows/.cells
+    with zipfile.ZipFile(docx_path) as z:
+        body = etree.fromstring(z.read("word/document.xml")).find(f"{_W}body")
+    name = os.path.splitext(os.path.basename(docx_path))[0]
+    m = _RE_GRADE.search(normalize_key(name))
+    grade = int(m.group(1)) if m else None
+    subject = _subject_from_text(name)
+    rows: List[dict] = []
+    for el in body.iterchildren(f"{_W}p", f"{_W}tbl"):
+        if el.tag == f"{_W}p":
+            text = _norm_spaces(_docx_text(el))
+            if not text or len(text) > 60:
+                continue
+            k = normalize_key(text)
+            m = _RE_GRADE.match(k)
+            if m:
+                grade = int(m.group(1))
+            elif subject is None and re.search(r"\bmon\s", k):
+                subject = _subject_from_text(text)
             continue
-        if c0.lower().startswith("chủ đề"):
-            current_topic = c0.replace("Chủ đề A.", "Chủ đề A:").replace("Chủ đề B.", "Chủ đề B:").replace("Chủ đề C.", "Chủ đề C:") \
-                             .replace("Chủ đề D.", "Chủ đề D:").replace("Chủ đề E.", "Chủ đề E:").replace("Chủ đề F.", "Chủ đề F:")
+        if grade is None or subject is None:
             continue
-        if not c1:
+        rows.extend(_docx_table_rows(_docx_grid(el), grade, subject))
+    df = pd.DataFrame(rows, columns=["grade","subject","semester","topic","lesson","yccd"])
+    if df.empty:
+        return df
+    df["topic"] = df["topic"].str.replace(r"Chủ\s*đề\s*([A-F])\.", r"Chủ đề \1:", regex=True)
+    return df.drop_duplicates().reset_index(drop=True)
+
+CATALOG_COLS = ["grade","subject","semester","topic","lesson","yccd"]
+CACHE_DIRNAME = ".catalog_cache"
+MANIFEST_NAME = "manifest.json"
+ERRORS_NAME = "errors.json"        # {file name: error} of the last build, read back by the app
+PARSER_VERSION = 3   # bump when parsing changes so cached fragments are re-parsed
+
+def _file_hash(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _fragment_name(name: str, digest: str) -> str:
+    """Fragment file for one source: the grade can come from the file name, so the name is part of the key."""
+    return hashlib.sha1(f"{name}\x1f{digest}\x1f{PARSER_VERSION}".encode("utf-8")).hexdigest() + ".pkl"
+
+def _list_sources(source_dir: str) -> List[str]:
+    return sorted(f for f in os.listdir(source_dir) if f.lower().endswith((".xlsx", ".docx")) and not f.startswith("~$"))
+
+def _parse_source(path: str) -> pd.DataFrame:
+    if path.lower().endswith(".docx"):
+        return parse_docx_to_catalog(path).assign(_docx=True)
+    return parse_xlsx_to_catalog(path)
+
+def _parse_to_fragment(path: str, frag_path: str) -> Tuple[str, Optional[str]]:
+    """Worker: parse one source file and store its fragment as a pickle. Returns (path, error)."""
+    try:
+        df = _parse_source(path)
+        df.to_pickle(frag_path)
+        return path, None
+    except Exception as e:
+        return path, f"{type(e).__name__}: {e}"
+
+def _load_manifest(cache_dir: str) -> Dict[str, dict]:
+    try:
+        with open(os.path.join(cache_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def _save_manifest(cache_dir: str, manifest: Dict[str, dict]) -> None:
+    tmp = os.path.join(cache_dir, MANIFEST_NAME + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, os.path.join(cache_dir, MANIFEST_NAME))
+
+def load_build_errors(source_dir: str, cache_dir: Optional[str] = None) -> Dict[str, str]:
+    """Per-file failures of the last build ({} if none or never built)."""
+    try:
+        with open(os.path.join(cache_dir or os.path.join(source_dir, CACHE_DIRNAME), ERRORS_NAME), "r", encoding="utf-8") as f:
+            return dict(json.load(f))
+    except Exception:
+        return {}
+
+def build_catalog_incremental(source_dir: str, cache_dir: Optional[str] = None,
+                              workers: Optional[int] = None) -> Tuple[pd.DataFrame, Dict[str, str]]:
+    """Parse only the sources whose (size, mtime, sha1) changed since the last build.
+
+    Each source's parsed rows are cached as a pickled fragment in `cache_dir`
+    (default: `<source_dir>/.catalog_cache`); changed files are parsed in a process pool.
+    Returns the merged (un-cleaned) catalog and a {file name: error} dict for failures.
+    """
+    cache_dir = cache_dir or os.path.join(source_dir, CACHE_DIRNAME)
+    os.makedirs(cache_dir, exist_ok=True)
+    old = _load_manifest(cache_dir)
+    manifest: Dict[str, dict] = {}
+    todo: List[Tuple[str, str]] = []
+    errors: Dict[str, str] = {}
+
+    for name in _list_sources(source_dir):
+        path = os.path.join(source_dir, name)
+        st_ = os.stat(path)
+        prev = old.get(name)
+        if prev and prev.get("parser") != PARSER_VERSION:
+            prev = None
+        if prev and prev.get("size") == st_.st_size and prev.get("mtime") == st_.st_mtime_ns \
+                and os.path.exists(os.path.join(cache_dir, prev["fragment"])):
+            manifest[name] = prev
             continue
-        rows.append({
-            "grade": 5,
-            "subject": "Tin",
-            "semester": "",
-            "topic": current_topic,
-            "lesson": c0,
-            "yccd": c1
-        })
-    return pd.DataFrame(rows)
-
-def build_catalog_from_sources(source_dir: str, output_csv: Optional[str] = None) -> pd.DataFrame:
-    """Build catalog from KHGD sources (xlsx)."""
-    xlsx_paths = [os.path.join(source_dir, f) for f in os.listdir(source_dir) if f.lower().endswith(".xlsx")]
+        digest = _file_hash(path)
+        entry = {"size": st_.st_size, "mtime": st_.st_mtime_ns, "sha1": digest, "fragment": _fragment_name(name, digest), "parser": PARSER_VERSION}
+        manifest[name] = entry
+        if prev and prev.get("sha1") == digest and os.path.exists(os.path.join(cache_dir, prev["fragment"])):
+            continue  # touched but unchanged
+        todo.append((path, os.path.join(cache_dir, entry["fragment"])))
+
+    if todo:
+        workers = min(workers or os.cpu_count() or 1, len(todo))
+        if workers <= 1:
+            results = [_parse_to_fragment(p, fp) for p, fp in todo]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as ex:
+                results = list(ex.map(_parse_to_fragment, *zip(*todo)))
+        for path, err in results:
+            if err:
+                name = os.path.basename(path)
+                errors[name] = err
+                manifest.pop(name, None)
+
     frames: List[pd.DataFrame] = []
-    for p in sorted(xlsx_paths):
+    for name, entry in manifest.items():
         try:
-            frames.append(parse_xlsx_to_catalog(p))
-        except Exception:
-            # ignore broken files
-            continue
-    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["grade","subject","semester","topic","lesson","yccd"])
-
-    # Tin lớp 5 fallback if present
-    tin_doc = os.path.join(source_dir, "04. Yeu cau can dat mon TIN HOC.docx")
-    if os.path.exists(tin_doc):
-        df2 = parse_tin_doc_grade5(tin_doc)
-        if not df2.empty:
-            df = pd.concat([df, df2], ignore_index=True)
+            frames.append(pd.read_pickle(os.path.join(cache_dir, entry["fragment"])))
+        except Exception as e:
+            errors[name] = f"Không đọc được bản đệm: {e}"
+
+    # drop fragments no longer referenced
+    live = {e["fragment"] for e in manifest.values()}
+    for f in os.listdir(cache_dir):
+        if f.endswith(".pkl") and f not in live:
+            try:
+                os.remove(os.path.join(cache_dir, f))
+            except OSError:
+                pass
+    _save_manifest(cache_dir, manifest)
+    with open(os.path.join(cache_dir, ERRORS_NAME), "w", encoding="utf-8") as f:
+        json.dump(errors, f, ensure_ascii=False, indent=1)
+
+    frames = [f for f in frames if not f.empty]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=CATALOG_COLS)
+    return df, errors
+
+def build_catalog_from_sources(source_dir: str, output_csv: Optional[str] = None,
+                               cache_dir: Optional[str] = None, workers: Optional[int] = None) -> pd.DataFrame:
+    """Build catalog from KHGD sources (xlsx + YCCĐ docx), re-parsing only changed files.
+
+    Word rows only fill (grade, subject) pairs the Excel plans lack: the plans carry semesters.
+    Per-file failures are warned about, kept in `df.attrs["build_errors"]` ({file name: error})
+    and saved for `load_build_errors`.
+    """
+    df, errors = build_catalog_incremental(source_dir, cache_dir=cache_dir, workers=workers)
+    for name, err in errors.items():
+        warnings.warn(f"Bỏ qua nguồn KHGD '{name}': {err}", stacklevel=2)
+    if "_docx" in df.columns:
+        from_doc = df["_docx"].fillna(False).astype(bool)
+        have = set(zip(df.loc[~from_doc, "grade"], df.loc[~from_doc, "subject"]))
+        dup = pd.Series([k in have for k in zip(df["grade"], df["subject"])], index=df.index)
+        df = df[~(from_doc & dup)].drop(columns="_docx")
 
     # final cleanup
     for c in ["subject","semester","topic","lesson","yccd"]:
@@ -286,17 +535,20 @@ def build_catalog_from_sources(source_dir: str, output_csv: Optional[str] = None
             df[c] = ""
         df[c] = df[c].fillna("").astype(str).map(_norm_spaces)
     df["grade"] = pd.to_numeric(df.get("grade"), errors="coerce").astype("Int64")
-    df = df.dropna(subset=["grade"]).drop_duplicates(subset=["grade","subject","semester","topic","lesson","yccd"]).reset_index(drop=True)
+    df = df.dropna(subset=["grade"]).drop_duplicates(subset=CATALOG_COLS).reset_index(drop=True)
+    df.attrs["build_errors"] = errors
 
     if output_csv:
         os.makedirs(os.path.dirname(output_csv) or ".", exist_ok=True)
         df.to_csv(output_csv, index=False, encoding="utf-8-sig")
     return df
 
-def load_or_build_catalog(csv_path: str, source_dir: str) -> pd.DataFrame:
+def load_or_build_catalog(csv_path: str, source_dir: str) -> Tuple[pd.DataFrame, Dict[str, str]]:
+    """Catalog CSV (rebuilt from sources if missing/broken) and the per-file errors of the last build."""
     if os.path.exists(csv_path):
         try:
-            return pd.read_csv(csv_path)
+            return pd.read_csv(csv_path), load_build_errors(source_dir)
         except Exception:
             pass
-    return build_catalog_from_sources(source_dir, output_csv=csv_path)
+    df = build_catalog_from_sources(source_dir, output_csv=csv_path)
+    return df, dict(df.attrs.get("build_errors", {}))
@@ -0,0 +1,128 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+import threading
+
+import pandas as pd
+
+from .normalize import normalize_subject, normalize_semester, normalize_series
+from .profiling import timed
+
+PREP_COLS = ["grade","subject","semester","topic","lesson","yccd","grade_norm","subject_norm","semester_norm"]
+
+def _norm_text(x: str) -> str:
+    return str(x or "").strip()
+
+@timed("catalog.prep")
+def prep_catalog(df: pd.DataFrame) -> pd.DataFrame:
+    if df is None or df.empty:
+        return pd.DataFrame(columns=PREP_COLS)
+    d = df.copy()
+    d["grade_norm"] = pd.to_numeric(d.get("grade", pd.Series([], dtype="float")), errors="coerce").fillna(-1).astype(int)
+    d["subject_norm"] = normalize_series(d.get("subject", pd.Series("", index=d.index)), normalize_subject)
+    d["semester_norm"] = normalize_series(d.get("semester", pd.Series("", index=d.index)), normalize_semester, "")
+    for c in ["topic","lesson","yccd"]:
+        d[c] = normalize_series(d.get(c, pd.Series("", index=d.index)), _norm_text)
+    return d
+
+@timed("catalog.cascade_filter")
+def cascade_filter(cat: pd.DataFrame, grade: int, subject: str, semester: str) -> pd.DataFrame:
+    subj = normalize_subject(subject)
+    sem = normalize_semester(semester)
+    d1 = cat[(cat["grade_norm"] == int(grade)) | (cat["grade_norm"] == -1)]
+    d2 = d1[(d1["subject_norm"].str.lower() == subj.lower()) | (d1["subject_norm"].str.strip() == "")]
+    d3 = d2[(d2["semester_norm"].str.upper() == sem.upper()) | (d2["semester_norm"].str.strip() == "")]
+    return d3
+
+def _sorted_nonblank(values) -> List[str]:
+    return sorted({str(v) for v in values if str(v).strip()})
+
+@dataclass
+class CascadeView:
+    """Dropdown options for one (grade, subject, semester), wildcard rows included."""
+    topics: List[str]
+    lessons: Dict[str, List[str]]                     # topic -> sorted lessons
+    yccds: Dict[Tuple[str, str], List[str]]           # (topic, lesson) -> sorted distinct YCCĐ
+    yccd_rows: Dict[Tuple[str, str], List[str]]       # (topic, lesson) -> YCCĐ in catalog order (for matrix fill)
+
+    @staticmethod
+    def from_frame(d: pd.DataFrame) -> "CascadeView":
+        lessons: Dict[str, List[str]] = {}
+        yccds: Dict[Tuple[str, str], List[str]] = {}
+        yccd_rows: Dict[Tuple[str, str], List[str]] = {}
+        for (t, l), gdf in d.groupby(["topic","lesson"], sort=False):
+            y = gdf["yccd"].astype(str).tolist()
+            yccd_rows[(str(t), str(l))] = y
+            yccds[(str(t), str(l))] = _sorted_nonblank(y)
+        for t, gdf in d.groupby("topic", sort=False):
+            lessons[str(t)] = _sorted_nonblank(gdf["lesson"].unique())
+        return CascadeView(topics=_sorted_nonblank(d["topic"].unique()), lessons=lessons, yccds=yccds, yccd_rows=yccd_rows)
+
+@dataclass
+class CascadeIndex:
+    """Catalog compiled once into option lists for the Lớp → Môn → HK → Chủ đề → Bài → YCCĐ cascade.
+
+    Rows with grade -1 / blank subject / blank semester are wildcards and show up under every
+    matching selection. Views for combinations not present in the catalog are built on demand.
+    """
+    groups: Dict[Tuple[int, str, str], pd.DataFrame]
+    subjects: Dict[int, List[str]] = field(default_factory=dict)
+    semesters: Dict[Tuple[int, str], List[str]] = field(default_factory=dict)
+    views: Dict[Tuple[int, str, str], CascadeView] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @staticmethod
+    def build(cat_prepped: pd.DataFrame, grades=(1, 2, 3, 4, 5)) -> "CascadeIndex":
+        d = cat_prepped.assign(
+            _s=cat_prepped["subject_norm"].str.strip().str.lower(),
+            _h=cat_prepped["semester_norm"].str.strip().str.upper(),
+        )
+        groups = {(int(g), s, h): gdf for (g, s, h), gdf in d.groupby(["grade_norm","_s","_h"], sort=False)}
+        idx = CascadeIndex(groups=groups)
+        all_grades = sorted(set(grades) | {g for g, _, _ in groups if g != -1})
+        subj_keys = sorted({s for _, s, _ in groups if s})
+        sem_keys = sorted({h for _, _, h in groups if h} | {"HK1","HK2"})
+        for g in all_grades:
+            idx.subject_options(g)
+            for s in subj_keys:
+                idx.semester_options(g, s)
+                for h in sem_keys:
+                    idx.view(g, s, h)
+        return idx
+
+    def _parts(self, grade: int, subj: str | None = None, sem: str | None = None) -> List[pd.DataFrame]:
+        out = []
+        for (g, s, h), gdf in self.groups.items():
+            if g not in (grade, -1):
+                continue
+            if subj is not None and s not in (subj, ""):
+                continue
+            if sem is not None and h not in (sem, ""):
+                continue
+            out.append(gdf)
+        return out
+
+    def subject_options(self, grade: int) -> List[str]:
+        if int(grade) not in self.subjects:
+            parts = self._parts(int(grade))
+            self.subjects[int(grade)] = _sorted_nonblank(pd.concat([p["subject_norm"] for p in parts])) if parts else []
+        return self.subjects[int(grade)]
+
+    def semester_options(self, grade: int, subject: str) -> List[str]:
+        key = (int(grade), normalize_subject(subject).strip().lower())
+        if key not in self.semesters:
+            parts = self._parts(*key)
+            self.semesters[key] = _sorted_nonblank(pd.concat([p["semester_norm"] for p in parts])) if parts else []
+        return self.semesters[key]
+
+    def view(self, grade: int, subject: str, semester: str) -> CascadeView:
+        key = (int(grade), normalize_subject(subject).strip().lower(), normalize_semester(semester).strip().upper())
+        v = self.views.get(key)
+        if v is None:
+            with self._lock:
+                v = self.views.get(key)
+                if v is None:
+                    parts = self._parts(*key)
+                    d = pd.concat(parts).sort_index() if parts else pd.DataFrame(columns=PREP_COLS)
+                    v = self.views[key] = CascadeView.from_frame(d)
+        return v
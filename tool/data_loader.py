@@ -1,7 +1,9 @@
 from __future__ import annotations
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence
 import pandas as pd
-from .utils import normalize_subject, normalize_semester
-import re
+from .normalize import normalize_subject, normalize_semester, normalize_series
+from .profiling import timed
 
 REQUIRED = ["grade","subject","semester","topic","lesson","yccd"]
 
@@ -13,37 +15,64 @@ def load_catalog_csv(path: str) -> pd.DataFrame:
     df["grade"] = pd.to_numeric(df["grade"], errors="coerce").astype("Int64")
     for c in ["subject","semester","topic","lesson","yccd"]:
         df[c] = df[c].fillna("").astype(str).str.strip()
-    df["subject"] = df["subject"].apply(normalize_subject)
-    df["semester"] = df["semester"].apply(normalize_semester)
+    df["subject"] = normalize_series(df["subject"], normalize_subject)
+    df["semester"] = normalize_series(df["semester"], normalize_semester)
     return df
 
-def try_parse_catalog_from_excel(uploaded_file) -> pd.DataFrame:
-    xls = pd.ExcelFile(uploaded_file)
-    best = None
-    for sh in xls.sheet_names:
-        d = pd.read_excel(xls, sheet_name=sh)
-        cols = [str(c).strip().lower() for c in d.columns]
-        if any("ycc" in c for c in cols) and any("bài" in c or "lesson" in c for c in cols) and any("chủ" in c or "topic" in c for c in cols):
-            best = d
-            break
-    if best is None:
-        best = pd.read_excel(xls, sheet_name=xls.sheet_names[0])
-    rename = {}
-    for c in best.columns:
-        cl = str(c).strip().lower()
-        if "lớp" in cl or cl == "grade":
-            rename[c] = "grade"
-        elif "môn" in cl or cl == "subject":
-            rename[c] = "subject"
-        elif "hk" in cl or "học kì" in cl or cl == "semester":
-            rename[c] = "semester"
-        elif "chủ đề" in cl or cl == "topic":
-            rename[c] = "topic"
-        elif "bài" in cl or "nội dung" in cl or cl == "lesson":
-            rename[c] = "lesson"
-        elif "yêu cầu" in cl or "ycc" in cl or cl == "yccd":
-            rename[c] = "yccd"
-    df = best.rename(columns=rename)
+PROBE_ROWS = 8        # rows per sheet inspected for a header
+KEY_FIELDS = {"topic", "lesson", "yccd"}
+
+def _field_for(header) -> Optional[str]:
+    """Catalog column a header cell maps to (same substring rules as before)."""
+    cl = str(header if header is not None else "").strip().lower()
+    if not cl:
+        return None
+    if "lớp" in cl or cl == "grade":
+        return "grade"
+    if "môn" in cl or cl == "subject":
+        return "subject"
+    if "hk" in cl or "học kì" in cl or cl == "semester":
+        return "semester"
+    if "chủ đề" in cl or cl == "topic":
+        return "topic"
+    if "bài" in cl or "nội dung" in cl or cl == "lesson":
+        return "lesson"
+    if "yêu cầu" in cl or "ycc" in cl or cl == "yccd":
+        return "yccd"
+    return None
+
+def _header_mapping(cells: Sequence) -> Dict[str, int]:
+    """field -> column index; the first column wins when several map to one field."""
+    out: Dict[str, int] = {}
+    for j, c in enumerate(cells):
+        f = _field_for(c)
+        if f and f not in out:
+            out[f] = j
+    return out
+
+@dataclass
+class SheetProbe:
+    sheet: str
+    header_row: int               # 0-based
+    mapping: Dict[str, int]
+
+    @property
+    def score(self) -> int:
+        return len(self.mapping) + (10 if KEY_FIELDS <= set(self.mapping) else 0)
+
+    @property
+    def matches(self) -> bool:
+        return KEY_FIELDS <= set(self.mapping)
+
+def _best_header(sheet: str, rows: Iterable[Sequence]) -> SheetProbe:
+    best = SheetProbe(sheet, 0, {})
+    for r, cells in enumerate(rows):
+        p = SheetProbe(sheet, r, _header_mapping(cells))
+        if p.score > best.score:
+            best = p
+    return best
+
+def _finish(df: pd.DataFrame) -> pd.DataFrame:
     for c in REQUIRED:
         if c not in df.columns:
             df[c] = ""
@@ -51,7 +80,54 @@ def try_parse_catalog_from_excel(uploaded_file) -> pd.DataFrame:
     df["grade"] = pd.to_numeric(df["grade"], errors="coerce").astype("Int64")
     for c in ["subject","semester","topic","lesson","yccd"]:
         df[c] = df[c].fillna("").astype(str).str.strip()
-    df["subject"] = df["subject"].apply(normalize_subject)
-    df["semester"] = df["semester"].apply(normalize_semester)
-    df = df.dropna(subset=["topic","lesson"], how="all")
+    df["subject"] = normalize_series(df["subject"], normalize_subject)
+    df["semester"] = normalize_series(df["semester"], normalize_semester)
+    df = df[(df["topic"] != "") | (df["lesson"] != "") | (df["yccd"] != "")].reset_index(drop=True)
     return df
+
+def _pick(probes: List[SheetProbe], merge: bool) -> List[SheetProbe]:
+    hits = [p for p in probes if p.matches]
+    if not hits:
+        return [max(probes, key=lambda p: p.score)] if probes else []
+    return hits if merge else [hits[0]]
+
+def _parse_xlsx(source, merge: bool) -> pd.DataFrame:
+    # one read-only pass: PROBE_ROWS rows of every sheet, then only the chosen sheets in full
+    import openpyxl
+    wb = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        probes = [_best_header(ws.title, ws.iter_rows(max_row=PROBE_ROWS, values_only=True)) for ws in wb.worksheets]
+        frames = []
+        for p in _pick(probes, merge):
+            cols = list(p.mapping.items())
+            rows = [[row[j] if j < len(row) else None for _, j in cols]
+                    for row in wb[p.sheet].iter_rows(min_row=p.header_row + 2, values_only=True)]
+            frames.append(pd.DataFrame(rows, columns=[f for f, _ in cols], dtype=object))
+    finally:
+        wb.close()
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=REQUIRED)
+
+def _parse_xls(source, merge: bool) -> pd.DataFrame:
+    # legacy .xls: openpyxl cannot stream it; pandas with nrows for the probe
+    xls = pd.ExcelFile(source)
+    probes = [_best_header(sh, pd.read_excel(xls, sheet_name=sh, header=None, nrows=PROBE_ROWS).values.tolist())
+              for sh in xls.sheet_names]
+    frames = []
+    for p in _pick(probes, merge):
+        d = pd.read_excel(xls, sheet_name=p.sheet, header=None, skiprows=p.header_row + 1, usecols=sorted(p.mapping.values()))
+        d.columns = [f for f, _ in sorted(p.mapping.items(), key=lambda kv: kv[1])]
+        frames.append(d)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=REQUIRED)
+
+@timed("catalog.parse_excel")
+def try_parse_catalog_from_excel(uploaded_file, merge: bool = False) -> pd.DataFrame:
+    """YCCĐ catalog from a KHGD workbook.
+
+    Every sheet is probed on its first PROBE_ROWS rows for a header row with Chủ đề/Bài/YCCĐ
+    columns; only the first matching sheet (all matching sheets with `merge=True`) is then read
+    in full. Without any match the best-scoring sheet is used."""
+    name = str(getattr(uploaded_file, "name", uploaded_file)).lower()
+    if hasattr(uploaded_file, "seek"):
+        uploaded_file.seek(0)
+    df = _parse_xls(uploaded_file, merge) if name.endswith(".xls") else _parse_xlsx(uploaded_file, merge)
+    return _finish(df)
@@ -0,0 +1,75 @@
+"""Autosave of exam drafts (session_state["draft_items"]) to a local SQLite file.
+
+One row per (draft_id, qno). `sync()` keeps a digest of every item it has written and only
+upserts items whose content changed (and deletes removed ones), so a rerun that touched
+nothing costs a few hashes and no I/O.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+
+from .profiling import timed
+
+KEEP_DAYS = 30
+
+def _digest(item: dict) -> str:
+    return hashlib.sha1(json.dumps(item, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+class DraftStore:
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS draft_items (
+            draft_id TEXT NOT NULL, qno INTEGER NOT NULL, data TEXT NOT NULL, updated REAL NOT NULL,
+            PRIMARY KEY (draft_id, qno))""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS draft_items_updated ON draft_items(updated)")
+        self._seen: Dict[str, Dict[int, str]] = {}   # draft_id -> qno -> digest of what is on disk
+        self.prune()
+
+    def load(self, draft_id: str) -> List[dict]:
+        with self._lock:
+            rows = self._db.execute("SELECT qno, data FROM draft_items WHERE draft_id=? ORDER BY qno", (draft_id,)).fetchall()
+            items = [json.loads(d) for _, d in rows]
+            self._seen[draft_id] = {int(q): _digest(it) for (q, _), it in zip(rows, items)}
+        return items
+
+    @timed("draft.autosave")
+    def sync(self, draft_id: str, items: List[dict]) -> int:
+        """Write changed items, delete removed ones; returns the number of rows touched."""
+        with self._lock:
+            seen = self._seen.setdefault(draft_id, {})
+            now = {int(it.get("qno", 0)): it for it in items}
+            digests = {q: _digest(it) for q, it in now.items()}
+            upserts = [(draft_id, q, json.dumps(now[q], ensure_ascii=False, default=str), time.time())
+                       for q, d in digests.items() if seen.get(q) != d]
+            deletes = [(draft_id, q) for q in seen if q not in now]
+            if not upserts and not deletes:
+                return 0
+            self._db.execute("BEGIN")
+            try:
+                if upserts:
+                    self._db.executemany("INSERT OR REPLACE INTO draft_items(draft_id, qno, data, updated) VALUES (?,?,?,?)", upserts)
+                if deletes:
+                    self._db.executemany("DELETE FROM draft_items WHERE draft_id=? AND qno=?", deletes)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            self._seen[draft_id] = digests
+            return len(upserts) + len(deletes)
+
+    def prune(self, days: int = KEEP_DAYS) -> None:
+        """Forget drafts nobody touched for `days` days."""
+        with self._lock:
+            self._db.execute("""DELETE FROM draft_items WHERE draft_id IN (
+                SELECT draft_id FROM draft_items GROUP BY draft_id HAVING MAX(updated) < ?)""", (time.time() - days * 86400,))
@@ -1,92 +1,365 @@
 from __future__ import annotations
-from typing import List
-import os, json
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, List, Optional, Tuple, TypeVar
+from io import BytesIO
+import hashlib
+import json
+import os
+import threading
+import zipfile
 from copy import deepcopy
-from docx import Document
+from functools import lru_cache
 from .utils import QTYPE_ORDER, LEVEL_ORDER, fmt_ranges
 from .matrix_template import MatrixTemplate
+from .profiling import timed
+
+# ---- python-docx is imported on first use, not when the app starts ----
+def Document(*args):
+    from docx import Document as _Document
+    return _Document(*args)
+
+def OxmlElement(tag: str):
+    from docx.oxml import OxmlElement as _OxmlElement
+    return _OxmlElement(tag)
+
+@lru_cache(maxsize=None)
+def qn(tag: str) -> str:
+    from docx.oxml.ns import qn as _qn
+    return _qn(tag)
 
 DOCX_QTYPE_TO_COL_START = {"MCQ": 4, "TF": 7, "MATCH": 10, "FILL": 13, "ESSAY": 16}
 
-def _delete_row(table, row_idx: int):
-    tbl = table._tbl
-    tr = table.rows[row_idx]._tr
-    tbl.remove(tr)
-
-def export_spec_from_template(template_docx_path: str, output_path: str, matrix: MatrixTemplate, items: List[dict]) -> str:
-    doc = Document(template_docx_path)
-    table = doc.tables[0]
-
-    header_rows = 4
-    totals_rows = 3
-    current_rows = len(table.rows)
-    data_start = header_rows
-    data_end = current_rows - totals_rows
-
-    for ridx in range(data_end-1, data_start-1, -1):
-        _delete_row(table, ridx)
-
-    style_tr = deepcopy(table.rows[header_rows-1]._tr)
-    for _ in matrix.lessons:
-        table._tbl.insert(len(table.rows)-totals_rows, deepcopy(style_tr))
-
-    m = {}
-    for it in items:
-        key = (it.get("topic",""), it.get("lesson",""), it.get("qtype",""), int(it.get("level",1)))
-        m.setdefault(key, []).append(int(it.get("qno",0)))
-
-    for i, lesson in enumerate(matrix.lessons):
-        r = data_start + i
-        cells = table.rows[r].cells
-        cells[0].text = str(lesson.tt)
-        cells[1].text = lesson.topic or ""
-        cells[2].text = lesson.lesson or ""
-        if len(cells) > 3 and ("…" in cells[3].text or "." in cells[3].text):
-            cells[3].text = ""
-
-        for qtype in QTYPE_ORDER:
-            base = DOCX_QTYPE_TO_COL_START[qtype]
-            for lv in LEVEL_ORDER:
-                col = base + (lv-1)
-                nums = m.get((lesson.topic, lesson.lesson, qtype, lv), [])
-                txt = fmt_ranges(nums)
-                cells[col].text = f"Câu {txt}" if txt else ""
-
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    doc.save(output_path)
-    return output_path
-
-def export_exam_docx(output_path: str, title: str, total_points: float, items: List[dict]) -> str:
-    doc = Document()
+# ---- content-hash cache: re-downloading an unchanged draft does not rebuild the document ----
+_CACHE_MAX = 64
+_cache: "OrderedDict[str, object]" = OrderedDict()   # rendered bytes and compiled SpecTemplates
+_T = TypeVar("_T")
+_cache_lock = threading.Lock()
+
+def _content_key(*parts) -> str:
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(json.dumps(p, sort_keys=True, ensure_ascii=False, default=repr).encode("utf-8"))
+    return h.hexdigest()
+
+def _cached(key: str, build: Callable[[], _T], use_cache: bool) -> _T:
+    if use_cache:
+        with _cache_lock:
+            data = _cache.get(key)
+            if data is not None:
+                _cache.move_to_end(key)
+                return data
+    data = build()
+    if use_cache:
+        with _cache_lock:
+            _cache[key] = data
+            while len(_cache) > _CACHE_MAX:
+                _cache.popitem(last=False)
+    return data
+
+def _to_bytes(doc) -> bytes:
+    buf = BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+SPEC_HEADER_ROWS = 4
+SPEC_TOTALS_ROWS = 3
+
+def _text_of(tc) -> str:
+    return "".join(t.text or "" for t in tc.iter(qn("w:t")))
+
+def _set_tc_text(tc, text: str, ppr, rpr) -> None:
+    """Replace the content of a raw w:tc with one paragraph/run, keeping the prototype's formatting."""
+    for child in list(tc):
+        if child.tag != qn("w:tcPr"):
+            tc.remove(child)
+    p = OxmlElement("w:p")
+    if ppr is not None:
+        p.append(deepcopy(ppr))
+    r = OxmlElement("w:r")
+    if rpr is not None:
+        r.append(deepcopy(rpr))
+    t = OxmlElement("w:t")
+    t.set(qn("xml:space"), "preserve")
+    t.text = text
+    r.append(t)
+    p.append(r)
+    tc.append(p)
+
+class SpecTemplate:
+    """`đặc tả.docx` parsed once: skeleton without data rows + the data-row prototype.
+
+    The prototype `w:tr` is pre-filled with one formatted run per cell; `render()` clones it per
+    lesson and only sets the `w:t` texts (grid column -> tc mapped once), so no python-docx cell
+    grid is rebuilt per export.
+    """
+
+    def __init__(self, path: str, header_rows: int = SPEC_HEADER_ROWS, totals_rows: int = SPEC_TOTALS_ROWS):
+        doc = Document(path)
+        tbl = doc.tables[0]._tbl
+        trs = tbl.tr_lst
+        if len(trs) <= header_rows + totals_rows:
+            raise ValueError(f"Mẫu đặc tả '{os.path.basename(path)}' thiếu dòng dữ liệu mẫu: bảng đầu tiên có {len(trs)} dòng, "
+                             f"cần > {header_rows} dòng tiêu đề + {totals_rows} dòng tổng.")
+        self.header_rows = header_rows
+        self._proto = deepcopy(trs[header_rows])
+        for tr in trs[header_rows:len(trs) - totals_rows]:
+            tbl.remove(tr)
+        buf = BytesIO()
+        doc.save(buf)
+        self._skeleton = buf.getvalue()
+
+        self._grid_to_tc: List[int] = []
+        for i, tc in enumerate(self._proto.tc_lst):
+            self._grid_to_tc.extend([i] * int(tc.grid_span or 1))
+        c3 = _text_of(self._proto.tc_lst[self._grid_to_tc[3]]) if len(self._grid_to_tc) > 3 else ""
+        clear_col3 = "…" in c3 or "." in c3
+
+        # cells written per lesson: TT, topic, lesson, (YCCĐ placeholder), 15 qtype×level cells
+        self._cols = [0, 1, 2] + ([3] if clear_col3 else []) + \
+            [DOCX_QTYPE_TO_COL_START[q] + (lv-1) for q in QTYPE_ORDER for lv in LEVEL_ORDER]
+        self._cols = [c for c in self._cols if c < len(self._grid_to_tc)]
+        tcs = self._proto.tc_lst
+        for i in sorted({self._grid_to_tc[c] for c in self._cols}):
+            tc = tcs[i]
+            p = tc.find(qn("w:p"))
+            ppr = p.find(qn("w:pPr")) if p is not None else None
+            r = tc.find(".//" + qn("w:r"))
+            rpr = r.find(qn("w:rPr")) if r is not None else None
+            _set_tc_text(tc, "", ppr, rpr)
+
+    def render(self, matrix: MatrixTemplate, items: List[dict]) -> bytes:
+        doc = Document(BytesIO(self._skeleton))
+        tbl = doc.tables[0]._tbl
+        anchor = tbl.tr_lst[self.header_rows]  # first totals row
+
+        m = {}
+        for it in items:
+            key = (it.get("topic",""), it.get("lesson",""), it.get("qtype",""), int(it.get("level",1)))
+            m.setdefault(key, []).append(int(it.get("qno",0)))
+
+        for lesson in matrix.lessons:
+            tr = deepcopy(self._proto)
+            tcs = tr.tc_lst
+            texts = {c: "" for c in self._cols}
+            texts.update({0: str(lesson.tt), 1: lesson.topic or "", 2: lesson.lesson or ""})
+            for qtype in QTYPE_ORDER:
+                base = DOCX_QTYPE_TO_COL_START[qtype]
+                for lv in LEVEL_ORDER:
+                    txt = fmt_ranges(m.get((lesson.topic, lesson.lesson, qtype, lv), []))
+                    texts[base + (lv-1)] = f"Câu {txt}" if txt else ""
+            for c in self._cols:
+                tcs[self._grid_to_tc[c]].find(".//" + qn("w:t")).text = texts[c]
+            anchor.addprevious(tr)
+
+        return _to_bytes(doc)
+
+def get_spec_template(template_docx_path: str) -> SpecTemplate:
+    """Compiled template, kept in the export LRU (an edited file gets a new key; the old one ages out)."""
+    st_ = os.stat(template_docx_path)
+    key = _content_key("spec_template", os.path.abspath(template_docx_path), st_.st_mtime_ns, st_.st_size)
+    return _cached(key, lambda: SpecTemplate(template_docx_path), use_cache=True)
+
+@timed("export.spec")
+def export_spec_from_template(template_docx_path: str, matrix: MatrixTemplate, items: List[dict], use_cache: bool = True) -> bytes:
+    """Bảng đặc tả .docx as bytes (nothing is written to disk)."""
+    st_ = os.stat(template_docx_path)
+    key = _content_key("spec", template_docx_path, st_.st_mtime_ns, st_.st_size, repr(matrix), items)
+    return _cached(key, lambda: get_spec_template(template_docx_path).render(matrix, items), use_cache)
+
+_blank_docx: Optional[bytes] = None
+
+def _new_document():
+    """Fresh document from the default template, loaded from in-memory bytes (shared styles)."""
+    global _blank_docx
+    if _blank_docx is None:
+        _blank_docx = _to_bytes(Document())
+    return Document(BytesIO(_blank_docx))
+
+def warm_export() -> None:
+    """Import python-docx and build the blank document ahead of the first export."""
+    _new_document()
+
+def _sorted_items(items: List[dict]) -> List[dict]:
+    return sorted(items, key=lambda x: int(x.get("qno",0)))
+
+KEY_HEADERS = ["Câu", "Dạng", "Mức", "Điểm", "Đáp án", "Hướng dẫn chấm"]
+
+def _exam_start(title: str, total_points: float):
+    doc = _new_document()
     p = doc.add_paragraph(title)
     p.runs[0].bold = True
     doc.add_paragraph(f"Thang điểm: {total_points:g}").italic = True
     doc.add_paragraph("")
+    return doc
 
-    for it in sorted(items, key=lambda x: int(x.get("qno",0))):
-        qno = int(it.get("qno",0))
-        pts = it.get("points", 0)
-        stem = (it.get("stem","") or "").strip()
-        qtype = (it.get("qtype","") or "").upper()
-        options = it.get("options","")
-
-        p = doc.add_paragraph()
-        p.add_run(f"Câu {qno}. ").bold = True
-        p.add_run(f"({pts:g} điểm) ")
-        p.add_run(stem if stem else "[Chưa có nội dung câu]")
-
-        if qtype == "MCQ" and options:
-            try:
-                opts = json.loads(options) if isinstance(options, str) else options
-            except Exception:
-                opts = []
-            letters = ["A","B","C","D","E","F"]
-            for i2, opt in enumerate(list(opts)[:6]):
-                doc.add_paragraph(f"{letters[i2]}. {opt}")
-        else:
-            doc.add_paragraph("........................................................................")
-        doc.add_paragraph("")
+def _exam_add_item(doc, it: dict) -> None:
+    qno = int(it.get("qno",0))
+    pts = it.get("points", 0)
+    stem = (it.get("stem","") or "").strip()
+    qtype = (it.get("qtype","") or "").upper()
+    options = it.get("options","")
+
+    p = doc.add_paragraph()
+    p.add_run(f"Câu {qno}. ").bold = True
+    p.add_run(f"({pts:g} điểm) ")
+    p.add_run(stem if stem else "[Chưa có nội dung câu]")
+
+    if qtype == "MCQ" and options:
+        try:
+            opts = json.loads(options) if isinstance(options, str) else options
+        except Exception:
+            opts = []
+        letters = ["A","B","C","D","E","F"]
+        for i2, opt in enumerate(list(opts)[:6]):
+            doc.add_paragraph(f"{letters[i2]}. {opt}")
+    else:
+        doc.add_paragraph("........................................................................")
+    doc.add_paragraph("")
+
+def _key_start(title: str, n_rows: int):
+    doc = _new_document()
+    p = doc.add_paragraph(f"ĐÁP ÁN VÀ HƯỚNG DẪN CHẤM — {title}")
+    p.runs[0].bold = True
+    table = doc.add_table(rows=1 + n_rows, cols=len(KEY_HEADERS))
+    table.style = "Table Grid"
+    for c, h in enumerate(KEY_HEADERS):
+        table.cell(0, c).text = h
+    return doc, table
+
+def _key_fill_row(tr, it: dict) -> None:
+    vals = [
+        str(int(it.get("qno",0))),
+        str(it.get("qtype","") or ""),
+        f"M{it.get('level','')}",
+        f"{float(it.get('points',0) or 0):g}",
+        str(it.get("answer","") or ""),
+        str(it.get("marking_guide","") or ""),
+    ]
+    for tc, v in zip(tr.tc_lst, vals):
+        tc.clear_content()
+        tc.add_p().add_r().text = v
+
+@timed("export.exam")
+def export_exam_docx(title: str, total_points: float, items: List[dict], use_cache: bool = True) -> bytes:
+    """Đề .docx as bytes (nothing is written to disk)."""
+    key = _content_key("exam", title, float(total_points), items)
+    return _cached(key, lambda: _build_exam(title, total_points, items), use_cache)
+
+def _build_exam(title: str, total_points: float, items: List[dict]) -> bytes:
+    doc = _exam_start(title, total_points)
+    for it in _sorted_items(items):
+        _exam_add_item(doc, it)
+    return _to_bytes(doc)
+
+@timed("export.answer_key")
+def export_answer_key_docx(title: str, items: List[dict], use_cache: bool = True) -> bytes:
+    """Đáp án + hướng dẫn chấm .docx as bytes."""
+    key = _content_key("key", title, items)
+    return _cached(key, lambda: _build_answer_key(title, items), use_cache)
+
+def _build_answer_key(title: str, items: List[dict]) -> bytes:
+    rows = _sorted_items(items)
+    doc, table = _key_start(title, len(rows))
+    for tr, it in zip(table._tbl.tr_lst[1:], rows):
+        _key_fill_row(tr, it)
+    return _to_bytes(doc)
 
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    doc.save(output_path)
-    return output_path
+# ================= Combined export (one pass) =================
+@dataclass
+class ExportBundle:
+    exam: bytes
+    answer_key: bytes
+    spec: Optional[bytes] = None
+
+    def files(self, prefix: str = "") -> List[Tuple[str, bytes]]:
+        out = [(f"{prefix}De.docx", self.exam), (f"{prefix}Dap_an.docx", self.answer_key)]
+        if self.spec is not None:
+            out.append((f"{prefix}Bang_dac_ta.docx", self.spec))
+        return out
+
+    def to_zip(self) -> bytes:
+        buf = BytesIO()
+        with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for arc, data in self.files():
+                zf.writestr(arc, data)
+        return buf.getvalue()
+
+_bundles: "OrderedDict[str, ExportBundle]" = OrderedDict()
+
+@timed("export.bundle")
+def export_bundle(title: str, total_points: float, items: List[dict], matrix: Optional[MatrixTemplate] = None,
+                  spec_template_path: Optional[str] = None, use_cache: bool = True) -> ExportBundle:
+    """Exam + answer key (+ spec when a matrix and spec template are given) from one walk over `items`.
+
+    Items are sorted once; each item is written to the exam and its key row in the same step.
+    The spec reuses the compiled SpecTemplate and gets the same sorted list.
+    """
+    with_spec = bool(spec_template_path) and matrix is not None
+    spec_sig = None
+    if with_spec:
+        st_ = os.stat(spec_template_path)
+        spec_sig = (spec_template_path, st_.st_mtime_ns, st_.st_size, repr(matrix))
+    key = _content_key("bundle", title, float(total_points), items, spec_sig)
+
+    def build() -> ExportBundle:
+        rows = _sorted_items(items)
+        exam = _exam_start(title, total_points)
+        key_doc, table = _key_start(title, len(rows))
+        for tr, it in zip(table._tbl.tr_lst[1:], rows):
+            _exam_add_item(exam, it)
+            _key_fill_row(tr, it)
+        spec = get_spec_template(spec_template_path).render(matrix, rows) if with_spec else None
+        return ExportBundle(exam=_to_bytes(exam), answer_key=_to_bytes(key_doc), spec=spec)
+
+    if not use_cache:
+        return build()
+    with _cache_lock:
+        hit = _bundles.get(key)
+        if hit is not None:
+            _bundles.move_to_end(key)
+            return hit
+    out = build()
+    with _cache_lock:
+        _bundles[key] = out
+        while len(_bundles) > _CACHE_MAX // 4:
+            _bundles.popitem(last=False)
+    return out
+
+# ================= Bulk export (ZIP) =================
+@dataclass
+class ExportJob:
+    name: str                       # folder name inside the ZIP, e.g. "Lop3_Tin_HK1_CKI_MaDe101"
+    title: str
+    matrix: Optional[MatrixTemplate]
+    items: List[dict]
+    total_points: float = 10.0
+
+def _render_job(job: ExportJob, spec_template_path: Optional[str]) -> List[Tuple[str, bytes]]:
+    """Worker: exam + answer key (+ spec) for one job, built in one pass."""
+    b = export_bundle(job.title, job.total_points, job.items, job.matrix, spec_template_path, use_cache=False)
+    return b.files(prefix=f"{job.name}/")
+
+@timed("export.bulk_zip")
+def export_bulk_zip(jobs: List[ExportJob], spec_template_path: Optional[str] = None,
+                    workers: Optional[int] = None, out: Optional[BinaryIO] = None) -> Optional[bytes]:
+    """Render many jobs in worker processes and stream the documents into one ZIP.
+
+    Writes to `out` (file-like) if given, otherwise returns the ZIP bytes. The pool is forked
+    per call, which suits the CLI and benchmarks; a long-running server passes workers=1.
+    """
+    target = out if out is not None else BytesIO()
+    workers = min(workers or os.cpu_count() or 1, max(1, len(jobs)))
+    with zipfile.ZipFile(target, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        if workers <= 1:
+            for job in jobs:
+                for arc, data in _render_job(job, spec_template_path):
+                    zf.writestr(arc, data)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as ex:
+                futs = [ex.submit(_render_job, job, spec_template_path) for job in jobs]
+                for fut in as_completed(futs):
+                    for arc, data in fut.result():
+                        zf.writestr(arc, data)
+    return None if out is not None else target.getvalue()
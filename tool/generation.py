@@ -1,12 +1,15 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from typing import Dict, List, Optional, Tuple
+import json
 import random
 import pandas as pd
 
 from .utils import QTYPE_ORDER, LEVEL_ORDER
 from .matrix_template import MatrixTemplate
 from .question_bank import Bank
+from .profiling import timed
+from .prompts import Prompt, question_prompt
 
 @dataclass
 class DraftItem:
@@ -19,6 +22,9 @@ class DraftItem:
     points: float
     question_id: Optional[str] = None
     stem: str = ""
+    options: str = ""
+    answer: str = ""
+    marking_guide: str = ""
 
 def build_slots_from_matrix(matrix: MatrixTemplate, points_per_qtype: Dict[str,float]) -> List[DraftItem]:
     items: List[DraftItem] = []
@@ -61,6 +67,7 @@ def _pick_question(df: pd.DataFrame, topic: str, lesson: str, yccd: str, qtype:
             return sub.loc[idx]
     return None
 
+@timed("bank.assign_auto")
 def assign_auto(items: List[DraftItem], bank: Bank, grade: int, subject: str, semester: str, seed: int = 42) -> Tuple[List[DraftItem], List[str]]:
     df = bank.filtered(grade, subject, semester)
     rng = random.Random(seed)
@@ -75,6 +82,25 @@ def assign_auto(items: List[DraftItem], bank: Bank, grade: int, subject: str, se
             continue
         it.question_id = str(row.get("question_id",""))
         it.stem = str(row.get("stem",""))
+        it.options = str(row.get("options",""))
+        it.answer = str(row.get("answer",""))
+        it.marking_guide = str(row.get("marking_guide",""))
         it.yccd = it.yccd or str(row.get("yccd",""))
         used_ids.add(it.question_id)
     return items, warnings
+
+def build_question_prompt(grade, subject: str, semester: str, topic: str, lesson: str, yccd: str,
+                          qtype: str, level: int, points: float) -> Prompt:
+    """Stable system prefix + slot suffix (see tool/prompts.py); pass straight to ai_generate."""
+    return question_prompt(grade, subject, semester, topic, lesson, yccd, qtype, level, points)
+
+def parse_ai_question(txt: str) -> Dict[str, str]:
+    """Parse the JSON answer of an AI call into stem/options/answer/marking_guide strings."""
+    obj = json.loads(txt)
+    opts = obj.get("options", [])
+    return {
+        "stem": obj.get("stem",""),
+        "options": json.dumps(opts, ensure_ascii=False) if isinstance(opts, list) else str(opts),
+        "answer": obj.get("answer",""),
+        "marking_guide": obj.get("marking_guide",""),
+    }
@@ -1,8 +1,9 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from typing import Dict, List, Tuple, Optional
-import openpyxl
-from .utils import safe_int
+import pandas as pd
+from .utils import safe_int, QTYPE_ORDER, LEVEL_ORDER, qtype_level_label
+from .profiling import timed
 
 @dataclass
 class LessonRow:
@@ -31,11 +32,13 @@ QTYPE_COLS = {
     "ESSAY": ("S","T","U"),
 }
 
-def load_matrix_template(xlsx_path: str, total_points: float = 10.0) -> MatrixTemplate:
-    wb = openpyxl.load_workbook(xlsx_path, data_only=False)
-    ws = wb["ma trận"] if "ma trận" in wb.sheetnames else wb[wb.sheetnames[0]]
-    title = str(ws["C2"].value or "MA TRẬN").strip()
+QTYPE_COL_RANGE = (7, 21)  # G:U, 1-based
+DATA_START_ROW = 7
+
+def _is_formula(v) -> bool:
+    return isinstance(v, str) and v.startswith("=")
 
+def _meta_from_title(title: str) -> Tuple[Optional[int], Optional[str], Optional[str]]:
     grade = None; subject = None; semester = None
     t = title.upper()
     for g in range(1, 6):
@@ -44,42 +47,75 @@ def load_matrix_template(xlsx_path: str, total_points: float = 10.0) -> MatrixTe
     if "TIN" in t: subject = "Tin"
     if "HK1" in t or "HỌC KÌ I" in t or "HKI" in t: semester = "HK1"
     if "HK2" in t or "HỌC KÌ II" in t or "HKII" in t: semester = "HK2"
+    return grade, subject, semester
 
-    start_row = 7
-    end_row = None
-    for r in range(start_row, ws.max_row + 1):
-        a = ws.cell(r, 1).value
-        if isinstance(a, str) and "Tổng số câu" in a:
-            end_row = r - 1
-            break
-    end_row = end_row or ws.max_row
+def _read_rows(xlsx_path: str, data_only: bool) -> Tuple[str, List[tuple]]:
+    """Title (C2) + rows A:U from row DATA_START_ROW up to the "Tổng số câu" row, in one read-only pass."""
+    import openpyxl  # deferred: only needed when a template is actually read
+    wb = openpyxl.load_workbook(xlsx_path, read_only=True, data_only=data_only)
+    try:
+        ws = wb["ma trận"] if "ma trận" in wb.sheetnames else wb[wb.sheetnames[0]]
+        title = None
+        rows: List[tuple] = []
+        for r, vals in enumerate(ws.iter_rows(min_row=1, max_col=QTYPE_COL_RANGE[1], values_only=True), start=1):
+            if r == 2:
+                title = vals[2] if len(vals) > 2 else None
+            if r < DATA_START_ROW:
+                continue
+            a = vals[0] if vals else None
+            if isinstance(a, str) and "Tổng số câu" in a:
+                break
+            rows.append(tuple(vals) + (None,) * (QTYPE_COL_RANGE[1] - len(vals)))
+    finally:
+        wb.close()
+    return str(title or "MA TRẬN").strip(), rows
 
-    total_periods = 0
-    for r in range(start_row, end_row + 1):
-        total_periods += safe_int(ws.cell(r, 4).value, 0)
+@timed("template.load")
+def load_matrix_template(xlsx_path: str, total_points: float = 10.0) -> MatrixTemplate:
+    title, rows = _read_rows(xlsx_path, data_only=False)
 
-    lessons: List[LessonRow] = []
-    current_topic = ""
-    for r in range(start_row, end_row + 1):
-        tt = ws.cell(r, 1).value
+    # cells driven by formulas (TT, periods or counts): use the values cached by Excel
+    needed = [0, 3] + list(range(QTYPE_COL_RANGE[0] - 1, QTYPE_COL_RANGE[1]))
+    if any(_is_formula(row[i]) for row in rows for i in needed):
+        _, cached = _read_rows(xlsx_path, data_only=True)
+        rows = [
+            tuple(c[i] if _is_formula(v) and i < len(c) else v for i, v in enumerate(row))
+            for row, c in zip(rows, cached)
+        ]
+
+    grade, subject, semester = _meta_from_title(title)
+
+    # single pass: keep lesson rows and the period total together
+    total_periods = 0
+    parsed = []
+    for row in rows:
+        periods = safe_int(row[3], 0)
+        total_periods += periods
+        tt = row[0]
         if tt is None:
             continue
         try:
             tt_int = int(tt)
         except Exception:
             continue
-        topic = ws.cell(r, 2).value
+        parsed.append((tt_int, row, periods))
+
+    lessons: List[LessonRow] = []
+    current_topic = ""
+    for tt_int, row, periods in parsed:
+        topic = row[1]
         if topic:
             current_topic = str(topic).strip()
-        lesson = str(ws.cell(r, 3).value or "").strip()
-        periods = safe_int(ws.cell(r, 4).value, 0)
+        lesson = str(row[2] or "").strip()
         ratio = (periods / total_periods * 100.0) if total_periods else 0.0
         points_target = float(total_points) * ratio / 100.0
 
         counts: Dict[Tuple[str, int], int] = {}
-        for qtype, cols in QTYPE_COLS.items():
-            for level, col_letter in zip([1, 2, 3], cols):
-                counts[(qtype, level)] = safe_int(ws[f"{col_letter}{r}"].value, 0)
+        col = QTYPE_COL_RANGE[0] - 1
+        for qtype in QTYPE_COLS:
+            for level in (1, 2, 3):
+                counts[(qtype, level)] = safe_int(row[col], 0)
+                col += 1
 
         lessons.append(LessonRow(
             tt=tt_int, topic=current_topic, lesson=lesson, periods=periods,
@@ -90,3 +126,41 @@ def load_matrix_template(xlsx_path: str, total_points: float = 10.0) -> MatrixTe
         title=title, grade=grade, subject=subject, semester=semester,
         lessons=lessons, total_points=float(total_points)
     )
+
+def matrix_to_editor_df(mx: MatrixTemplate) -> pd.DataFrame:
+    rows = []
+    for lr in mx.lessons:
+        r = {
+            "TT": lr.tt,
+            "Chủ đề": lr.topic,
+            "Bài": lr.lesson,
+            "Số tiết": lr.periods,
+        }
+        for q in QTYPE_ORDER:
+            for lv in LEVEL_ORDER:
+                r[qtype_level_label(q, lv)] = int(lr.counts.get((q, lv), 0))
+        rows.append(r)
+    return pd.DataFrame(rows)
+
+def editor_df_to_matrix(mx: MatrixTemplate, df_ed: pd.DataFrame) -> MatrixTemplate:
+    # apply edited counts back to matrix in-memory (do not write file)
+    lookup = {int(r.tt): r for r in mx.lessons}
+    # rows in lesson order -> match by position (templates may repeat TT values)
+    by_pos = len(df_ed) == len(mx.lessons)
+    for pos, (_, row) in enumerate(df_ed.iterrows()):
+        try:
+            tt = int(row.get("TT"))
+        except Exception:
+            continue
+        lr = mx.lessons[pos] if by_pos and int(mx.lessons[pos].tt) == tt else lookup.get(tt)
+        if not lr:
+            continue
+        for q in QTYPE_ORDER:
+            for lv in LEVEL_ORDER:
+                col = qtype_level_label(q, lv)
+                v = row.get(col, 0)
+                try:
+                    lr.counts[(q, lv)] = int(float(v))
+                except Exception:
+                    lr.counts[(q, lv)] = 0
+    return mx
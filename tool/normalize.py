@@ -0,0 +1,87 @@
+from __future__ import annotations
+from functools import lru_cache
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+# ---- accent folding table (built once; str.translate instead of per-char category checks) ----
+def _build_fold_table() -> dict:
+    table = {}
+    for cp in list(range(0x00C0, 0x0250)) + list(range(0x1E00, 0x1F00)):
+        ch = chr(cp)
+        base = "".join(c for c in unicodedata.normalize("NFD", ch) if unicodedata.category(c) != "Mn")
+        if base != ch:
+            table[cp] = base
+    for cp in range(0x0300, 0x0370):  # stray combining marks (input already in NFD form)
+        table[cp] = None
+    table.update({ord("đ"): "d", ord("Đ"): "D"})
+    table.update({ord(c): " " for c in "-_/"})
+    return table
+
+_FOLD = _build_fold_table()
+_CACHE_SIZE = 1 << 16
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def normalize_key(s: str) -> str:
+    """Normalize Vietnamese strings for matching (remove accents, lower, collapse spaces)."""
+    s = "" if s is None else str(s)
+    return " ".join(s.translate(_FOLD).lower().split())
+
+SUBJECT_ALIASES = {
+    "tin": "Tin",
+    "tin hoc": "Tin",
+    "tinhoc": "Tin",
+    "informatique": "Tin",
+    "toan": "Toán",
+    "tieng viet": "Tiếng Việt",
+    "tiengviet": "Tiếng Việt",
+    "khoa hoc": "Khoa học",
+    "lich su dia ly": "Lịch sử - Địa lý",
+    "lich su dia li": "Lịch sử - Địa lý",
+    "lich su va dia ly": "Lịch sử - Địa lý",
+    "lich su va dia li": "Lịch sử - Địa lý",
+    "lsdl": "Lịch sử - Địa lý",
+    "ls dl": "Lịch sử - Địa lý",
+    "dao duc": "Đạo đức",
+    "cong nghe": "Công nghệ",
+    "am nhac": "Âm nhạc",
+    "mi thuat": "Mĩ thuật",
+    "my thuat": "Mĩ thuật",
+}
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def normalize_subject(s: str) -> str:
+    k = normalize_key(s)
+    return SUBJECT_ALIASES.get(k, "" if s is None else str(s).strip())
+
+_RE_TWO = re.compile(r"\b2\b")
+_RE_ONE = re.compile(r"\b1\b")
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def normalize_semester(s: str, default: str = "HK1") -> str:
+    """Map a semester label to HK1/HK2. Blank/unrecognised labels give `default`
+    (the catalog uses default="" so that blank rows stay wildcards)."""
+    k = normalize_key(s)
+    # recognize HK2 first ("hoc ki i" is a prefix of "hoc ki ii")
+    if "hk2" in k or "hkii" in k or "hoc ki ii" in k or "hoc ky ii" in k or _RE_TWO.search(k):
+        return "HK2"
+    if "hk1" in k or "hki" in k or "hoc ki i" in k or "hoc ky i" in k or _RE_ONE.search(k):
+        return "HK1"
+    # fallback: keep original if already looks like HK*
+    up = ("" if s is None else str(s)).upper().strip()
+    if up.startswith("HK"):
+        return up
+    return default
+
+def normalize_series(col: pd.Series, fn, *args) -> pd.Series:
+    """Apply `fn` to the distinct values of `col` only (factorize -> normalize -> take)."""
+    codes, uniques = pd.factorize(col.fillna("").astype(str), sort=False)
+    if len(uniques) == 0:
+        return pd.Series([], index=col.index, dtype=object)
+    mapped = np.array([fn(u, *args) for u in uniques], dtype=object)
+    return pd.Series(mapped.take(codes), index=col.index, dtype=object)
+
+def cache_info() -> dict:
+    return {f.__name__: f.cache_info()._asdict() for f in (normalize_key, normalize_subject, normalize_semester)}
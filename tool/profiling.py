@@ -0,0 +1,128 @@
+from __future__ import annotations
+from collections import deque
+from dataclasses import dataclass, asdict
+from functools import wraps
+from typing import Deque, Dict, List, Optional
+import json
+import threading
+import time
+
+RING_SIZE = 4096
+
+@dataclass
+class Span:
+    stage: str
+    start: float          # wall clock (epoch seconds)
+    duration_ms: float
+    ok: bool = True
+
+_spans: Deque[Span] = deque(maxlen=RING_SIZE)
+_totals: Dict[str, List[float]] = {}   # stage -> [count, errors, total_ms]; never evicted or reset
+_lock = threading.Lock()
+
+def record(stage: str, start: float, duration_ms: float, ok: bool = True) -> None:
+    with _lock:
+        _spans.append(Span(stage, start, duration_ms, ok))
+        tot = _totals.setdefault(stage, [0, 0, 0.0])
+        tot[0] += 1
+        tot[1] += 0 if ok else 1
+        tot[2] += duration_ms
+
+class timed:
+    """Time a block or a function into the span ring buffer.
+
+    ``with timed("export.exam"): ...`` or ``@timed("catalog.prep")``.
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._t0 = 0.0
+        self._wall = 0.0
+
+    def __enter__(self) -> "timed":
+        self._wall = time.time()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        record(self.stage, self._wall, (time.perf_counter() - self._t0) * 1000.0, ok=exc_type is None)
+        return False
+
+    def __call__(self, fn):
+        stage = self.stage
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+
+def spans(stage: Optional[str] = None) -> List[Span]:
+    with _lock:
+        out = list(_spans)
+    return [s for s in out if stage is None or s.stage == stage]
+
+def reset() -> None:
+    """Clear the span ring (the Prometheus counters keep counting)."""
+    with _lock:
+        _spans.clear()
+
+def totals() -> Dict[str, Dict[str, float]]:
+    """Per stage since process start: count, errors, total_ms (unaffected by ring eviction/reset)."""
+    with _lock:
+        return {stage: {"count": int(c), "errors": int(e), "total_ms": ms} for stage, (c, e, ms) in sorted(_totals.items())}
+
+def _percentile(sorted_vals: List[float], q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    k = (len(sorted_vals) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+def stats() -> Dict[str, Dict[str, float]]:
+    """Per stage: count, errors, p50/p95/max and total in ms (over the spans still in the ring)."""
+    by_stage: Dict[str, List[Span]] = {}
+    for s in spans():
+        by_stage.setdefault(s.stage, []).append(s)
+    out = {}
+    for stage in sorted(by_stage):
+        ss = by_stage[stage]
+        d = sorted(s.duration_ms for s in ss)
+        out[stage] = {
+            "count": len(d),
+            "errors": sum(1 for s in ss if not s.ok),
+            "p50_ms": _percentile(d, 0.50),
+            "p95_ms": _percentile(d, 0.95),
+            "max_ms": d[-1],
+            "total_ms": sum(d),
+        }
+    return out
+
+def to_jsonl() -> str:
+    return "".join(json.dumps(asdict(s), ensure_ascii=False) + "\n" for s in spans())
+
+def _label(stage: str) -> str:
+    return stage.replace("\\", "\\\\").replace('"', '\\"')
+
+def to_prometheus(prefix: str = "radethi") -> str:
+    """Prometheus text exposition: a summary per stage.
+
+    Quantiles come from the spans in the ring; _sum (seconds), _count and the error counter
+    are monotonic process totals, so rate() stays correct across ring eviction and reset().
+    """
+    name = f"{prefix}_stage_duration_seconds"
+    ring, tot_all = stats(), totals()
+    lines = [f"# HELP {name} Duration of instrumented stages.", f"# TYPE {name} summary"]
+    for stage, tot in tot_all.items():
+        lbl, st_ = _label(stage), ring.get(stage)
+        if st_:
+            lines.append(f'{name}{{stage="{lbl}",quantile="0.5"}} {st_["p50_ms"] / 1000.0:.6f}')
+            lines.append(f'{name}{{stage="{lbl}",quantile="0.95"}} {st_["p95_ms"] / 1000.0:.6f}')
+        lines.append(f'{name}_sum{{stage="{lbl}"}} {tot["total_ms"] / 1000.0:.6f}')
+        lines.append(f'{name}_count{{stage="{lbl}"}} {tot["count"]}')
+    errs = f"{prefix}_stage_errors_total"
+    lines += [f"# HELP {errs} Instrumented calls that raised.", f"# TYPE {errs} counter"]
+    for stage, tot in tot_all.items():
+        lines.append(f'{errs}{{stage="{_label(stage)}"}} {tot["errors"]}')
+    return "\n".join(lines) + "\n"
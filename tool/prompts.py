@@ -0,0 +1,155 @@
+"""Question prompts split into a stable prefix and a per-slot suffix.
+
+Providers cache prompt prefixes (OpenAI automatic prefix caching, Gemini implicit/explicit
+context caching), so everything identical across calls — role, CTGDPT 2018/TT27 rules,
+JSON schema, one example per question type — lives in `SYSTEM_PREFIX`, sent first as the
+system message. Only the slot (lớp, môn, bài, YCCĐ, dạng, mức, điểm) goes into the suffix.
+Keep `SYSTEM_PREFIX` byte-identical between calls: any edit invalidates provider caches.
+Both caches only start at 1,024 prompt tokens (Gemini 2.5 Pro: 4,096), so the prefix also
+carries per-subject guidance, a self-check list and examples from several subjects to stay
+above that; `tests/test_prompts.py` guards the size.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+from typing import NamedTuple
+
+from .utils import LEVEL_NAME
+
+CACHE_MIN_TOKENS = 1024   # OpenAI automatic prefix caching, Gemini 2.5 Flash context caching
+
+class Prompt(NamedTuple):
+    system: str   # stable prefix, identical for every question
+    user: str     # slot-specific suffix
+
+    def __str__(self) -> str:
+        return f"{self.system}\n\n{self.user}"
+
+_EXAMPLES = {
+    "MCQ": {"stem": "Thiết bị nào dùng để gõ chữ vào máy tính?",
+            "options": ["Bàn phím", "Loa", "Màn hình", "Máy in"], "answer": "A",
+            "marking_guide": "Chọn A được trọn điểm."},
+    "TF": {"stem": "Đúng ghi Đ, sai ghi S: a) Chuột dùng để điều khiển con trỏ. b) Loa dùng để nhập chữ.",
+           "options": [], "answer": "a) Đ; b) S",
+           "marking_guide": "Mỗi ý đúng được một nửa số điểm."},
+    "MATCH": {"stem": "Nối thiết bị ở cột A với công dụng ở cột B: 1) Bàn phím 2) Loa 3) Màn hình — a) hiển thị hình ảnh b) phát âm thanh c) gõ chữ.",
+              "options": [], "answer": "1-c; 2-b; 3-a",
+              "marking_guide": "Mỗi cặp nối đúng được một phần ba số điểm."},
+    "FILL": {"stem": "Điền từ thích hợp vào chỗ trống: Khi ngồi trước máy tính, mắt cách màn hình khoảng ...... cm.",
+             "options": [], "answer": "50 – 80",
+             "marking_guide": "Điền đúng khoảng cách được trọn điểm."},
+    "ESSAY": {"stem": "Em hãy nêu hai việc nên làm để bảo vệ mắt khi sử dụng máy tính.",
+              "options": [], "answer": "(gợi ý) Ngồi đúng tư thế; nghỉ mắt sau mỗi 30 phút.",
+              "marking_guide": "Nêu đúng mỗi việc được một nửa số điểm; diễn đạt rõ ràng."},
+}
+
+# more examples across subjects/grades: they help the model and keep the prefix cacheable
+_MORE_EXAMPLES = [
+    ("Toán lớp 3", "MCQ", {"stem": "Số liền sau của 4 999 là số nào?",
+                          "options": ["4 998", "5 000", "5 999", "4 990"], "answer": "B",
+                          "marking_guide": "Chọn B được trọn điểm."}),
+    ("Toán lớp 4", "ESSAY", {"stem": "Một cửa hàng có 3 thùng sách, mỗi thùng 24 quyển. Cửa hàng đã bán 28 quyển. Hỏi cửa hàng còn lại bao nhiêu quyển sách?",
+                             "options": [], "answer": "Số sách có: 24 × 3 = 72 (quyển); còn lại: 72 − 28 = 44 (quyển). Đáp số: 44 quyển sách.",
+                             "marking_guide": "Phép tính số sách có được một nửa số điểm; phép tính còn lại và đáp số được một nửa số điểm."}),
+    ("Tiếng Việt lớp 3", "FILL", {"stem": "Điền từ chỉ đặc điểm thích hợp vào chỗ trống: Bầu trời mùa thu ...... và cao.",
+                                  "options": [], "answer": "xanh (trong xanh, trong vắt)",
+                                  "marking_guide": "Điền một từ chỉ đặc điểm hợp lí được trọn điểm."}),
+    ("Tiếng Việt lớp 5", "TF", {"stem": "Đúng ghi Đ, sai ghi S: a) \"Chăm chỉ\" và \"siêng năng\" là hai từ đồng nghĩa. b) \"Cao\" và \"thấp\" là hai từ đồng nghĩa.",
+                                "options": [], "answer": "a) Đ; b) S",
+                                "marking_guide": "Mỗi ý đúng được một nửa số điểm."}),
+    ("Khoa học lớp 4", "MATCH", {"stem": "Nối chất ở cột A với trạng thái thường gặp ở cột B: 1) Nước đá 2) Hơi nước 3) Nước uống — a) lỏng b) rắn c) khí.",
+                                 "options": [], "answer": "1-b; 2-c; 3-a",
+                                 "marking_guide": "Mỗi cặp nối đúng được một phần ba số điểm."}),
+    ("Lịch sử và Địa lí lớp 4", "MCQ", {"stem": "Đồng bằng Bắc Bộ do những con sông nào bồi đắp nên?",
+                                        "options": ["Sông Hồng và sông Thái Bình", "Sông Tiền và sông Hậu", "Sông Đà và sông Mã", "Sông Cả và sông Gianh"],
+                                        "answer": "A", "marking_guide": "Chọn A được trọn điểm."}),
+]
+
+_SUBJECT_HINTS = {
+    "Toán": "số liệu gần gũi (đồ dùng học tập, cây trồng, tiền Việt Nam), kết quả là số đẹp, đơn vị đo đúng chương trình lớp; bài toán có lời văn ghi rõ câu hỏi, đáp án trình bày lời giải – phép tính – đáp số.",
+    "Tiếng Việt": "ngữ liệu ngắn, trong sáng, đúng chính tả; câu hỏi đọc hiểu bám vào văn bản đã cho trong đề; câu hỏi luyện từ và câu dùng đúng thuật ngữ của lớp (từ chỉ sự vật, hoạt động, đặc điểm; câu kể, câu hỏi...).",
+    "Tin học": "thao tác và thiết bị học sinh đã thực hành (chuột, bàn phím, thư mục, phần mềm soạn thảo, trình chiếu, Scratch); nhắc quy tắc an toàn khi dùng máy tính và Internet khi phù hợp.",
+    "Khoa học": "hiện tượng quan sát được hằng ngày (nước, không khí, ánh sáng, âm thanh, thực vật, động vật, cơ thể người); không yêu cầu công thức hay số liệu học sinh chưa học.",
+    "Lịch sử và Địa lí": "nhân vật, sự kiện, địa danh đúng nội dung bài; mốc thời gian chỉ hỏi khi bài có nêu; câu vận dụng gắn với quê hương, địa phương của học sinh.",
+    "Tự nhiên và Xã hội": "tình huống trong gia đình, trường học, cộng đồng; câu hỏi về sức khoẻ và an toàn nêu hành vi cụ thể, dễ nhận biết đúng – sai.",
+    "Đạo đức": "tình huống ứng xử gần gũi, có một cách ứng xử đúng rõ ràng; tránh phán xét con người, không dùng tên thật của học sinh hay thầy cô.",
+    "Công nghệ": "đồ dùng, vật liệu, quy trình làm sản phẩm đơn giản trong bài; nhắc an toàn khi dùng dụng cụ.",
+    "Tiếng Anh": "từ vựng và mẫu câu đúng bài (Unit); câu dẫn có thể viết bằng tiếng Việt ngắn gọn, phần ngữ liệu viết bằng tiếng Anh.",
+}
+
+_SELF_CHECK = [
+    "Câu hỏi đo đúng YCCĐ đã cho, không đo YCCĐ khác.",
+    "Mức độ đúng như yêu cầu: M1 hỏi điều đã học, M2 cần hiểu để trả lời, M3 là tình huống mới.",
+    "Đáp án đúng duy nhất (trắc nghiệm) hoặc đáp án gợi ý đủ ý (tự luận); các phương án nhiễu hợp lí, cùng loại, độ dài tương đương.",
+    "Không dùng phủ định kép, không có phương án \"tất cả các ý trên\" hay \"cả A và B\".",
+    "Số liệu, tên riêng, sự kiện chính xác; không bịa đặt nội dung ngoài sách giáo khoa.",
+    "Hướng dẫn chấm chia điểm khớp với số điểm của câu, theo bước 0,25 điểm.",
+    "Độ dài phù hợp thời gian làm bài: câu M1 đọc và làm trong khoảng 1 phút, câu tự luận M3 khoảng 5 phút.",
+    "JSON hợp lệ: dùng dấu ngoặc kép, không có dấu phẩy thừa, không xuống dòng trong chuỗi.",
+]
+
+_QTYPE_RULES = {
+    "MCQ": "Trắc nghiệm 4 lựa chọn: đúng 4 phương án trong \"options\", chỉ 1 phương án đúng; \"answer\" là một chữ cái A/B/C/D.",
+    "TF": "Đúng/Sai: nêu 2–4 ý a), b), ... trong \"stem\"; \"options\" = []; \"answer\" ghi Đ/S cho từng ý.",
+    "MATCH": "Nối cột: 3–4 cặp trong \"stem\"; \"options\" = []; \"answer\" liệt kê các cặp nối đúng.",
+    "FILL": "Điền khuyết: chỗ trống viết \"......\"; \"options\" = []; \"answer\" là từ/cụm từ cần điền.",
+    "ESSAY": "Tự luận: câu hỏi mở ngắn; \"options\" = []; \"answer\" là đáp án gợi ý.",
+}
+
+def _build_prefix() -> str:
+    lines = [
+        "Bạn là chuyên gia ra đề kiểm tra định kì cấp tiểu học theo Chương trình GDPT 2018 và Thông tư 27/2020/TT-BGDĐT.",
+        "Mỗi yêu cầu là một câu hỏi cho một vị trí trong ma trận đề: lớp, môn, học kì, chủ đề, bài học, YCCĐ, dạng câu, mức độ và điểm.",
+        "",
+        "QUY TẮC:",
+        "- Câu hỏi bám sát YCCĐ và nội dung bài học đã cho; không dùng kiến thức ngoài chương trình của lớp.",
+        "- Đúng mức độ TT27 được yêu cầu, không nhảy mức:",
+        f"  + {LEVEL_NAME[1]}: nhận biết, nhắc lại kiến thức đã học.",
+        f"  + {LEVEL_NAME[2]}: hiểu, giải thích, so sánh, trình bày theo cách hiểu của mình.",
+        f"  + {LEVEL_NAME[3]}: vận dụng vào tình huống mới, giải quyết vấn đề thực tế gần gũi.",
+        "- Ngôn ngữ tiếng Việt chuẩn, ngắn gọn, phù hợp lứa tuổi; không đánh đố, không gây hiểu lầm.",
+        "- Hướng dẫn chấm khớp với số điểm của câu.",
+        "- Lớp 1–2: câu rất ngắn, từ ngữ quen thuộc; lớp 3: câu ngắn, một yêu cầu; lớp 4–5: có thể có ngữ liệu hoặc tình huống ngắn, tối đa hai yêu cầu nhỏ.",
+        "- Không dùng hình ảnh, bảng biểu hay âm thanh mà đề không thể in kèm; nếu cần, mô tả bằng lời trong \"stem\".",
+        "- Không nhắc đến AI, không giải thích cách ra đề, không thêm lời chào.",
+        "",
+        "DẠNG CÂU:",
+        *(f"- {q}: {rule}" for q, rule in _QTYPE_RULES.items()),
+        "",
+        "GỢI Ý THEO MÔN:",
+        *(f"- {subj}: {hint}" for subj, hint in _SUBJECT_HINTS.items()),
+        "- Môn khác: bám sát nội dung bài học và YCCĐ, dùng ví dụ gần gũi với học sinh tiểu học.",
+        "",
+        "TỰ KIỂM TRA TRƯỚC KHI TRẢ LỜI:",
+        *(f"{i}. {line}" for i, line in enumerate(_SELF_CHECK, start=1)),
+        "",
+        "ĐẦU RA: chỉ một đối tượng JSON, không thêm chữ hay markdown, đúng cấu trúc:",
+        '{"stem":"...","options":["A...","B...","C...","D..."],"answer":"A","marking_guide":"..."}',
+        "Nếu không phải MCQ thì options = [] .",
+        "",
+        "VÍ DỤ (Tin học lớp 3):",
+        *(f"- {q}: {json.dumps(ex, ensure_ascii=False)}" for q, ex in _EXAMPLES.items()),
+        "",
+        "VÍ DỤ (môn khác):",
+        *(f"- {where}, {q}: {json.dumps(ex, ensure_ascii=False)}" for where, q, ex in _MORE_EXAMPLES),
+    ]
+    return "\n".join(lines)
+
+SYSTEM_PREFIX = _build_prefix()
+PREFIX_HASH = hashlib.sha1(SYSTEM_PREFIX.encode("utf-8")).hexdigest()[:12]
+
+def question_prompt(grade, subject: str, semester: str, topic: str, lesson: str, yccd: str,
+                    qtype: str, level: int, points: float) -> Prompt:
+    """Prompt for one slot; session-level fields first so consecutive calls share more prefix."""
+    lvl_name = LEVEL_NAME.get(int(level), f"M{level}")
+    return Prompt(SYSTEM_PREFIX, f"""Hãy tạo 01 câu hỏi.
+Lớp: {grade}
+Môn: {subject}
+Học kì: {semester}
+Chủ đề: {topic}
+Bài học: {lesson}
+YCCĐ: {yccd or '(tổng hợp)'}
+Dạng: {qtype}
+Mức độ (TT27): {lvl_name}
+Điểm: {points}""")
@@ -3,7 +3,8 @@ from dataclasses import dataclass
 from typing import List, Tuple
 import json
 import pandas as pd
-from .utils import normalize_subject, normalize_semester
+from .normalize import normalize_subject, normalize_semester, normalize_series
+from .profiling import timed
 
 REQUIRED_COLS = [
     "question_id","grade","subject","semester","topic","lesson","yccd",
@@ -24,6 +25,10 @@ class Bank:
             if col in df.columns:
                 df[col] = df[col].fillna("").astype(str)
         df["qtype"] = df["qtype"].str.upper().str.strip()
+        if "subject" in df.columns:
+            df["subject"] = normalize_series(df["subject"], normalize_subject)
+        if "semester" in df.columns:
+            df["semester"] = normalize_series(df["semester"], normalize_semester, "")
         return Bank(df=df)
 
     def validate(self) -> Tuple[bool, List[str]]:
@@ -52,6 +57,7 @@ class Bank:
                 break
         return (len(errs)==0), errs
 
+    @timed("bank.filter")
     def filtered(self, grade: int, subject: str, semester: str) -> pd.DataFrame:
         df = self.df
         return df[
@@ -60,14 +66,20 @@ class Bank:
             (df["semester"].str.lower()==str(semester).lower())
         ].copy()
 
-def load_bank_from_upload(uploaded_file) -> Bank:
-    name = uploaded_file.name.lower()
+def _read_bank_df(source, name: str) -> pd.DataFrame:
+    name = name.lower()
     if name.endswith(".csv"):
-        df = pd.read_csv(uploaded_file)
+        df = pd.read_csv(source)
     elif name.endswith(".xlsx") or name.endswith(".xls"):
-        df = pd.read_excel(uploaded_file)
+        df = pd.read_excel(source)
     else:
         raise ValueError("Chỉ hỗ trợ CSV hoặc XLSX")
     if "marking_guide" not in df.columns:
         df["marking_guide"] = ""
-    return Bank(df=df).normalize()
+    return df
+
+def load_bank_from_path(path: str) -> Bank:
+    return Bank(df=_read_bank_df(path, path)).normalize()
+
+def load_bank_from_upload(uploaded_file) -> Bank:
+    return Bank(df=_read_bank_df(uploaded_file, uploaded_file.name)).normalize()
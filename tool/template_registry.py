@@ -0,0 +1,128 @@
+from __future__ import annotations
+from copy import deepcopy
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import os
+import threading
+import time
+
+from .matrix_template import MatrixTemplate, load_matrix_template
+from .normalize import normalize_subject, normalize_semester
+
+@dataclass
+class TemplateEntry:
+    path: str
+    size: int
+    mtime_ns: int
+    sha1: str
+    template: Optional[MatrixTemplate]
+    error: str = ""
+
+def _sha1(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _rescaled(mx: MatrixTemplate, total_points: float) -> MatrixTemplate:
+    """Independent copy of a cached template for a given total (callers mutate `counts`)."""
+    out = deepcopy(mx)
+    out.total_points = float(total_points)
+    for lr in out.lessons:
+        lr.points_target = float(total_points) * lr.ratio_pct / 100.0
+    return out
+
+class TemplateRegistry:
+    """Matrix templates in a folder, each parsed once per (path, mtime, sha1).
+
+    `best()` answers "best template for grade/subject/semester" from in-memory metadata;
+    `get()` hands out a private copy of the parsed template. The folder is re-scanned
+    (stat only) at most every `scan_interval` seconds.
+    """
+
+    def __init__(self, template_dir: str, scan_interval: float = 5.0):
+        self.template_dir = template_dir
+        self.scan_interval = scan_interval
+        self._entries: Dict[str, TemplateEntry] = {}
+        self._best: Dict[Tuple[int, str, str], Optional[str]] = {}
+        self._scanned_at = 0.0
+        self._lock = threading.RLock()
+
+    def refresh(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._scanned_at < self.scan_interval:
+            return
+        with self._lock:
+            entries: Dict[str, TemplateEntry] = {}
+            names = sorted(f for f in os.listdir(self.template_dir) if f.lower().endswith(".xlsx")) \
+                if os.path.isdir(self.template_dir) else []
+            for name in names:
+                p = os.path.join(self.template_dir, name)
+                try:
+                    st_ = os.stat(p)
+                except OSError:
+                    continue
+                prev = self._entries.get(p)
+                if prev and prev.size == st_.st_size and prev.mtime_ns == st_.st_mtime_ns:
+                    entries[p] = prev
+                    continue
+                digest = _sha1(p)
+                if prev and prev.sha1 == digest:
+                    prev.size, prev.mtime_ns = st_.st_size, st_.st_mtime_ns
+                    entries[p] = prev
+                    continue
+                try:
+                    entries[p] = TemplateEntry(p, st_.st_size, st_.st_mtime_ns, digest, load_matrix_template(p, total_points=10.0))
+                except Exception as e:
+                    entries[p] = TemplateEntry(p, st_.st_size, st_.st_mtime_ns, digest, None, error=str(e))
+            if list(entries) != list(self._entries) or any(entries[p] is not self._entries.get(p) for p in entries):
+                self._best = {}
+            self._entries = entries
+            self._scanned_at = now
+
+    def paths(self) -> List[str]:
+        self.refresh()
+        return list(self._entries)
+
+    def errors(self) -> Dict[str, str]:
+        self.refresh()
+        return {os.path.basename(p): e.error for p, e in self._entries.items() if e.error}
+
+    def best(self, grade: int, subject: str, semester: str) -> Optional[str]:
+        self.refresh()
+        key = (int(grade), normalize_subject(subject).lower(), normalize_semester(semester).upper())
+        if key in self._best:
+            return self._best[key]
+        with self._lock:
+            best = None
+            best_score = -1
+            for p, e in self._entries.items():
+                mx = e.template
+                if mx is None:
+                    continue
+                score = 0
+                if mx.grade == key[0]:
+                    score += 3
+                if (mx.subject or "").lower() == key[1]:
+                    score += 3
+                if (mx.semester or "").upper() == key[2]:
+                    score += 2
+                if score > best_score:
+                    best_score = score
+                    best = p
+            self._best[key] = best
+        return best
+
+    def get(self, path: str, total_points: float = 10.0) -> MatrixTemplate:
+        self.refresh()
+        e = self._entries.get(path)
+        if e is None:
+            self.refresh(force=True)
+            e = self._entries.get(path)
+        if e is None:
+            return load_matrix_template(path, total_points=total_points)
+        if e.template is None:
+            raise ValueError(e.error)
+        return _rescaled(e.template, total_points)